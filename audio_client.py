@@ -1,12 +1,44 @@
 """
 Audio Calling Module
-Handles audio capture and UDP streaming using SoundDevice
+Handles audio capture and UDP streaming using SoundDevice, 1:1 or in a conference
 """
 import socket
 import threading
+import time
 import sounddevice as sd
 import numpy as np
-from typing import Optional
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+import audio_codec
+from audio_codec import CODEC_NAMES, CODEC_PCM, create_codec
+from audio_mixer import AudioMixer
+from audio_stream import AUDIO_HEADER, MAX_DATAGRAM, PKT_AUDIO, AudioJitterBuffer, AudioPacketizer, SampleRing
+from voice_activity import CN_HEADER, PKT_COMFORT_NOISE, ComfortNoise, VoiceActivityDetector
+
+
+class _RemoteSource:
+    """Receive state for one participant (or the mixer we hear everyone through)"""
+
+    def __init__(self, address: tuple, sample_rate: int, min_delay: float, max_delay: float):
+        self.address = address
+        self.jitter_buffer = AudioJitterBuffer(sample_rate, min_delay, max_delay)
+        self.comfort_noise = ComfortNoise(sample_rate)
+        self.jitter_buffer.comfort_noise = self.comfort_noise
+        self.decoders: Dict[int, object] = {}  # payload type -> decoder (None if unsupported)
+        self.last_seen = time.monotonic()
+        # Mixer mode: this participant's mix goes out on its own clock,
+        # in the codec they send with
+        self.packetizer = AudioPacketizer()
+        self.encoder = None
+
+    def stats(self) -> dict:
+        stats = {
+            'codecs_received': [decoder.name for decoder in self.decoders.values() if decoder],
+            'jitter_buffer': self.jitter_buffer.stats(),
+        }
+        if self.encoder:
+            stats['codec_sent'] = self.encoder.name
+        return stats
+
 
 class AudioClient:
     """Handles audio streaming via UDP"""
@@ -15,11 +47,48 @@ class AudioClient:
     SAMPLE_RATE = 16000 # 16kHz
     CHANNELS = 1
     BLOCK_SIZE = 1024 # Buffer size
+    LOW_LATENCY_BLOCK_MS = 20
+    RING_BLOCKS = 8      # capacity of the callback rings, in blocks
+    PLAYBACK_BLOCKS = 2  # how far ahead of the output callback playback is kept
+    SOURCE_TIMEOUT = 10.0  # seconds of silence before a participant is dropped
+    MAX_SOURCES = 16       # participants received at once
     
-    def __init__(self, port: int):
+    def __init__(self, port: int, min_delay: float = 0.02, max_delay: float = 0.3,
+                 low_latency: bool = False, block_ms: Optional[float] = None,
+                 vad: bool = True, codecs: Optional[Sequence[str]] = None,
+                 mixer: bool = False, max_speakers: int = 3):
+        """
+        min_delay, max_delay: bounds (seconds) for each receive jitter
+            buffer's depth, which otherwise follows the measured jitter
+        low_latency: run the sound devices from callbacks, exchanging
+            audio with the network threads through lock-free rings,
+            instead of blocking reads/writes in Python threads
+        block_ms: audio per block and packet (default BLOCK_SIZE samples,
+            or LOW_LATENCY_BLOCK_MS in low-latency mode); 10-20 ms suits
+            low-latency mode
+        vad: don't send while nobody is talking, only an occasional
+            comfort noise level for the receiver to fill the gap with
+        codecs: codecs to offer and accept, most preferred first
+            (default: every one audio_codec supports at this block size)
+        mixer: act as a conference mixer, sending each participant one
+            stream of everyone else (our microphone included) mixed, so
+            nobody's downstream grows with the size of the call; anyone
+            who sends to this client joins
+        max_speakers: most participants mixed at once; the loudest are kept
+        """
         self.port = port + 2  # Audio port is Chat Port + 2
-        self.remote_address: Optional[tuple] = None
+        self.remotes: List[tuple] = []  # audio addresses we send to
         self.running = False
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.low_latency = low_latency
+        if block_ms is None:
+            block_ms = self.LOW_LATENCY_BLOCK_MS if low_latency else self.BLOCK_SIZE * 1000 / self.SAMPLE_RATE
+        self.block_size = int(self.SAMPLE_RATE * block_ms / 1000)
+        self.use_vad = vad
+        self.codec_preference = list(codecs) if codecs is not None else None
+        self.mixer = mixer
+        self.max_speakers = max_speakers
         
         # Audio Interface (controlled via flags)
         self.input_stream = None
@@ -28,17 +97,95 @@ class AudioClient:
         # Sockets
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.socket.bind(('0.0.0.0', self.port))
+        self.socket.settimeout(0.5)  # so the receive thread notices stop_call()
+        
+        # Sequence numbers and timestamps out; per participant, reordering
+        # and concealment in
+        self.packetizer = AudioPacketizer()
+        self.sources: Dict[tuple, _RemoteSource] = {}  # sender address -> receive state
+        self._lock = threading.Lock()
+        self.packets_sent = 0
+        self.sources_rejected = 0  # new participants refused beyond MAX_SOURCES
+        
+        # Send codec (decoders are per participant)
+        self.encoder = create_codec(CODEC_PCM, self.SAMPLE_RATE, self.CHANNELS)
+        self._codec_agreed = False  # False until the send codec is settled
+        self.packets_undecodable = 0  # unknown payload type, or a payload that failed to decode
+        
+        # Silence suppression out
+        self.vad = VoiceActivityDetector(self.SAMPLE_RATE) if vad else None
+        
+        # Mixing participants together, for our speaker or (mixer mode) for each other
+        self.audio_mixer = AudioMixer(max_speakers)
+        self._mixed = np.zeros(self.block_size, dtype=np.int16)
+
+        # Low-latency mode: callback <-> network thread hand-off (and in
+        # mixer mode, the mixing send path -> speaker)
+        self.capture_ring = SampleRing(self.RING_BLOCKS * self.block_size)
+        self.playback_ring = SampleRing(self.RING_BLOCKS * self.block_size)
+        self.device_xruns = 0  # callbacks where the device reported over/underflow
+
+    @property
+    def remote_address(self) -> Optional[tuple]:
+        """First configured remote (the peer, in a 1:1 call)"""
+        return self.remotes[0] if self.remotes else None
+        
+    def supported_codecs(self) -> list:
+        """Codecs to offer in an audio_request, most preferred first"""
+        available = audio_codec.supported_codecs(self.block_size, self.SAMPLE_RATE)
+        if self.codec_preference is None:
+            return available
+        return [name for name in self.codec_preference if name in available]
+        
+    def start_call(self, remote_ip: str, remote_port: int, codec: Optional[str] = None):
+        """Start audio call with a peer (see start_conference).
+        
+        codec: what to send with, as chosen by the callee from the caller's
+            offer. The caller leaves it out and sends PCM until it learns
+            the callee's choice: from the callee's audio_answer (see
+            set_codec) or, from peers that send none, their first packet.
+        """
+        self.start_conference([(remote_ip, remote_port)], codec)
+
+    def set_codec(self, name: str) -> bool:
+        """Send with the codec the callee picked (its audio_answer), if supported"""
+        if name not in self.supported_codecs():
+            return False
+        if name != self.encoder.name:
+            self.encoder = create_codec(name, self.SAMPLE_RATE, self.CHANNELS)
+        self._codec_agreed = True
+        return True
         
-    def start_call(self, remote_ip: str, remote_port: int):
-        """Start audio call with a peer"""
-        self.remote_address = (remote_ip, remote_port + 2)
+    def start_conference(self, remotes: Iterable[Tuple[str, int]], codec: Optional[str] = None):
+        """Start an audio call with any number of participants.
+
+        remotes: (ip, chat port) of each participant to send to. With a
+            mixer, that is just the mixer; a mixer can start with none
+            and take on participants as they send.
+        Each participant heard gets a jitter buffer of their own, and the
+        loudest few are mixed into one output.
+        """
+        with self._lock:
+            # Audio port is always Chat Port + 2
+            self.remotes = [(ip, port + 2) for ip, port in remotes]
+            self.sources = {}
+        self.encoder = create_codec(codec or CODEC_PCM, self.SAMPLE_RATE, self.CHANNELS)
+        self._codec_agreed = codec is not None
+        self.packetizer = AudioPacketizer()
+        self.vad = VoiceActivityDetector(self.SAMPLE_RATE) if self.use_vad else None
+        self.audio_mixer = AudioMixer(self.max_speakers)
+        self.playback_ring = SampleRing(self.RING_BLOCKS * self.block_size)
         self.running = True
         
         try:
             # Start threads
-            threading.Thread(target=self._audio_loop, daemon=True).start()
+            if self.low_latency:
+                self._start_callbacks()
+            else:
+                self._start_threads()
             
-            print(f"Audio started on port {self.port} -> {self.remote_address}")
+            mode = " (mixing)" if self.mixer else ""
+            print(f"Audio started on port {self.port}{mode} -> {', '.join(map(str, self.remotes)) or 'no one yet'}")
             
         except Exception as e:
             print(f"Audio Start Error: {e}")
@@ -51,68 +198,290 @@ class AudioClient:
             self.input_stream.abort()
         if self.output_stream:
             self.output_stream.abort()
+
+    def add_remote(self, remote_ip: str, remote_port: int):
+        """Start sending to another participant mid-call"""
+        address = (remote_ip, remote_port + 2)
+        with self._lock:
+            if address not in self.remotes:
+                # Replaced rather than appended to, so the send path never sees it change
+                self.remotes = self.remotes + [address]
+
+    def remove_remote(self, remote_ip: str, remote_port: int):
+        """Stop sending to a participant and stop playing them"""
+        address = (remote_ip, remote_port + 2)
+        with self._lock:
+            self.remotes = [remote for remote in self.remotes if remote != address]
+            self.sources = {addr: source for addr, source in self.sources.items() if addr != address}
             
-    def _audio_loop(self):
-        """Combined audio IO loop"""
+    def _start_threads(self):
+        """Start Input, Receive and Output threads"""
+        threading.Thread(target=self._record_loop, daemon=True).start()
+        threading.Thread(target=self._receive_loop, daemon=True).start()
+        threading.Thread(target=self._play_loop, daemon=True).start()
+
+    def _start_callbacks(self):
+        """Start the callback-driven streams and the threads that feed and drain them"""
+        self.capture_ring = SampleRing(self.RING_BLOCKS * self.block_size)
+        self.playback_ring = SampleRing(self.RING_BLOCKS * self.block_size)
+        self.device_xruns = 0
+        threading.Thread(target=self._send_loop, daemon=True).start()
+        threading.Thread(target=self._receive_loop, daemon=True).start()
+        if not self.mixer:  # a mixer's send path fills the playback ring itself
+            threading.Thread(target=self._feed_loop, daemon=True).start()
         
-        def callback(indata, outdata, frames, time, status):
-            if status:
-                print(status)
-            
-            # 1. Send Microphone Input
-            if self.remote_address:
+        options = dict(samplerate=self.SAMPLE_RATE, blocksize=self.block_size,
+                       channels=self.CHANNELS, dtype='int16', latency='low')
+        self.input_stream = sd.InputStream(callback=self._input_callback, **options)
+        self.output_stream = sd.OutputStream(callback=self._output_callback, **options)
+        self.input_stream.start()
+        self.output_stream.start()
+
+    def _input_callback(self, indata, frames, time_info, status):
+        """Audio thread: hand the microphone block to the send thread, never blocking"""
+        if status:
+            self.device_xruns += 1
+        self.capture_ring.write(indata.reshape(-1))
+
+    def _output_callback(self, outdata, frames, time_info, status):
+        """Audio thread: play what the feed thread has queued, silence if it fell behind"""
+        if status:
+            self.device_xruns += 1
+        self.playback_ring.read_into(outdata.reshape(-1))
+
+    def _send_loop(self):
+        """Low-latency mode: send each captured block as it fills"""
+        block = np.zeros(self.block_size, dtype=np.int16)
+        poll = self.block_size / self.SAMPLE_RATE / 4
+        while self.running:
+            if self.capture_ring.available() < self.block_size:
+                time.sleep(poll)
+                continue
+            self.capture_ring.read_into(block)
+            self._send_block(block)
+
+    def _feed_loop(self):
+        """Low-latency mode: keep the playback ring PLAYBACK_BLOCKS ahead of the
+        output callback, from the participants' jitter buffers"""
+        poll = self.block_size / self.SAMPLE_RATE / 4
+        while self.running:
+            if self.playback_ring.available() >= self.PLAYBACK_BLOCKS * self.block_size:
+                time.sleep(poll)
+                continue
+            try:
+                self.playback_ring.write(self._next_block())
+            except Exception as e:
+                if self.running:
+                    print(f"Audio play error: {e}")
+
+    def _record_loop(self):
+        """Capture microphone and send UDP"""
+        with sd.InputStream(samplerate=self.SAMPLE_RATE, blocksize=self.block_size, channels=self.CHANNELS, dtype='int16') as stream:
+            while self.running:
+                data, overflowed = stream.read(self.block_size)
+                self._send_block(data)
+
+    def _send_block(self, block):
+        """Send one captured block to every participant, or during silence just
+        the odd comfort noise packet"""
+        if self.mixer:
+            self._mix_and_send(block.reshape(-1))
+            return
+        targets = self.remotes
+        if not targets:
+            return
+        if self.vad is None or self.vad.is_speech(block):
+            encoder = self.encoder
+            datagram = self.packetizer.packet(encoder.encode(block), len(block), encoder.payload_type)
+        else:
+            self.packetizer.skip(len(block))
+            datagram = self.vad.comfort_noise(len(block))
+        if datagram:
+            for address in targets:
                 try:
-                    # Convert to bytes
-                    data = indata.tobytes()
-                    self.socket.sendto(data, self.remote_address)
+                    self.socket.sendto(datagram, address)
+                    self.packets_sent += 1
                 except Exception:
                     pass
-            
-            # 2. Receive Network Audio (Non-blocking check)
+
+    def _mix_and_send(self, block: np.ndarray):
+        """Mixer mode, once per captured block: take a block from every
+        participant, send each of them the active speakers except
+        themselves, and queue all but our own voice for our speaker"""
+        sources = self._source_list()
+        blocks = {}
+        for source in sources:
+            samples = source.jitter_buffer.pop(len(block))
+            if source.jitter_buffer.received:  # not concealment or comfort noise
+                blocks[source.address] = samples
+        if self.vad is None or self.vad.is_speech(block):
+            blocks[None] = block  # our microphone
+        active = self.audio_mixer.select(blocks)
+
+        heard = [key for key in active if key is not None]
+        self.playback_ring.write(self.audio_mixer.mix(blocks, heard, self._mixed))
+        for source in sources:
+            keys = [key for key in active if key != source.address]
+            if not keys or source.encoder is None:
+                source.packetizer.skip(len(block))  # nothing for them to hear
+                continue
+            encoder = source.encoder
+            mixed = self.audio_mixer.mix(blocks, keys, self._mixed)
+            datagram = source.packetizer.packet(encoder.encode(mixed), len(mixed), encoder.payload_type)
             try:
-                # Standard socket recv is blocking, so we need to be careful inside callback
-                # But typically we read ONE packet per callback frame
-                # Ideally, we should use a buffer queue, but for low latency:
-                
-                # We need to make recv non-blocking or use a separate thread
-                pass 
-                
+                self.socket.sendto(datagram, source.address)
+                self.packets_sent += 1
             except Exception:
                 pass
-                
-            # For simplicity in 'sounddevice' callback mode, doing network IO is risky.
-            # Better approach: Separate threads for Network RX -> Buffer -> Audio Out
-            
-        # RE-DESIGN FOR ROBUSTNESS: 
-        # Use two separate streams to avoid callback complexity
-        self._start_threads()
-        
-    def _start_threads(self):
-        """Start Input and Output threads"""
-        threading.Thread(target=self._record_loop, daemon=True).start()
-        threading.Thread(target=self._play_loop, daemon=True).start()
 
-    def _record_loop(self):
-        """Capture microphone and send UDP"""
-        with sd.InputStream(samplerate=self.SAMPLE_RATE, blocksize=self.BLOCK_SIZE, channels=self.CHANNELS, dtype='int16') as stream:
-            while self.running:
-                data, overflowed = stream.read(self.BLOCK_SIZE)
-                if self.remote_address:
-                    try:
-                        self.socket.sendto(data.tobytes(), self.remote_address)
-                    except Exception:
-                        pass
+    def _receive_loop(self):
+        """Receive UDP packets into each participant's jitter buffer"""
+        packet = bytearray(MAX_DATAGRAM)
+        view = memoryview(packet)
+        expired = time.monotonic()
+        while self.running:
+            try:
+                now = time.monotonic()
+                if now - expired >= 1.0:
+                    self._expire_sources(now)
+                    expired = now
+                size, addr = self.socket.recvfrom_into(packet)
+                if size < CN_HEADER.size or packet[0] not in (PKT_AUDIO, PKT_COMFORT_NOISE):
+                    continue
+                source = self.sources.get(addr) or self._open_source(addr)
+                if source is None:
+                    continue
+                source.last_seen = now
+                if packet[0] == PKT_COMFORT_NOISE:
+                    source.comfort_noise.set_level(CN_HEADER.unpack_from(packet, 0)[1])
+                    continue
+                if size <= AUDIO_HEADER.size:
+                    continue
+                _, payload_type, seq, timestamp = AUDIO_HEADER.unpack_from(packet, 0)
+                decoder = self._decoder(source, payload_type)
+                if decoder is None:
+                    self.packets_undecodable += 1
+                    continue
+                try:
+                    samples = decoder.decode(view[AUDIO_HEADER.size:size])
+                except Exception:
+                    self.packets_undecodable += 1
+                    continue
+                source.jitter_buffer.push(seq, timestamp, samples.tobytes())
+            except socket.timeout:
+                continue
+            except Exception as e:
+                if self.running:
+                    print(f"Audio receive error: {e}")
+
+    def _open_source(self, address: tuple) -> Optional[_RemoteSource]:
+        """Receive state for a newly heard participant"""
+        with self._lock:
+            if len(self.sources) >= self.MAX_SOURCES:
+                self.sources_rejected += 1
+                return None
+            source = _RemoteSource(address, self.SAMPLE_RATE, self.min_delay, self.max_delay)
+            # Replaced rather than added to, so the playout side can read it unlocked
+            self.sources = {**self.sources, address: source}
+        print(f"Audio from {address}")
+        return source
+
+    def _expire_sources(self, now: float):
+        """Drop participants gone silent (suppressed silence still sends comfort noise)"""
+        with self._lock:
+            silent = [address for address, source in self.sources.items()
+                      if now - source.last_seen > self.SOURCE_TIMEOUT]
+            if silent:
+                self.sources = {address: source for address, source in self.sources.items()
+                                if address not in silent}
+        for address in silent:
+            print(f"Audio from {address} ended")
+
+    def _source_list(self) -> List[_RemoteSource]:
+        return list(self.sources.values())
+
+    def _decoder(self, source: _RemoteSource, payload_type: int):
+        """A participant's decoder for a payload type (None if unsupported).
+
+        The first packet from the callee also settles the caller's send
+        codec. In mixer mode, each participant's mix is sent in the codec
+        they send with.
+        """
+        if payload_type not in source.decoders:
+            name = CODEC_NAMES.get(payload_type)
+            try:
+                source.decoders[payload_type] = create_codec(name, self.SAMPLE_RATE, self.CHANNELS) if name else None
+            except ValueError:
+                source.decoders[payload_type] = None
+        decoder = source.decoders[payload_type]
+        if decoder is None:
+            return None
+        if self.mixer:
+            if source.encoder is None or source.encoder.name != decoder.name:
+                source.encoder = create_codec(decoder.name, self.SAMPLE_RATE, self.CHANNELS)
+        elif not self._codec_agreed:
+            self._codec_agreed = True
+            if decoder.name != self.encoder.name:
+                self.encoder = create_codec(decoder.name, self.SAMPLE_RATE, self.CHANNELS)
+        return decoder
+        
+    def _next_block(self) -> np.ndarray:
+        """The next block for the speaker: the active speakers among the
+        participants, mixed. When nobody has sent audio for it, one
+        participant's concealment or comfort noise fills the gap instead.
+        The array is reused, so play or copy it first."""
+        blocks = {}
+        filler = None
+        for source in self._source_list():
+            samples = source.jitter_buffer.pop(self.block_size)
+            if source.jitter_buffer.received:
+                blocks[source.address] = samples
+            elif filler is None:
+                filler = samples
+        if not blocks and filler is not None:
+            self._mixed[:] = filler
+            return self._mixed
+        return self.audio_mixer.mix(blocks, self.audio_mixer.select(blocks), self._mixed)
 
     def _play_loop(self):
-        """Receive UDP and play to speaker"""
-        # Create a queue or write directly to stream
-        with sd.OutputStream(samplerate=self.SAMPLE_RATE, blocksize=self.BLOCK_SIZE, channels=self.CHANNELS, dtype='int16') as stream:
+        """Play the participants out to the speaker; the device's pace sets the clock"""
+        block = np.zeros(self.block_size, dtype=np.int16)
+        with sd.OutputStream(samplerate=self.SAMPLE_RATE, blocksize=self.block_size, channels=self.CHANNELS, dtype='int16') as stream:
             while self.running:
                 try:
-                    data, _ = self.socket.recvfrom(4096)
-                    # Convert bytes back to numpy array
-                    audio_data = np.frombuffer(data, dtype=np.int16)
-                    stream.write(audio_data)
+                    # Always a full block: audio, concealment for a lost packet, or silence
+                    if self.mixer:
+                        self.playback_ring.read_into(block)  # mixed by the send path
+                        stream.write(block)
+                    else:
+                        stream.write(self._next_block())
                 except Exception as e:
                     if self.running:
                         print(f"Audio play error: {e}")
+
+    def get_stats(self) -> dict:
+        """Send codec, packets sent and undecodable, voice activity, mixing,
+        per participant jitter buffer counters and, in low-latency mode,
+        callback ring underruns/overruns"""
+        stats = {
+            'codec': self.encoder.name,
+            'packets_sent': self.packets_sent,
+            'packets_undecodable': self.packets_undecodable,
+            'peers': {
+                'targets': len(self.remotes),
+                'mixing': self.mixer,
+                'sources_rejected': self.sources_rejected,
+            },
+            'mixer': self.audio_mixer.stats(),
+            'sources': {f"{ip}:{port}": source.stats() for (ip, port), source in self.sources.items()},
+        }
+        if self.vad:
+            stats['vad'] = self.vad.stats()
+        if self.low_latency:
+            stats['callback'] = {
+                'block_ms': round(self.block_size * 1000 / self.SAMPLE_RATE, 1),
+                'capture_ring': self.capture_ring.stats(),
+                'playback_ring': self.playback_ring.stats(),
+                'device_xruns': self.device_xruns,
+            }
+        return stats
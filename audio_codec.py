@@ -0,0 +1,240 @@
+"""
+Audio Codec Module
+Encodes blocks of int16 samples into audio packet payloads.
+
+Each packet names its codec with a payload type byte, so a receiver can
+decode whatever arrives. The caller offers the codecs it supports with
+its audio_request, and the callee sends with the first one it also
+supports. The caller switches to that codec once the callee's first
+packet shows which one it picked.
+
+  pcm     raw 16-bit PCM (always available)
+  pcmu    G.711 mu-law, 8 bits per sample
+  pcma    G.711 A-law, 8 bits per sample
+  adpcm   IMA ADPCM, 4 bits per sample; each packet carries the
+          predictor state it starts from, so a lost packet never
+          corrupts the next
+  opus    Opus, if opuslib and libopus are installed and the block is
+          a valid Opus frame size
+"""
+import struct
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+try:
+    import opuslib
+except (ImportError, OSError):  # OSError: opuslib installed without libopus
+    opuslib = None
+
+
+CODEC_PCM = 'pcm'
+CODEC_PCMU = 'pcmu'
+CODEC_PCMA = 'pcma'
+CODEC_ADPCM = 'adpcm'
+CODEC_OPUS = 'opus'
+
+# Most compact first
+PREFERENCE = [CODEC_OPUS, CODEC_ADPCM, CODEC_PCMU, CODEC_PCMA, CODEC_PCM]
+
+
+class PcmCodec:
+    """Uncompressed 16-bit samples (the original wire format)"""
+
+    name = CODEC_PCM
+    payload_type = 0
+
+    def encode(self, samples: np.ndarray) -> bytes:
+        return samples.tobytes()
+
+    def decode(self, payload) -> np.ndarray:
+        return np.frombuffer(payload, dtype=np.int16)
+
+
+def _ulaw_tables():
+    """(encode table indexed by the sample's uint16 bits, decode table by code)"""
+    x = np.arange(-32768, 32768, dtype=np.int32)
+    value = x >> 2
+    mask = np.where(value < 0, 0x7F, 0xFF)
+    value = np.minimum(np.abs(value), 8159) + 0x21
+    segment = np.searchsorted([0x3F, 0x7F, 0xFF, 0x1FF, 0x3FF, 0x7FF, 0xFFF, 0x1FFF], value)
+    codes = np.where(segment >= 8, 0x7F, (segment << 4) | ((value >> np.minimum(segment + 1, 8)) & 0x0F)) ^ mask
+    encode = np.empty(65536, dtype=np.uint8)
+    encode[x.astype(np.uint16)] = codes
+
+    u = ~np.arange(256) & 0xFF
+    magnitude = (((u & 0x0F) << 3) + 0x84 << ((u >> 4) & 7)) - 0x84
+    decode = np.where(u & 0x80, -magnitude, magnitude).astype(np.int16)
+    return encode, decode
+
+
+def _alaw_tables():
+    x = np.arange(-32768, 32768, dtype=np.int32)
+    value = x >> 3
+    mask = np.where(value >= 0, 0xD5, 0x55)
+    value = np.where(value >= 0, value, -value - 1)
+    segment = np.searchsorted([0x1F, 0x3F, 0x7F, 0xFF, 0x1FF, 0x3FF, 0x7FF, 0xFFF], value)
+    shift = np.where(segment < 2, 1, segment)
+    codes = np.where(segment >= 8, 0x7F, (segment << 4) | ((value >> np.minimum(shift, 7)) & 0x0F)) ^ mask
+    encode = np.empty(65536, dtype=np.uint8)
+    encode[x.astype(np.uint16)] = codes
+
+    a = np.arange(256) ^ 0x55
+    segment = (a & 0x70) >> 4
+    magnitude = ((a & 0x0F) << 4) + np.where(segment == 0, 8, 0x108)
+    magnitude = np.where(segment > 1, magnitude << np.maximum(segment - 1, 0), magnitude)
+    decode = np.where(a & 0x80, magnitude, -magnitude).astype(np.int16)
+    return encode, decode
+
+
+class G711Codec:
+    """G.711 companding through 64K/256-entry lookup tables: one numpy gather per block"""
+
+    def __init__(self, name: str, payload_type: int, tables):
+        self.name = name
+        self.payload_type = payload_type
+        self._encode, self._decode = tables
+
+    def encode(self, samples: np.ndarray) -> bytes:
+        return self._encode[samples.reshape(-1).view(np.uint16)].tobytes()
+
+    def decode(self, payload) -> np.ndarray:
+        return self._decode[np.frombuffer(payload, dtype=np.uint8)]
+
+
+IMA_STEPS = [
+    7, 8, 9, 10, 11, 12, 13, 14, 16, 17, 19, 21, 23, 25, 28, 31, 34, 37, 41, 45,
+    50, 55, 60, 66, 73, 80, 88, 97, 107, 118, 130, 143, 157, 173, 190, 209, 230,
+    253, 279, 307, 337, 371, 408, 449, 494, 544, 598, 658, 724, 796, 876, 963,
+    1060, 1166, 1282, 1411, 1552, 1707, 1878, 2066, 2272, 2499, 2749, 3024, 3327,
+    3660, 4026, 4428, 4871, 5358, 5894, 6484, 7132, 7845, 8630, 9493, 10442,
+    11487, 12635, 13899, 15289, 16818, 18500, 20350, 22385, 24623, 27086, 29794,
+    32767,
+]
+IMA_INDEX_ADJUST = [-1, -1, -1, -1, 2, 4, 6, 8]
+
+# starting predictor, starting step index, padding
+ADPCM_HEADER = struct.Struct('!hBx')
+
+
+def _adpcm_tables():
+    """Per (step index, code): the signed predictor change and the next step index"""
+    steps = np.array(IMA_STEPS)[:, None]
+    codes = np.arange(16)
+    delta = ((steps >> 3) + np.where(codes & 4, steps, 0)
+             + np.where(codes & 2, steps >> 1, 0) + np.where(codes & 1, steps >> 2, 0))
+    delta = np.where(codes & 8, -delta, delta)
+    next_index = np.clip(np.arange(len(IMA_STEPS))[:, None] + np.array(IMA_INDEX_ADJUST)[codes & 7], 0, 88)
+    return delta.tolist(), next_index.tolist()
+
+
+class AdpcmCodec:
+    """IMA ADPCM. The predictor recurrence is inherently sample by sample, so
+    that loop runs over precomputed tables; nibble packing and unpacking
+    are done with numpy."""
+
+    name = CODEC_ADPCM
+    payload_type = 3
+
+    DELTA, NEXT_INDEX = None, None  # built on first use
+
+    def __init__(self):
+        if AdpcmCodec.DELTA is None:
+            AdpcmCodec.DELTA, AdpcmCodec.NEXT_INDEX = _adpcm_tables()
+        self._predictor = 0
+        self._index = 0
+
+    def encode(self, samples: np.ndarray) -> bytes:
+        samples = samples.reshape(-1)
+        predictor, index = self._predictor, self._index
+        header = ADPCM_HEADER.pack(predictor, index)
+        codes = bytearray(len(samples) + (len(samples) & 1))
+        delta_table, next_table = self.DELTA, self.NEXT_INDEX
+        for i, sample in enumerate(samples.tolist()):
+            diff = sample - predictor
+            step = IMA_STEPS[index]
+            code = min(7, (-diff << 2) // step) | 8 if diff < 0 else min(7, (diff << 2) // step)
+            predictor = max(-32768, min(32767, predictor + delta_table[index][code]))
+            index = next_table[index][code]
+            codes[i] = code
+        self._predictor, self._index = predictor, index
+        nibbles = np.frombuffer(codes, dtype=np.uint8)
+        return header + (nibbles[0::2] | (nibbles[1::2] << 4)).tobytes()
+
+    def decode(self, payload) -> np.ndarray:
+        predictor, index = ADPCM_HEADER.unpack_from(payload, 0)
+        packed = np.frombuffer(payload, dtype=np.uint8, offset=ADPCM_HEADER.size)
+        nibbles = np.empty(len(packed) * 2, dtype=np.uint8)
+        nibbles[0::2] = packed & 0x0F
+        nibbles[1::2] = packed >> 4
+        out = [0] * len(nibbles)
+        delta_table, next_table = self.DELTA, self.NEXT_INDEX
+        index = min(index, 88)
+        for i, code in enumerate(nibbles.tolist()):
+            predictor = max(-32768, min(32767, predictor + delta_table[index][code]))
+            index = next_table[index][code]
+            out[i] = predictor
+        return np.array(out, dtype=np.int16)
+
+
+class OpusCodec:
+    """Opus via opuslib, tuned for voice"""
+
+    name = CODEC_OPUS
+    payload_type = 4
+
+    FRAME_MS = (2.5, 5, 10, 20, 40, 60)
+
+    def __init__(self, sample_rate: int, channels: int):
+        self.channels = channels
+        self._encoder = opuslib.Encoder(sample_rate, channels, opuslib.APPLICATION_VOIP)
+        self._decoder = opuslib.Decoder(sample_rate, channels)
+        self._max_frame = sample_rate * 120 // 1000
+
+    @classmethod
+    def supports(cls, block_size: int, sample_rate: int) -> bool:
+        return opuslib is not None and any(block_size == sample_rate * ms / 1000 for ms in cls.FRAME_MS)
+
+    def encode(self, samples: np.ndarray) -> bytes:
+        return self._encoder.encode(samples.tobytes(), len(samples) // self.channels)
+
+    def decode(self, payload) -> np.ndarray:
+        return np.frombuffer(self._decoder.decode(bytes(payload), self._max_frame), dtype=np.int16)
+
+
+PAYLOAD_TYPES = {
+    CODEC_PCM: PcmCodec.payload_type,
+    CODEC_PCMU: 1,
+    CODEC_PCMA: 2,
+    CODEC_ADPCM: AdpcmCodec.payload_type,
+    CODEC_OPUS: OpusCodec.payload_type,
+}
+CODEC_NAMES = {payload_type: name for name, payload_type in PAYLOAD_TYPES.items()}
+
+_G711_TABLES: Dict[str, tuple] = {}
+
+
+def supported_codecs(block_size: int, sample_rate: int) -> List[str]:
+    """Codecs usable at this block size, most preferred first"""
+    return [name for name in PREFERENCE
+            if name != CODEC_OPUS or OpusCodec.supports(block_size, sample_rate)]
+
+
+def choose_codec(offered: Optional[Sequence[str]], supported: Sequence[str]) -> str:
+    """First codec in the caller's offer that we support too"""
+    return next((name for name in offered or () if name in supported), CODEC_PCM)
+
+
+def create_codec(name: str, sample_rate: int, channels: int = 1):
+    """A new codec instance (encoders and decoders may keep state, so one per stream)"""
+    if name == CODEC_PCM:
+        return PcmCodec()
+    if name in (CODEC_PCMU, CODEC_PCMA):
+        if name not in _G711_TABLES:
+            _G711_TABLES[name] = _ulaw_tables() if name == CODEC_PCMU else _alaw_tables()
+        return G711Codec(name, PAYLOAD_TYPES[name], _G711_TABLES[name])
+    if name == CODEC_ADPCM:
+        return AdpcmCodec()
+    if name == CODEC_OPUS and opuslib is not None:
+        return OpusCodec(sample_rate, channels)
+    raise ValueError(f"Unsupported audio codec '{name}'")
@@ -0,0 +1,80 @@
+"""
+Audio Mixer Module
+Mixes several participants' audio into one stream for conference calls.
+
+Every source's level is tracked block by block. When more sources are
+talking than the mixer may combine, only the loudest few (the active
+speakers) are mixed, so a room full of open microphones doesn't add up
+to a wall of background noise. A speaker keeps their place until
+someone else is clearly louder, so the selection doesn't flicker.
+Only received audio is mixed: a silent participant's comfort noise or a
+concealment tail never takes a speaker's place or adds to the mix.
+Mixing adds in int32 and clips back to int16 (a saturating add), so
+overloud peaks flatten instead of wrapping round into loud clicks.
+"""
+from typing import Dict, Hashable, Iterable, List
+
+import numpy as np
+
+from voice_activity import level_dbov
+
+
+class AudioMixer:
+    """Active speaker selection and saturating mixing of int16 blocks"""
+
+    ATTACK = 0.5   # smoothing weight of a new block's level when louder (speech starts fast)
+    RELEASE = 0.1  # and when quieter (pauses between words don't drop a speaker)
+
+    def __init__(self, max_speakers: int = 3, switch_db: float = 3.0):
+        self.max_speakers = max_speakers
+        self.switch_db = switch_db  # how much louder a newcomer must be to displace a speaker
+        self.levels: Dict[Hashable, float] = {}  # smoothed dBov per source
+        self.active: List[Hashable] = []
+        self._sum = np.zeros(0, dtype=np.int32)
+
+        # Counters
+        self.switches = 0   # times the set of active speakers changed
+        self.clipped = 0    # samples that saturated
+
+    def select(self, blocks: Dict[Hashable, np.ndarray]) -> List[Hashable]:
+        """Update each source's level from its latest block and return the active speakers"""
+        for key in [key for key in self.levels if key not in blocks]:
+            del self.levels[key]
+        for key, block in blocks.items():
+            level = level_dbov(block)
+            previous = self.levels.get(key, level)
+            weight = self.ATTACK if level > previous else self.RELEASE
+            self.levels[key] = previous + weight * (level - previous)
+
+        if len(blocks) <= self.max_speakers:
+            active = list(blocks)
+        else:
+            def score(key):
+                return self.levels[key] + (self.switch_db if key in self.active else 0)
+            active = sorted(blocks, key=score, reverse=True)[:self.max_speakers]
+        if set(active) != set(self.active):
+            self.switches += 1
+        self.active = active
+        return active
+
+    def mix(self, blocks: Dict[Hashable, np.ndarray], keys: Iterable[Hashable], out: np.ndarray) -> np.ndarray:
+        """Saturating sum of the blocks named by `keys` (silence if none) into the int16 array `out`"""
+        frames = len(out)
+        if len(self._sum) < frames:
+            self._sum = np.zeros(frames, dtype=np.int32)
+        total = self._sum[:frames]
+        total[:] = 0
+        for key in keys:
+            total += blocks[key].reshape(-1)[:frames]
+        self.clipped += int(np.count_nonzero((total > 32767) | (total < -32768)))
+        np.clip(total, -32768, 32767, out=total)
+        out[:frames] = total
+        return out
+
+    def stats(self) -> dict:
+        return {
+            'max_speakers': self.max_speakers,
+            'active': len(self.active),
+            'switches': self.switches,
+            'clipped_samples': self.clipped,
+        }
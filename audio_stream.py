@@ -0,0 +1,299 @@
+"""
+Audio Stream Module
+RTP-like packet header, a receive-side jitter buffer with loss concealment,
+and the lock-free sample ring between audio callbacks and network threads.
+
+Each audio packet carries its codec's payload type, a 16-bit sequence
+number and a 32-bit sample clock timestamp (as RTP does). The receiver
+decodes packets into a ring of slots indexed by sequence number and
+plays them out at the pace of the output device. The target depth
+follows the measured interarrival jitter, and latency is held near it:
+on an underrun playout stretches with concealment, and once the buffer
+runs well over the target, a packet is dropped. A missing packet is
+concealed by repeating the last one with a fade, which reaches silence
+after a few packets. Silence is filled with comfort noise when the
+sender suppresses it.
+"""
+import random
+import struct
+import threading
+import time
+from typing import List, Optional
+
+import numpy as np
+
+from jitter_buffer import JitterEstimator, ts_diff
+
+
+# Datagram kinds
+PKT_AUDIO = 1
+
+# kind, payload type (audio_codec), sequence number, timestamp (samples, wraps)
+AUDIO_HEADER = struct.Struct('!BBHI')
+
+MAX_DATAGRAM = 4096
+
+
+class AudioPacketizer:
+    """Sender side: stamps each captured block with the next sequence number and timestamp"""
+
+    def __init__(self):
+        # Random starting points, as RTP recommends
+        self.seq = random.getrandbits(16)
+        self.timestamp = random.getrandbits(32)
+
+    def packet(self, payload: bytes, samples: int, payload_type: int = 0) -> bytes:
+        """Header + encoded payload for one block of `samples`, advancing the clock by its length"""
+        datagram = AUDIO_HEADER.pack(PKT_AUDIO, payload_type, self.seq, self.timestamp) + payload
+        self.seq = (self.seq + 1) & 0xFFFF
+        self.timestamp = (self.timestamp + samples) & 0xFFFFFFFF
+        return datagram
+
+    def skip(self, samples: int):
+        """Advance the clock over a block that isn't sent (suppressed silence)"""
+        self.timestamp = (self.timestamp + samples) & 0xFFFFFFFF
+
+
+class AudioJitterBuffer:
+    """Reorders audio packets and plays them out with adaptive depth and concealment.
+
+    push() is called from the receive thread; pop() from the playout
+    side, which asks for exactly as many samples as the device needs
+    and always gets them (audio, concealment or silence).
+    """
+
+    def __init__(self, sample_rate: int, min_delay: float = 0.02, max_delay: float = 0.3,
+                 jitter_factor: float = 3.0, capacity: int = 64, fade_packets: int = 3):
+        self.sample_rate = sample_rate
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.jitter_factor = jitter_factor  # target depth = factor * jitter, within bounds
+        self.capacity = capacity
+        self.fade_packets = fade_packets  # concealed packets until silence
+        self.estimator = JitterEstimator()  # in samples
+
+        self._lock = threading.Lock()
+        self._seqs: List[Optional[int]] = [None] * capacity
+        self._payloads: List[Optional[bytes]] = [None] * capacity
+        self._buffered = 0  # samples waiting in the ring
+        self._next_seq: Optional[int] = None
+        self._priming = True  # waiting to fill up to the target before playing
+        self._packet_samples = 0  # size of the last packet received
+        self._last: Optional[np.ndarray] = None  # last packet played, for concealment
+        self._concealed_run = 0
+        self.comfort_noise = None  # a voice_activity.ComfortNoise, if the sender suppresses silence
+
+        # Block being played out and how far into it pop() has got
+        self._current: Optional[np.ndarray] = None
+        self._current_received = False  # _current is a received packet, not concealment
+        self._cursor = 0
+        self._out = np.zeros(0, dtype=np.int16)
+        # Whether the last pop() held any received audio, rather than only
+        # concealment, comfort noise or silence (a mixer leaves those out)
+        self.received = False
+
+        # Counters
+        self.packets_received = 0
+        self.packets_played = 0
+        self.packets_concealed = 0  # lost packets replaced by concealment
+        self.packets_late = 0       # arrived after their slot had played
+        self.packets_dropped = 0    # played too late to keep latency down, or overran the ring
+        self.underruns = 0          # nothing to play when the device needed it
+
+    @property
+    def target(self) -> int:
+        """Target depth in samples"""
+        delay = self.jitter_factor * self.estimator.jitter / self.sample_rate
+        return int(min(self.max_delay, max(self.min_delay, delay)) * self.sample_rate)
+
+    def push(self, seq: int, timestamp: int, payload: bytes, now: Optional[float] = None):
+        """Queue one packet's PCM payload"""
+        now = time.monotonic() if now is None else now
+        samples = len(payload) // 2
+        if not samples:
+            return
+        with self._lock:
+            self.packets_received += 1
+            if self._next_seq is not None and not self._priming and ts_diff(seq, self._next_seq, 16) < 0:
+                self.packets_late += 1
+                return
+            if self._next_seq is not None and ts_diff(seq, self._next_seq, 16) >= self.capacity:
+                self._reset()  # sender jumped ahead of the whole ring: start over
+                self.packets_dropped += 1
+            self.estimator.update(timestamp, int(now * self.sample_rate) & 0xFFFFFFFF)
+            self._packet_samples = samples
+
+            index = seq % self.capacity
+            if self._seqs[index] == seq:
+                return  # duplicate
+            if self._payloads[index] is not None:
+                self._buffered -= len(self._payloads[index]) // 2
+                self.packets_dropped += 1
+            self._seqs[index] = seq
+            self._payloads[index] = payload
+            self._buffered += samples
+            if self._next_seq is None or (self._priming and ts_diff(seq, self._next_seq, 16) < 0):
+                self._next_seq = seq  # play from the oldest packet
+
+    def pop(self, frames: int) -> np.ndarray:
+        """Exactly `frames` samples for the output device.
+
+        The array is reused by the next call, so play or copy it first.
+        """
+        if len(self._out) < frames:
+            self._out = np.zeros(frames, dtype=np.int16)
+        out = self._out[:frames]
+        filled = 0
+        received = False
+        while filled < frames:
+            if self._current is None or self._cursor >= len(self._current):
+                self._current, self._cursor = self._next_packet(), 0
+                if self._current is None:
+                    # Still filling up (or the sender is silent)
+                    noise = self.comfort_noise.block(frames - filled) if self.comfort_noise else None
+                    out[filled:] = 0 if noise is None else noise
+                    break
+            take = min(frames - filled, len(self._current) - self._cursor)
+            out[filled:filled + take] = self._current[self._cursor:self._cursor + take]
+            received = received or self._current_received
+            filled += take
+            self._cursor += take
+        self.received = received
+        return out
+
+    def _next_packet(self) -> Optional[np.ndarray]:
+        """Samples of the next packet to play: real, concealed, or None while priming"""
+        with self._lock:
+            if self._priming:
+                if self._next_seq is None or self._buffered < max(self.target, self._packet_samples):
+                    return None
+                self._priming = False
+
+            payload = self._take(self._next_seq)
+            if payload is not None:
+                self._next_seq = (self._next_seq + 1) & 0xFFFF
+                # Well over the target (e.g. after a delay spike): skip a packet
+                # so latency comes back down instead of staying high
+                if self._buffered >= self.target + 2 * self._packet_samples:
+                    if self._take(self._next_seq) is not None:
+                        self.packets_dropped += 1
+                    self._next_seq = (self._next_seq + 1) & 0xFFFF
+                self.packets_played += 1
+                self._concealed_run = 0
+                self._last = np.frombuffer(payload, dtype=np.int16)
+                self._current_received = True
+                return self._last
+
+            if self._buffered:
+                # Later packets are here, so this one is lost: conceal it and move on
+                self.packets_concealed += 1
+                self._next_seq = (self._next_seq + 1) & 0xFFFF
+            else:
+                # Nothing at all: stretch with concealment, and once that
+                # has faded out, refill to the target before playing again
+                self.underruns += 1
+                if self._concealed_run >= self.fade_packets:
+                    self._priming = True
+                    self._next_seq = None  # resume from whatever arrives next
+                    return None
+            self._current_received = False
+            return self._conceal()
+
+    def _take(self, seq: int) -> Optional[bytes]:
+        index = seq % self.capacity
+        if self._seqs[index] != seq:
+            return None
+        payload = self._payloads[index]
+        self._seqs[index] = self._payloads[index] = None
+        self._buffered -= len(payload) // 2
+        return payload
+
+    def _conceal(self) -> np.ndarray:
+        """The last packet again, faded a further step towards silence (lock held)"""
+        run = self._concealed_run
+        self._concealed_run += 1
+        if self._last is None or run >= self.fade_packets:
+            noise = self.comfort_noise.block(self._packet_samples or 1) if self.comfort_noise else None
+            return np.zeros(self._packet_samples or 1, dtype=np.int16) if noise is None else noise
+        start, end = 1 - run / self.fade_packets, 1 - (run + 1) / self.fade_packets
+        ramp = np.linspace(start, end, len(self._last), dtype=np.float32)
+        return (self._last * ramp).astype(np.int16)
+
+    def _reset(self):
+        """Empty the ring and wait to refill (lock held)"""
+        self._seqs = [None] * self.capacity
+        self._payloads = [None] * self.capacity
+        self._buffered = 0
+        self._next_seq = None
+        self._priming = True
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'buffered_ms': round(self._buffered * 1000 / self.sample_rate, 1),
+                'target_ms': round(self.target * 1000 / self.sample_rate, 1),
+                'jitter_ms': round(self.estimator.jitter * 1000 / self.sample_rate, 1),
+                'packets_received': self.packets_received,
+                'packets_played': self.packets_played,
+                'packets_concealed': self.packets_concealed,
+                'packets_late': self.packets_late,
+                'packets_dropped': self.packets_dropped,
+                'underruns': self.underruns,
+            }
+
+
+class SampleRing:
+    """Single-producer, single-consumer ring of int16 samples.
+
+    The producer only ever advances the write count and the consumer
+    only the read count. Both are plain ints, updated after the copy
+    they publish, so neither side takes a lock and an audio callback
+    never waits on a network thread.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._buffer = np.zeros(capacity, dtype=np.int16)
+        self._written = 0  # total samples written (producer only)
+        self._read = 0     # total samples read (consumer only)
+        self.overruns = 0   # writes that didn't fit; the excess was dropped
+        self.underruns = 0  # reads that came up short; the rest was silence
+
+    def available(self) -> int:
+        """Samples waiting to be read"""
+        return self._written - self._read
+
+    def free(self) -> int:
+        return self.capacity - self.available()
+
+    def write(self, samples: np.ndarray) -> int:
+        """Producer: copy in as many samples as fit and return how many"""
+        count = min(len(samples), self.free())
+        if count < len(samples):
+            self.overruns += 1
+        start = self._written % self.capacity
+        first = min(count, self.capacity - start)
+        self._buffer[start:start + first] = samples[:first]
+        self._buffer[:count - first] = samples[first:count]
+        self._written += count
+        return count
+
+    def read_into(self, out: np.ndarray) -> int:
+        """Consumer: fill `out`, padding with silence if short, and return the samples read"""
+        count = min(len(out), self.available())
+        start = self._read % self.capacity
+        first = min(count, self.capacity - start)
+        out[:first] = self._buffer[start:start + first]
+        out[first:count] = self._buffer[:count - first]
+        if count < len(out):
+            out[count:] = 0
+            self.underruns += 1
+        self._read += count
+        return count
+
+    def stats(self) -> dict:
+        return {
+            'buffered': self.available(),
+            'overruns': self.overruns,
+            'underruns': self.underruns,
+        }
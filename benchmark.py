@@ -0,0 +1,233 @@
+"""
+Benchmarks for the P2P chat wire and media paths
+Run: python benchmark.py [codec] [coalesce] [render] [audio] [--count N]
+"""
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import threading
+import time
+
+from framing import FRAMING_LENGTH, FrameDecoder, encode_frame
+from message_codec import CODECS, CODEC_COMPACT, CODEC_JSON
+
+
+def sample_messages(count: int) -> list:
+    """Representative chat traffic: short texts from the link's own user"""
+    texts = ["hi", "how are you?", "see you at 5 🙂", "ok", "Sending the file now, give me a sec"]
+    return [
+        {
+            'type': 'group_message' if i % 4 == 0 else 'message',
+            'from': 'alice',
+            'text': texts[i % len(texts)],
+            'timestamp': 1700000000.0 + i
+        }
+        for i in range(count)
+    ]
+
+
+def bench_codec(count: int):
+    """Messages/sec and bytes/message for each codec (encode + frame + decode)"""
+    messages = sample_messages(count)
+    print(f"{'codec':<10}{'encode msg/s':>15}{'decode msg/s':>15}{'bytes/msg':>12}")
+
+    for name in (CODEC_JSON, CODEC_COMPACT):
+        codec = CODECS[name]
+
+        start = time.perf_counter()
+        frames = [encode_frame(codec.encode(msg, 'alice'), FRAMING_LENGTH) for msg in messages]
+        encode_time = time.perf_counter() - start
+
+        stream = b''.join(frames)
+        decoder = FrameDecoder(initial_size=len(stream) + 1)
+        decoder.feed(stream)
+
+        start = time.perf_counter()
+        decoded = [codec.decode(frame, 'alice') for frame in decoder.frames()]
+        decode_time = time.perf_counter() - start
+
+        assert decoded == messages, f"{name} round trip mismatch"
+        print(f"{name:<10}{count / encode_time:>15,.0f}{count / decode_time:>15,.0f}"
+              f"{len(stream) / count:>12.1f}")
+
+
+@contextlib.contextmanager
+def local_clients(**sender_options):
+    """A connected sender/receiver pair on localhost, with logs kept quiet.
+
+    Runs in a temporary directory so client start-up does not append to
+    the real tracking_log.txt.
+    """
+    from p2p_client import P2PClient
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        sender = P2PClient(7000, **sender_options)
+        receiver = P2PClient(7100, engine=sender_options.get('engine', 'thread'))
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                receiver.start('receiver')
+                sender.start('sender')
+                if not sender.connect_to_peer(f"127.0.0.1:{receiver.port}"):
+                    raise RuntimeError("Benchmark peers failed to connect")
+                # Wait for the handshake so the link uses its negotiated format
+                deadline = time.time() + 5
+                while not receiver.peer_connections and time.time() < deadline:
+                    time.sleep(0.01)
+                time.sleep(0.2)
+            yield sender, receiver
+        finally:
+            with contextlib.redirect_stdout(io.StringIO()):
+                sender.stop()
+                receiver.stop()
+            os.chdir(cwd)
+
+
+def bench_coalesce(count: int):
+    """End-to-end messages/sec over localhost with and without coalescing"""
+    print(f"{'engine':<8}{'coalesce':>12}{'msg/s':>12}{'writes':>10}")
+
+    for engine in ('thread', 'async'):
+        for coalesce_usec in (0, 200, 1000):
+            with local_clients(engine=engine, coalesce_usec=coalesce_usec,
+                               queue_limit=256 * 1024 * 1024, overflow_policy='block') as (sender, receiver):
+                received = [0]
+                finished = threading.Event()
+
+                def on_message(**kwargs):
+                    received[0] += 1
+                    if received[0] == count:
+                        finished.set()
+
+                receiver.set_message_callback(on_message)
+                peer = next(iter(sender.peer_connections))
+
+                start = time.perf_counter()
+                for i in range(count):
+                    sender.send_message(peer, f"message {i}")
+                if not finished.wait(60):
+                    raise RuntimeError(f"Only {received[0]} of {count} messages arrived")
+                elapsed = time.perf_counter() - start
+
+                stats = sender.get_queue_stats()[peer]
+                label = f"{coalesce_usec}us" if coalesce_usec else "off"
+                print(f"{engine:<8}{label:>12}{count / elapsed:>12,.0f}{stats['write_calls']:>10}")
+
+
+def bench_render(count: int):
+    """Video receive-side decode: frames/sec and memory allocated per frame,
+    allocating a new image per frame vs decoding into reused buffers"""
+    import tracemalloc
+    import cv2
+    import numpy as np
+    from PIL import Image
+    from media_pipeline import LatestFrame
+    from video_client import decode_into
+
+    # A 640x480 test card: gradients compress like a real scene, noise wouldn't
+    x = np.linspace(0, 255, 640, dtype=np.uint8)
+    y = np.linspace(0, 255, 480, dtype=np.uint8)
+    card = np.dstack([np.tile(x, (480, 1)), np.tile(y[:, None], (1, 640)), np.full((480, 640), 128, np.uint8)])
+    jpeg = cv2.imencode('.jpg', card, [cv2.IMWRITE_JPEG_QUALITY, 70])[1].tobytes()
+    frames_count = min(count, 500)
+
+    def per_frame():
+        frame = cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), cv2.IMREAD_COLOR)
+        return Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+
+    frames = LatestFrame(lambda size: Image.new('RGB', size))
+
+    def reused():
+        decode_into(jpeg, frames)
+        frames.take()
+        frames.release()
+
+    print(f"{'path':<12}{'frames/s':>12}{'KB alloc/frame':>16}")
+    for name, render in (('per-frame', per_frame), ('reused', reused)):
+        render()  # warm up (first frame allocates the reused buffers)
+        start = time.perf_counter()
+        for _ in range(frames_count):
+            render()
+        elapsed = time.perf_counter() - start
+
+        # Peak memory allocated while rendering one frame, averaged
+        tracemalloc.start()
+        allocated = 0
+        for _ in range(50):
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+            render()
+            allocated += tracemalloc.get_traced_memory()[1] - baseline
+        tracemalloc.stop()
+        print(f"{name:<12}{frames_count / elapsed:>12,.0f}{allocated / 50 / 1024:>16,.0f}")
+
+
+def bench_audio(count: int):
+    """Audio codec cost per 20 ms block: encode/decode microseconds, bytes
+    on the wire and signal-to-noise ratio after the round trip (Opus is
+    perceptual and delays its output, so its SNR understates it)"""
+    import numpy as np
+    from audio_codec import create_codec, supported_codecs
+
+    rate, block = 16000, 320
+    blocks_count = min(count, 2000)
+
+    # Speech-like test signal: a voiced 150 Hz buzz with harmonics, its
+    # loudness rising and falling like syllables, over faint background noise
+    t = np.arange(blocks_count * block) / rate
+    voice = sum(np.sin(2 * np.pi * 150 * h * t) / h for h in range(1, 8))
+    envelope = 0.5 + 0.5 * np.sin(2 * np.pi * 4 * t)
+    signal = 6000 * voice * envelope + np.random.default_rng(0).normal(0, 100, len(t))
+    blocks = np.clip(signal, -32768, 32767).astype(np.int16).reshape(blocks_count, block)
+
+    print(f"{'codec':<8}{'encode us':>11}{'decode us':>11}{'bytes':>8}{'SNR dB':>8}")
+    for name in reversed(supported_codecs(block, rate)):
+        encoder, decoder = create_codec(name, rate), create_codec(name, rate)
+
+        start = time.perf_counter()
+        payloads = [encoder.encode(samples) for samples in blocks]
+        encode_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        decoded = [decoder.decode(payload) for payload in payloads]
+        decode_time = time.perf_counter() - start
+
+        original = blocks.reshape(-1).astype(np.float64)
+        error = np.concatenate([samples[:block] for samples in decoded]).astype(np.float64) - original
+        noise = np.dot(error, error)
+        snr = 10 * np.log10(np.dot(original, original) / noise) if noise else float('inf')
+        size = sum(len(payload) for payload in payloads) / blocks_count
+        print(f"{name:<8}{encode_time / blocks_count * 1e6:>11,.1f}{decode_time / blocks_count * 1e6:>11,.1f}"
+              f"{size:>8.0f}{snr:>8.1f}")
+
+
+BENCHMARKS = {
+    'codec': bench_codec,
+    'coalesce': bench_coalesce,
+    'render': bench_render,
+    'audio': bench_audio,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('names', nargs='*', metavar='name',
+                        help=f"benchmarks to run: {', '.join(BENCHMARKS)} (default: all)")
+    parser.add_argument('--count', type=int, default=100000, help="messages per run")
+    args = parser.parse_args()
+
+    unknown = [name for name in args.names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmark(s): {', '.join(unknown)}")
+
+    for name in args.names or BENCHMARKS:
+        print(f"== {name} ==")
+        BENCHMARKS[name](args.count)
+        print()
+
+
+if __name__ == "__main__":
+    main()
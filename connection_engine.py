@@ -0,0 +1,332 @@
+"""
+Connection Engines
+Socket I/O strategies used by P2PClient.
+
+ThreadEngine keeps the original model: blocking sockets with a receive
+thread and a writer thread per peer. SelectorEngine serves the listening
+socket and every peer socket from a single selectors event loop, so
+hundreds of peers cost one thread.
+
+Both engines take sends through each PeerConnection's outbound queue, so
+a sender never waits on a peer's socket. With coalescing enabled on the
+client, queued frames are held for up to coalesce_delay seconds (or until
+coalesce_bytes are waiting) and written with a single sendmsg call.
+"""
+import selectors
+import socket
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional
+
+from peer_connection import OutboundFrame, PeerConnection, notify_done
+
+
+# sendmsg (writev) is unavailable on Windows; fall back to one joined buffer
+HAS_SENDMSG = hasattr(socket.socket, 'sendmsg')
+MAX_IOV = 512  # stay under the platform's IOV_MAX (1024 on Linux)
+
+
+def send_frames(sock: socket.socket, frames: List[OutboundFrame]) -> int:
+    """Write a batch of frames with one syscall, returning the bytes sent"""
+    if len(frames) == 1:
+        return sock.send(frames[0].data)
+    if HAS_SENDMSG:
+        return sock.sendmsg([frame.data for frame in frames[:MAX_IOV]])
+    return sock.send(b''.join(frame.data for frame in frames))
+
+
+class ThreadEngine:
+    """Thread-per-peer engine using blocking sockets"""
+
+    def __init__(self, client):
+        self.client = client
+        self.server_socket: Optional[socket.socket] = None
+
+    def start(self, server_socket: socket.socket):
+        """Start accepting connections on the listening socket"""
+        self.server_socket = server_socket
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+
+    def stop(self):
+        """Stop the engine (sockets are closed by the client)"""
+        pass
+
+    def forget(self, conn: PeerConnection):
+        """Called after a connection is closed; its threads exit on their own"""
+        pass
+
+    def add_connection(self, conn: PeerConnection):
+        """Start serving an established connection"""
+        threading.Thread(target=self._receive_loop, args=(conn,), daemon=True).start()
+        threading.Thread(target=self._write_loop, args=(conn,), daemon=True).start()
+
+    def send(self, conn: PeerConnection, data: bytes, on_done: Optional[Callable] = None):
+        """Queue data for the peer's writer thread"""
+        conn.enqueue(data, on_done)
+
+    def _accept_loop(self):
+        """Accept incoming peer connections"""
+        while self.client.running:
+            try:
+                client_socket, address = self.server_socket.accept()
+                print(f"Incoming connection from {address}")
+                conn = self.client._create_connection(client_socket, f"{address[0]}:{address[1]}")
+                self.add_connection(conn)
+            except Exception as e:
+                if self.client.running:
+                    print(f"Accept error: {e}")
+
+    def _receive_loop(self, conn: PeerConnection):
+        """Receive data from a peer until it disconnects"""
+        try:
+            while self.client.running:
+                if not conn.decoder.recv_into(conn.sock):
+                    break
+                self.client._on_data(conn)
+        except Exception as e:
+            if self.client.running and not conn.closed:
+                print(f"Receive error from {conn.address}: {e}")
+        finally:
+            self.client._on_disconnect(conn)
+
+    def _write_loop(self, conn: PeerConnection):
+        """Drain the peer's outbound queue with blocking writes"""
+        client = self.client
+        while not conn.closed:
+            batch = conn.next_batch()
+            if not batch:
+                continue
+            if client.coalesce_delay > 0:
+                # Give the queue a moment to fill before paying for a syscall
+                conn.wait_for_bytes(client.coalesce_bytes, batch[0].queued_at + client.coalesce_delay)
+                batch = conn.next_batch(client.coalesce_bytes, timeout=0)
+                if not batch:
+                    continue
+            try:
+                while batch:
+                    done = conn.advance(send_frames(conn.sock, batch))
+                    notify_done(done)
+                    batch = batch[len(done):]
+            except OSError as e:
+                if not conn.closed:
+                    print(f"Send error to {conn.address}: {e}")
+                self.client._on_disconnect(conn, str(e))
+                return
+
+
+class SelectorEngine:
+    """Single event loop serving every peer socket via selectors"""
+
+    def __init__(self, client):
+        self.client = client
+        self.selector = selectors.DefaultSelector()
+        self.server_socket: Optional[socket.socket] = None
+        self.loop_thread: Optional[threading.Thread] = None
+
+        # Work handed over from other threads, applied inside the loop
+        self._pending_add: deque = deque()
+        self._pending_write: deque = deque()
+        self._pending_forget: deque = deque()
+
+        # Coalescing connections waiting for their flush deadline
+        self._flush_at: Dict[PeerConnection, float] = {}
+
+        # Self-pipe used to wake the loop from other threads
+        self._wake_recv, self._wake_send = socket.socketpair()
+        self._wake_recv.setblocking(False)
+        self._wake_send.setblocking(False)
+
+    def start(self, server_socket: socket.socket):
+        """Start the event loop on the listening socket"""
+        self.server_socket = server_socket
+        server_socket.setblocking(False)
+        self.selector.register(server_socket, selectors.EVENT_READ, None)
+        self.selector.register(self._wake_recv, selectors.EVENT_READ, None)
+        self.loop_thread = threading.Thread(target=self._loop, daemon=True)
+        self.loop_thread.start()
+
+    def stop(self):
+        """Wake the loop so it can notice the client has stopped"""
+        self._wake()
+
+    def add_connection(self, conn: PeerConnection):
+        """Hand an established connection over to the event loop"""
+        conn.sock.setblocking(False)
+        self._pending_add.append(conn)
+        self._wake()
+
+    def send(self, conn: PeerConnection, data: bytes, on_done: Optional[Callable] = None):
+        """Queue data for a peer; the loop writes it when the socket is ready"""
+        # A non-empty queue is already being written or awaiting a flush
+        if conn.enqueue(data, on_done):
+            self._pending_write.append(conn)
+            self._wake()
+
+    def forget(self, conn: PeerConnection):
+        """Unregister a closed connection from the loop"""
+        self._pending_forget.append(conn)
+        self._wake()
+
+    def _wake(self):
+        try:
+            self._wake_send.send(b'\0')
+        except (BlockingIOError, OSError):
+            # Pipe already full (loop will wake anyway) or engine shut down
+            pass
+
+    def _loop(self):
+        """Event loop: accept, read, write"""
+        try:
+            while self.client.running:
+                timeout = 1.0
+                if self._flush_at:
+                    timeout = max(0.0, min(self._flush_at.values()) - time.monotonic())
+                for key, events in self.selector.select(timeout=timeout):
+                    if key.fileobj is self.server_socket:
+                        self._accept()
+                    elif key.fileobj is self._wake_recv:
+                        self._drain_wake()
+                    else:
+                        conn = key.data
+                        if conn.closed:
+                            continue  # closed earlier in this batch, forget follows
+                        if events & selectors.EVENT_READ:
+                            self._read(conn)
+                        if events & selectors.EVENT_WRITE and not conn.closed:
+                            self._write(conn)
+                self._flush_due()
+                self._apply_pending()
+        except Exception as e:
+            if self.client.running:
+                print(f"Event loop error: {e}")
+        finally:
+            self.selector.close()
+            self._wake_recv.close()
+            self._wake_send.close()
+
+    def _drain_wake(self):
+        try:
+            while self._wake_recv.recv(4096):
+                pass
+        except (BlockingIOError, OSError):
+            pass
+
+    def _apply_pending(self):
+        """Register new connections, arm write interest and drop closed links"""
+        while self._pending_forget:
+            conn = self._pending_forget.popleft()
+            self._flush_at.pop(conn, None)
+            try:
+                self.selector.unregister(conn.sock)
+            except (KeyError, ValueError):
+                pass
+
+        while self._pending_add:
+            conn = self._pending_add.popleft()
+            if conn.closed:
+                continue
+            self.selector.register(conn.sock, selectors.EVENT_READ, conn)
+            if conn.outbound:
+                self._pending_write.append(conn)
+
+        while self._pending_write:
+            conn = self._pending_write.popleft()
+            if conn.closed:
+                continue
+            # Not registered yet is fine: picked up when its add is applied
+            self._set_events(conn, selectors.EVENT_READ | selectors.EVENT_WRITE)
+
+    def _set_events(self, conn: PeerConnection, events: int):
+        try:
+            self.selector.modify(conn.sock, events, conn)
+        except (KeyError, ValueError, OSError):
+            # Not registered, or closed by another thread (forget follows)
+            pass
+
+    def _accept(self):
+        while True:
+            try:
+                client_socket, address = self.server_socket.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                if self.client.running:
+                    print(f"Accept error: {e}")
+                return
+            print(f"Incoming connection from {address}")
+            client_socket.setblocking(False)
+            conn = self.client._create_connection(client_socket, f"{address[0]}:{address[1]}")
+            self.selector.register(client_socket, selectors.EVENT_READ, conn)
+
+    def _read(self, conn: PeerConnection):
+        try:
+            received = conn.decoder.recv_into(conn.sock)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as e:
+            if self.client.running:
+                print(f"Receive error from {conn.address}: {e}")
+            self._drop(conn)
+            return
+
+        if not received:
+            self._drop(conn)
+            return
+
+        try:
+            self.client._on_data(conn)
+        except Exception as e:
+            print(f"Receive error from {conn.address}: {e}")
+            self._drop(conn)
+
+    def _flush_due(self):
+        """Write out coalescing connections whose delay has expired"""
+        if not self._flush_at:
+            return
+        now = time.monotonic()
+        for conn in [c for c, deadline in self._flush_at.items() if deadline <= now]:
+            del self._flush_at[conn]
+            if not conn.closed:
+                self._write(conn, force=True)
+
+    def _write(self, conn: PeerConnection, force: bool = False):
+        """Write as much of the outbound queue as the socket accepts"""
+        client = self.client
+        coalescing = client.coalesce_delay > 0
+        if coalescing and not force:
+            deadline = conn.flush_deadline(client.coalesce_delay, client.coalesce_bytes)
+            if deadline is not None:
+                # Hold the frames; the loop timeout fires at the deadline
+                self._flush_at.setdefault(conn, deadline)
+                self._set_events(conn, selectors.EVENT_READ)
+                return
+        self._flush_at.pop(conn, None)
+
+        max_bytes = client.coalesce_bytes if coalescing else 0
+        while True:
+            batch = conn.next_batch(max_bytes, timeout=0)
+            if not batch:
+                self._set_events(conn, selectors.EVENT_READ)
+                return
+            length = sum(len(frame.data) for frame in batch)
+            try:
+                sent = send_frames(conn.sock, batch)
+            except (BlockingIOError, InterruptedError):
+                self._set_events(conn, selectors.EVENT_READ | selectors.EVENT_WRITE)
+                return
+            except OSError as e:
+                print(f"Send error to {conn.address}: {e}")
+                self._drop(conn, str(e))
+                return
+            notify_done(conn.advance(sent))
+            if sent < length:
+                self._set_events(conn, selectors.EVENT_READ | selectors.EVENT_WRITE)
+                return
+
+    def _drop(self, conn: PeerConnection, reason: str = "connection closed"):
+        try:
+            self.selector.unregister(conn.sock)
+        except (KeyError, ValueError):
+            pass
+        self.client._on_disconnect(conn, reason)
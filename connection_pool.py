@@ -0,0 +1,116 @@
+"""
+Connection Pool Module
+One live link per peer identity, reused across connect calls.
+
+Links are keyed by the username from the handshake (or by the dialled
+address for peers that never say who they are) and reachable through
+every address alias they are known by: the address we dialled, the
+peer's listening address and the ephemeral address of an inbound
+socket. Least recently used links are evicted when the pool is over
+size or a link has been idle too long.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from peer_connection import PeerConnection
+
+
+class ConnectionPool:
+    """Live peer links keyed by identity, in least-recently-used order"""
+
+    def __init__(self, max_size: int = 64, idle_timeout: float = 300.0):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout  # seconds, 0 disables idle eviction
+        self._lock = threading.Lock()
+        self._links: "OrderedDict[str, PeerConnection]" = OrderedDict()  # key -> link, LRU first
+        self._aliases: Dict[str, str] = {}  # 'ip:port' -> key
+
+    def add(self, conn: PeerConnection, key: str, local_username: str,
+            aliases: List[str] = ()) -> Optional[PeerConnection]:
+        """Pool a link under `key`, returning a duplicate that should be closed.
+
+        If another live link to the same peer exists, one of the two is
+        kept using a rule both ends agree on, and the other is returned.
+        """
+        with self._lock:
+            loser = None
+            existing = self._links.get(key)
+            if existing is not None and existing is not conn and not existing.closed:
+                keep = preferred_link(existing, conn, local_username)
+                loser = conn if keep is existing else existing
+                conn = keep
+
+            # Re-key a link first pooled under its dialled address
+            for old_key, link in list(self._links.items()):
+                if link is conn and old_key != key:
+                    del self._links[old_key]
+                    self._aliases[old_key] = key
+
+            self._links[key] = conn
+            self._links.move_to_end(key)
+            for alias in (conn.address, *aliases):
+                if alias and alias != key:
+                    self._aliases[alias] = key
+            return loser
+
+    def remove(self, conn: PeerConnection):
+        """Forget a link (its aliases go with it)"""
+        with self._lock:
+            keys = [key for key, link in self._links.items() if link is conn]
+            for key in keys:
+                del self._links[key]
+            if keys:
+                self._aliases = {
+                    alias: key for alias, key in self._aliases.items() if key not in keys
+                }
+
+    def get(self, key: str) -> Optional[PeerConnection]:
+        """Live link for a username or any of its addresses"""
+        with self._lock:
+            conn = self._links.get(key)
+            if conn is None:
+                target = self._aliases.get(key)
+                conn = self._links.get(target) if target else None
+            if conn is None or conn.closed:
+                return None
+            return conn
+
+    def touch(self, conn: PeerConnection):
+        """Mark a link as just used"""
+        conn.last_used = time.monotonic()
+
+    def evictable(self, now: Optional[float] = None) -> List[PeerConnection]:
+        """Links to close: idle past idle_timeout, then LRU links over max_size"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            links = sorted(self._links.values(), key=lambda conn: conn.last_used)
+        victims = []
+        if self.idle_timeout:
+            victims = [conn for conn in links if now - conn.last_used > self.idle_timeout]
+        excess = len(links) - len(victims) - self.max_size
+        if excess > 0:
+            victims += [conn for conn in links if conn not in victims][:excess]
+        return victims
+
+    def __len__(self) -> int:
+        return len(self._links)
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key) is not None
+
+
+def preferred_link(a: PeerConnection, b: PeerConnection, local_username: str) -> PeerConnection:
+    """Pick which of two links to the same peer survives.
+
+    Keep the link dialled by the side with the smaller username; both
+    ends apply the same rule, so they close the same duplicate. If both
+    links were dialled by the same side, keep the older one.
+    """
+    def dialler(conn: PeerConnection) -> str:
+        return local_username if conn.initiated else (conn.username or '')
+
+    if dialler(a) == dialler(b):
+        return a
+    return a if dialler(a) < dialler(b) else b
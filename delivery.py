@@ -0,0 +1,66 @@
+"""
+Delivery Tracking Module
+Per-peer delivery status for queued sends and group broadcasts
+"""
+import threading
+from concurrent.futures import Future
+from typing import Dict, Iterable, List, Optional
+
+
+# Delivery statuses
+PENDING = 'pending'
+SENT = 'sent'        # fully written to the peer's socket
+FAILED = 'failed'    # connection error before the message was written
+DROPPED = 'dropped'  # discarded by the peer's send-queue overflow policy
+
+
+class BroadcastReport:
+    """Outcome of a broadcast, one status per peer address"""
+
+    def __init__(self, peers: Iterable[str]):
+        self.statuses: Dict[str, str] = {peer: PENDING for peer in peers}
+        self.errors: Dict[str, str] = {}
+
+    @property
+    def delivered(self) -> List[str]:
+        """Peers the message was written to"""
+        return [peer for peer, status in self.statuses.items() if status == SENT]
+
+    @property
+    def failed(self) -> List[str]:
+        """Peers the message could not be delivered to"""
+        return [peer for peer, status in self.statuses.items() if status not in (SENT, PENDING)]
+
+    def __repr__(self) -> str:
+        return f"BroadcastReport(delivered={len(self.delivered)}, failed={len(self.failed)})"
+
+
+class BroadcastTracker:
+    """Collects per-peer results and resolves a Future once all are in"""
+
+    def __init__(self, peers: Iterable[str]):
+        self.report = BroadcastReport(peers)
+        self.future: Future = Future()
+        self._remaining = len(self.report.statuses)
+        self._lock = threading.Lock()
+        if not self._remaining:
+            self.future.set_result(self.report)
+
+    def callback_for(self, peer: str):
+        """Delivery callback for one peer: callback(status, error=None)"""
+        def on_done(status: str, error: Optional[str] = None):
+            self.resolve(peer, status, error)
+        return on_done
+
+    def resolve(self, peer: str, status: str, error: Optional[str] = None):
+        """Record the outcome for a peer (later results for it are ignored)"""
+        with self._lock:
+            if self.report.statuses.get(peer) != PENDING:
+                return
+            self.report.statuses[peer] = status
+            if error:
+                self.report.errors[peer] = error
+            self._remaining -= 1
+            done = self._remaining == 0
+        if done:
+            self.future.set_result(self.report)
@@ -0,0 +1,125 @@
+"""
+Wire Framing Module
+Newline-delimited and length-prefixed message framing for peer links.
+
+A length-prefixed frame is FRAME_MAGIC followed by a 4-byte big-endian
+payload length. FRAME_MAGIC (0xFE) never appears in UTF-8 text, so a
+decoder can tell the two framings apart at every message boundary and
+old newline-JSON peers keep working on the same link.
+"""
+import socket
+import struct
+from typing import Iterator
+
+
+FRAMING_NEWLINE = 'newline'
+FRAMING_LENGTH = 'length'
+
+FRAME_MAGIC = 0xFE
+FRAME_HEADER = struct.Struct('!BI')  # magic, payload length
+
+MAX_FRAME_SIZE = 16 * 1024 * 1024  # 16MB
+
+
+def encode_frame(payload: bytes, framing: str = FRAMING_LENGTH) -> bytes:
+    """Wrap a payload for the given framing"""
+    if framing == FRAMING_LENGTH:
+        return FRAME_HEADER.pack(FRAME_MAGIC, len(payload)) + payload
+    return payload + b'\n'
+
+
+class FrameDecoder:
+    """Incremental frame parser over a reusable receive buffer.
+
+    Data is read straight into the free tail of a bytearray with
+    recv_into, and frames are handed out as memoryview slices of that
+    buffer. A slice is only valid until the next call to recv_into.
+    """
+
+    def __init__(self, initial_size: int = 65536, max_frame_size: int = MAX_FRAME_SIZE):
+        self.max_frame_size = max_frame_size
+        self._buffer = bytearray(initial_size)
+        self._view = memoryview(self._buffer)
+        self._start = 0  # first unparsed byte
+        self._end = 0    # end of received data
+        self._scan = 0   # newline search resumes here
+        self._needed = 0  # bytes required for the frame being parsed
+
+    def pending(self) -> int:
+        """Number of received bytes not yet returned as frames"""
+        return self._end - self._start
+
+    def recv_into(self, sock: socket.socket) -> int:
+        """Read from a socket into the buffer, returning the byte count (0 on EOF)"""
+        self._reserve(self._needed, 1)
+        return self._commit(sock.recv_into(self._view[self._end:]))
+
+    def feed(self, data: bytes):
+        """Append already-received bytes to the buffer"""
+        self._reserve(0, len(data))
+        self._view[self._end:self._end + len(data)] = data
+        self._commit(len(data))
+
+    def frames(self) -> Iterator[memoryview]:
+        """Yield every complete frame payload currently in the buffer"""
+        buffer = self._buffer
+        while self._start < self._end:
+            start = self._start
+            available = self._end - start
+
+            if buffer[start] == FRAME_MAGIC:
+                if available < FRAME_HEADER.size:
+                    self._needed = FRAME_HEADER.size
+                    return
+                _, length = FRAME_HEADER.unpack_from(buffer, start)
+                if length > self.max_frame_size:
+                    raise ValueError(f"Frame of {length} bytes exceeds limit")
+                total = FRAME_HEADER.size + length
+                if available < total:
+                    self._needed = total
+                    return
+                self._start = self._scan = start + total
+                self._needed = 0
+                yield self._view[start + FRAME_HEADER.size:start + total]
+            else:
+                end = buffer.find(b'\n', max(self._scan, start), self._end)
+                if end < 0:
+                    self._scan = self._end
+                    if available > self.max_frame_size:
+                        raise ValueError("Line exceeds frame size limit")
+                    self._needed = available + 1
+                    return
+                self._start = self._scan = end + 1
+                self._needed = 0
+                if end > start:
+                    yield self._view[start:end]
+
+    def _commit(self, count: int) -> int:
+        self._end += count
+        return count
+
+    def _reserve(self, needed: int, free: int):
+        """Ensure room for a `needed`-byte frame and `free` bytes after the data"""
+        capacity = len(self._buffer)
+        if self._end + free <= capacity and self._start + needed <= capacity:
+            return
+
+        pending = self._end - self._start
+        if self._start > 0:
+            # Move the partial frame to the front (same length, no resize)
+            scan_offset = self._scan - self._start
+            self._buffer[:pending] = self._buffer[self._start:self._end]
+            self._start, self._end = 0, pending
+            self._scan = scan_offset
+
+        required = max(needed, pending + free)
+        if required <= capacity:
+            return
+
+        while capacity < required:
+            capacity *= 2
+        grown = bytearray(capacity)
+        grown[:pending] = self._buffer[:pending]
+        self._view.release()
+        self._buffer = grown
+        self._view = memoryview(grown)
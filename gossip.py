@@ -0,0 +1,76 @@
+"""
+Gossip Module
+Helpers for relaying group messages over a partial mesh.
+
+Each group message carries a unique msg_id and a hop budget. A node
+delivers a message the first time it sees the id and forwards it to a
+bounded random subset of its peers, so per-node upload stays constant as
+the group grows.
+"""
+import itertools
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Sequence
+
+
+class SeenCache:
+    """Set of recently seen message ids with TTL eviction.
+
+    Every entry lives for the same TTL, so insertion order is expiry
+    order and eviction only ever looks at the oldest entries.
+    """
+
+    def __init__(self, ttl: float = 60.0, max_size: int = 100000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._expiry: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, msg_id: str) -> bool:
+        """Record an id; returns False if it was already seen"""
+        now = time.monotonic()
+        with self._lock:
+            self._evict(now)
+            if msg_id in self._expiry:
+                return False
+            self._expiry[msg_id] = now + self.ttl
+            if len(self._expiry) > self.max_size:
+                self._expiry.popitem(last=False)
+            return True
+
+    def __contains__(self, msg_id: str) -> bool:
+        with self._lock:
+            self._evict(time.monotonic())
+            return msg_id in self._expiry
+
+    def __len__(self) -> int:
+        return len(self._expiry)
+
+    def _evict(self, now: float):
+        expiry = self._expiry
+        while expiry:
+            oldest = next(iter(expiry.values()))
+            if oldest > now:
+                break
+            expiry.popitem(last=False)
+
+
+class MessageIdGenerator:
+    """Unique message ids: a random per-process prefix plus a counter"""
+
+    def __init__(self):
+        self._prefix = os.urandom(6).hex()
+        self._counter = itertools.count()
+
+    def next_id(self) -> str:
+        return f"{self._prefix}-{next(self._counter):x}"
+
+
+def choose_relays(candidates: Sequence, fanout: int) -> List:
+    """Pick up to `fanout` random relay targets"""
+    if len(candidates) <= fanout:
+        return list(candidates)
+    return random.sample(list(candidates), fanout)
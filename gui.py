@@ -2,9 +2,10 @@
 GUI for P2P Chat Application
 Simple Tkinter-based interface
 """
+import math
 import tkinter as tk
 from tkinter import ttk, scrolledtext, messagebox
-from p2p_client import P2PClient
+from p2p_client import P2PClient, LINK_CONNECTED, LINK_DISCONNECTED
 import threading
 
 
@@ -160,41 +161,52 @@ class ChatGUI:
             messagebox.showwarning("Invalid Address", "Please use a real username or ID")
             return
             
+        # Lookups and dialling can block, so they run off the Tk thread
+        threading.Thread(target=self._connect_worker, args=(target,), daemon=True).start()
+        
+    def _connect_worker(self, target: str):
+        """Connect in the background, then report back on the Tk thread"""
         try:
             success = False
+            peer = display = None
             
             # Case 1: IP:PORT format
             if ':' in target:
                 success = self.client.connect_to_peer(target)
-                if success:
-                    self.current_peer = target
-                    # Display name is same as address
-                    self.current_peer_display = target
+                # Display name is same as address
+                peer = display = target
             
             # Case 2: Username
             else:
                 success = self.client.connect_by_username(target)
                 if success:
                     # Get the IP for sending messages
-                    address = self.client.discovery.get_peer_address(target)
-                    self.current_peer = address
+                    peer = self.client.discovery.get_peer_address(target)
                     # Store friendly name for display
-                    self.current_peer_display = f"{target} ({address})"
-                
-            if success:
-                self.show_chat_screen()
-            else:
-                messagebox.showerror("Connection Failed", 
-                                   f"Could not connect to '{target}'.\n\n"
-                                   "Troubleshooting:\n"
-                                   "1. Is the peer online?\n"
-                                   "2. Use 'localhost:PORT' if on same computer\n"
-                                   "3. Check if firewall is blocking")
-                                   
+                    display = f"{target} ({peer})"
+                    
+            self.root.after(0, lambda: self._on_connect_result(target, success, peer, display))
+            
         except ValueError as e:
-             messagebox.showerror("Not Found", str(e))
+            error = str(e)
+            self.root.after(0, lambda: messagebox.showerror("Not Found", error))
         except Exception as e:
-            messagebox.showerror("Connection Error", str(e))
+            error = str(e)
+            self.root.after(0, lambda: messagebox.showerror("Connection Error", error))
+            
+    def _on_connect_result(self, target: str, success: bool, peer: str, display: str):
+        """Tk thread: open the chat, or explain why the connection failed"""
+        if success:
+            self.current_peer = peer
+            self.current_peer_display = display
+            self.show_chat_screen()
+        else:
+            messagebox.showerror("Connection Failed", 
+                               f"Could not connect to '{target}'.\n\n"
+                               "Troubleshooting:\n"
+                               "1. Is the peer online?\n"
+                               "2. Use 'localhost:PORT' if on same computer\n"
+                               "3. Check if firewall is blocking")
             
     def show_chat_screen(self):
         """Show chat interface"""
@@ -215,6 +227,13 @@ class ChatGUI:
                 font=('Arial', 12, 'bold'),
                 bg='#312e81', fg='white').pack(side='left')
         
+        # Link quality, refreshed while this screen is open
+        rtt_label = tk.Label(header, text="",
+                            font=('Arial', 9),
+                            bg='#312e81', fg='#c7d2fe')
+        rtt_label.pack(side='right', padx=10)
+        self.update_rtt_label(rtt_label)
+        
         # Messages area
         self.messages_text = scrolledtext.ScrolledText(
             self.root,
@@ -245,6 +264,19 @@ class ChatGUI:
         ttk.Button(input_frame, text="📞 Voice",
                   command=self.start_audio_call).pack(side='right', padx=5)
         
+    def update_rtt_label(self, label: tk.Label):
+        """Show the current peer's round-trip time and jitter until the label is destroyed"""
+        if not label.winfo_exists():
+            return
+        state = self.client.get_peer_state(self.current_peer) if self.client else LINK_DISCONNECTED
+        stats = self.client.get_peer_rtt(self.current_peer) if state == LINK_CONNECTED else None
+        if stats is None:
+            # An idle link the pool closed is re-dialled on the next message
+            label.config(text=state)
+        elif stats['rtt_ms'] is not None:
+            label.config(text=f"RTT {stats['rtt_ms']:.0f} ms ± {stats['jitter_ms']:.0f}")
+        self.root.after(2000, lambda: self.update_rtt_label(label))
+        
     def send_message(self):
         """Send a message"""
         message = self.message_entry.get().strip()
@@ -258,7 +290,8 @@ class ChatGUI:
         except Exception as e:
             messagebox.showerror("Error", f"Failed to send: {e}")
             
-    def on_message_received(self, sender: str, text: str, timestamp: float, msg_type: str = 'message', peer_address: str = None):
+    def on_message_received(self, sender: str, text: str, timestamp: float, msg_type: str = 'message', peer_address: str = None,
+                            codecs: list = None, codec: str = None):
         """Callback for incoming messages"""
         
         # Handle Group Messages
@@ -270,6 +303,13 @@ class ChatGUI:
                  pass
              return
 
+        # The callee's codec choice for the call we started
+        if msg_type == 'audio_answer':
+            audio_client = getattr(self, 'audio_client', None)
+            if audio_client and audio_client.running:
+                audio_client.set_codec(codec)
+            return
+            
         # Handle Private Messages
         if self.screen == "chat":
             if msg_type == 'video_request':
@@ -285,7 +325,7 @@ class ChatGUI:
                 response = messagebox.askyesno("Incoming Voice Call",
                                              f"Voice call from {sender}. Accept?")
                 if response:
-                     self.root.after(0, lambda: self.start_audio_session(peer_address))
+                     self.root.after(0, lambda: self.start_audio_session(peer_address, answer=True, codecs=codecs))
             
     def display_message(self, sender: str, text: str):
         """Display a message in the chat"""
@@ -394,28 +434,57 @@ class ChatGUI:
             video_win.geometry("660x520")
             video_win.configure(bg='#1e1b4b')
             
-            # Video Frame
-            video_label = tk.Label(video_win, bg='black')
-            video_label.pack(fill='both', expand=True, padx=10, pady=10)
+            # Video Frame: one tile per incoming stream
+            video_grid = tk.Frame(video_win, bg='black')
+            video_grid.pack(fill='both', expand=True, padx=10, pady=10)
+            tiles = {}  # stream id -> label
             
             tk.Label(video_win, text="Waiting for video...", bg='#1e1b4b', fg='white').pack()
             
             # Start Video Client
             # Use local port based on our Chat Port + 1
             # Remote port is Peer Chat Port + 1
-            vc = VideoClient(self.client.port)
+            vc = VideoClient(self.client.port, width=640, height=480, quality=70)
             
-            def on_frame(image):
-                # Update UI in main thread
+            def layout_tiles():
+                columns = max(1, math.ceil(math.sqrt(len(tiles))))
+                for i, label in enumerate(tiles.values()):
+                    label.grid(row=i // columns, column=i % columns, padx=2, pady=2)
+            
+            def on_frame(stream_id):
+                # Update UI in main thread; frames that arrive before this
+                # runs are coalesced, so only the newest one is drawn
                 def _update():
                     if not video_win.winfo_exists():
                         return
-                    photo = ImageTk.PhotoImage(image)
-                    video_label.config(image=photo)
-                    video_label.image = photo # Keep reference
+                    image = vc.take_frame(stream_id)
+                    if image is None:
+                        return
+                    try:
+                        video_label = tiles.get(stream_id)
+                        if video_label is None:
+                            video_label = tiles[stream_id] = tk.Label(video_grid, bg='black')
+                            layout_tiles()
+                        photo = getattr(video_label, 'image', None)
+                        if photo is not None and (photo.width(), photo.height()) == image.size:
+                            photo.paste(image)  # reuse the Tk image
+                        else:
+                            photo = ImageTk.PhotoImage(image)
+                            video_label.config(image=photo)
+                            video_label.image = photo # Keep reference
+                    finally:
+                        vc.release_frame(stream_id)
                 self.root.after(0, _update)
             
-            vc.start_call(ip, port, on_frame)
+            def on_stream_end(stream_id):
+                def _remove():
+                    video_label = tiles.pop(stream_id, None)
+                    if video_label is not None and video_win.winfo_exists():
+                        video_label.destroy()
+                        layout_tiles()
+                self.root.after(0, _remove)
+            
+            vc.start_call(ip, port, on_frame, on_stream_end)
             
             # Handle close
             def on_close():
@@ -435,14 +504,18 @@ class ChatGUI:
             return
             
         try:
-            self.client.send_message(self.current_peer, "Starting Voice Call...", msg_type='audio_request')
-            self.start_audio_session(self.current_peer)
+            # Start listening first, so the request can offer this client's codecs
+            if self.start_audio_session(self.current_peer):
+                self.client.send_message(self.current_peer, "Starting Voice Call...", msg_type='audio_request',
+                                         extra={'codecs': self.audio_client.supported_codecs()})
         except Exception as e:
             messagebox.showerror("Error", f"Failed to start audio: {e}")
             
-    def start_audio_session(self, peer_address):
-        """Start audio client"""
+    def start_audio_session(self, peer_address, answer: bool = False, codecs: list = None) -> bool:
+        """Start audio client. When answering a call, send with the first of
+        the caller's offered codecs that this client supports too."""
         from audio_client import AudioClient
+        from audio_codec import choose_codec
         
         try:
             # Parse IP/Port
@@ -456,7 +529,13 @@ class ChatGUI:
             
             # Start Audio Client
             self.audio_client = AudioClient(self.client.port)
-            self.audio_client.start_call(ip, port)
+            codec = choose_codec(codecs, self.audio_client.supported_codecs()) if answer else None
+            self.audio_client.start_call(ip, port, codec=codec)
+            if answer and codecs is not None:
+                # Tell the caller what we picked: with silence suppressed it
+                # might not hear a packet from us (and so the codec) for a while
+                self.client.send_message(peer_address, "Voice call accepted", msg_type='audio_answer',
+                                         extra={'codec': codec})
             
             # Show small dialog
             call_win = tk.Toplevel(self.root)
@@ -471,9 +550,11 @@ class ChatGUI:
                 
             ttk.Button(call_win, text="End Call", command=stop_call).pack()
             call_win.protocol("WM_DELETE_WINDOW", stop_call)
+            return True
             
         except Exception as e:
              messagebox.showerror("Audio Error", f"Could not start audio: {e}")
+             return False
 
     def on_closing(self):
         """Handle window close"""
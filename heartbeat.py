@@ -0,0 +1,77 @@
+"""
+Heartbeat Module
+Round-trip time estimation and TCP keepalive tuning for peer links.
+
+P2PClient pings every link on a fixed interval; the pong echoes the
+ping's send time, giving one RTT sample per interval. Samples are
+smoothed the way TCP does it (RFC 6298) and jitter is tracked like RTP
+interarrival jitter (RFC 3550).
+"""
+import socket
+from typing import Optional
+
+
+class RttEstimator:
+    """Smoothed RTT, RTT variance and jitter from ping/pong samples"""
+
+    ALPHA = 1 / 8   # SRTT gain
+    BETA = 1 / 4    # RTTVAR gain
+    JITTER_GAIN = 1 / 16
+
+    def __init__(self):
+        self.srtt: Optional[float] = None
+        self.rttvar: Optional[float] = None
+        self.jitter = 0.0
+        self.last: Optional[float] = None
+        self.min: Optional[float] = None
+        self.samples = 0
+
+    def update(self, sample: float):
+        """Add an RTT sample in seconds"""
+        if self.srtt is None:
+            self.srtt = sample
+            self.rttvar = sample / 2
+        else:
+            self.rttvar += self.BETA * (abs(self.srtt - sample) - self.rttvar)
+            self.srtt += self.ALPHA * (sample - self.srtt)
+            self.jitter += self.JITTER_GAIN * (abs(sample - self.last) - self.jitter)
+        self.last = sample
+        self.min = sample if self.min is None else min(self.min, sample)
+        self.samples += 1
+
+    def as_dict(self) -> dict:
+        """Estimates in milliseconds (None until the first sample)"""
+        def ms(value):
+            return None if value is None else round(value * 1000, 2)
+
+        return {
+            'rtt_ms': ms(self.srtt),
+            'rtt_var_ms': ms(self.rttvar),
+            'jitter_ms': ms(self.jitter if self.samples else None),
+            'last_rtt_ms': ms(self.last),
+            'min_rtt_ms': ms(self.min),
+            'samples': self.samples,
+        }
+
+
+def enable_keepalive(sock: socket.socket, idle: int, interval: int, count: int):
+    """Turn on TCP keepalive so the kernel notices a silent peer in about
+    idle + interval * count seconds instead of hours.
+
+    Per-socket timings are set where the platform supports them (Linux,
+    macOS, Windows); elsewhere only SO_KEEPALIVE is enabled.
+    """
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        if hasattr(socket, 'TCP_KEEPIDLE'):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, idle)
+        elif hasattr(socket, 'TCP_KEEPALIVE'):  # macOS name for the idle time
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPALIVE, idle)
+        if hasattr(socket, 'TCP_KEEPINTVL'):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, interval)
+        if hasattr(socket, 'TCP_KEEPCNT'):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, count)
+        elif hasattr(socket, 'SIO_KEEPALIVE_VALS'):  # Windows: times in ms, fixed retry count
+            sock.ioctl(socket.SIO_KEEPALIVE_VALS, (1, idle * 1000, interval * 1000))
+    except OSError as e:
+        print(f"Could not enable TCP keepalive: {e}")
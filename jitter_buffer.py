@@ -0,0 +1,139 @@
+"""
+Jitter Buffer Module
+Receive-side reordering and paced playout for media streams.
+
+Each packet carries the sender's capture timestamp. The receiver
+tracks the transit time (arrival minus capture, which includes an
+unknown clock offset) and its variation (RFC 3550 interarrival
+jitter). A frame is played at its capture time plus the smallest
+recent transit plus a playout delay that follows the measured jitter.
+Frames are therefore released on the sender's clock rather than in
+network bursts. Frames that arrive after their slot has played are
+dropped.
+"""
+import heapq
+import threading
+import time
+from collections import deque
+from typing import List, Optional, Tuple
+
+
+def ts_diff(a: int, b: int, bits: int = 32) -> int:
+    """Signed difference a - b of two wrapping timestamps"""
+    half = 1 << (bits - 1)
+    return ((a - b + half) % (1 << bits)) - half
+
+
+class JitterEstimator:
+    """Transit time and RFC 3550 interarrival jitter, in milliseconds"""
+
+    GAIN = 1 / 16
+
+    def __init__(self, window: int = 128):
+        self.jitter = 0.0
+        self._last_transit: Optional[int] = None
+        self._transits: deque = deque(maxlen=window)  # recent transits, for the base delay
+
+    def update(self, capture_ms: int, arrival_ms: int) -> int:
+        """Add a packet and return its transit time (ms, includes clock offset)"""
+        transit = ts_diff(arrival_ms, capture_ms)
+        if self._last_transit is not None:
+            self.jitter += self.GAIN * (abs(transit - self._last_transit) - self.jitter)
+        self._last_transit = transit
+        self._transits.append(transit)
+        return transit
+
+    def base_transit(self) -> int:
+        """Smallest recent transit: the delay of a packet that met no queueing"""
+        return min(self._transits) if self._transits else 0
+
+
+class VideoJitterBuffer:
+    """Reorders frames and releases each at capture time + a jitter-adaptive delay.
+
+    push() is called from the receive thread and pop() from a playout
+    thread, which waits until the next frame is due.
+    """
+
+    def __init__(self, min_delay: float = 0.02, max_delay: float = 0.5,
+                 jitter_factor: float = 3.0, max_frames: int = 32):
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.jitter_factor = jitter_factor  # playout delay = factor * jitter, within bounds
+        self.max_frames = max_frames
+        self.estimator = JitterEstimator()
+        self.delay = min_delay
+        self._heap: List[Tuple[float, int, int, bytes]] = []  # (due, seq, frame id, data)
+        self._seq = 0  # frame ids wrap, so the heap orders ties by arrival
+        self._last_played: Optional[int] = None
+        self._cond = threading.Condition()
+        self._closed = False
+
+        # Counters
+        self.frames_played = 0
+        self.frames_late = 0     # arrived after a newer frame had played
+        self.frames_dropped = 0  # overflowed the buffer
+
+    def push(self, frame_id: int, capture_ms: int, data: bytes, now: Optional[float] = None):
+        """Queue a complete frame (copy it first if it lives in a reused buffer)"""
+        now = time.monotonic() if now is None else now
+        with self._cond:
+            if self._last_played is not None and ts_diff(frame_id, self._last_played) <= 0:
+                self.frames_late += 1
+                return
+            transit = self.estimator.update(capture_ms, int(now * 1000))
+            target = self.jitter_factor * self.estimator.jitter / 1000
+            self.delay = min(self.max_delay, max(self.min_delay, target))
+            # Due when a frame with no queueing delay would have arrived, plus the playout delay
+            due = now + (self.estimator.base_transit() - transit) / 1000 + self.delay
+            heapq.heappush(self._heap, (due, self._seq, frame_id, data))
+            self._seq += 1
+            if len(self._heap) > self.max_frames:
+                # Fall back to the newest frames rather than growing the delay
+                self._heap = heapq.nlargest(self.max_frames, self._heap)
+                heapq.heapify(self._heap)
+                self.frames_dropped += 1
+            self._cond.notify()
+
+    def pop(self, timeout: Optional[float] = None) -> Optional[Tuple[int, bytes]]:
+        """Wait for the next frame to fall due and return (frame id, data).
+
+        Returns None on timeout or once closed.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while not self._closed:
+                now = time.monotonic()
+                if self._heap and self._heap[0][0] <= now:
+                    due, _, frame_id, data = heapq.heappop(self._heap)
+                    if self._last_played is not None and ts_diff(frame_id, self._last_played) <= 0:
+                        self.frames_late += 1  # overtaken while waiting
+                        continue
+                    self._last_played = frame_id
+                    self.frames_played += 1
+                    return frame_id, data
+                wait = self._heap[0][0] - now if self._heap else None
+                if deadline is not None:
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        return None
+                    wait = remaining if wait is None else min(wait, remaining)
+                self._cond.wait(wait)
+            return None
+
+    def close(self):
+        """Wake and stop any waiting pop()"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                'buffered': len(self._heap),
+                'delay_ms': round(self.delay * 1000, 1),
+                'jitter_ms': round(self.estimator.jitter, 1),
+                'frames_played': self.frames_played,
+                'frames_late': self.frames_late,
+                'frames_dropped': self.frames_dropped,
+            }
@@ -0,0 +1,143 @@
+"""
+Media Pipeline Module
+Building blocks for staged capture -> encode -> send pipelines.
+
+Stages are connected by small bounded queues that drop the oldest item
+when full, so a slow stage sheds stale frames instead of building up
+latency, and each stage's processing time is recorded for stats.
+"""
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, Optional
+
+
+class DropOldestQueue:
+    """Bounded FIFO that discards its oldest item to make room"""
+
+    def __init__(self, maxsize: int, on_drop: Optional[Callable[[Any], None]] = None):
+        self._items: deque = deque()
+        self.maxsize = maxsize
+        self.on_drop = on_drop  # called with each discarded item
+        self._cond = threading.Condition()
+        self._closed = False
+        self.dropped = 0
+
+    def put(self, item):
+        dropped = None
+        with self._cond:
+            if len(self._items) >= self.maxsize:
+                dropped = self._items.popleft()
+                self.dropped += 1
+            self._items.append(item)
+            self._cond.notify()
+        if dropped is not None and self.on_drop:
+            self.on_drop(dropped)
+
+    def get(self, timeout: Optional[float] = None):
+        """Oldest item, or None on timeout or once closed"""
+        with self._cond:
+            if not self._items and not self._closed:
+                self._cond.wait(timeout)
+            return self._items.popleft() if self._items else None
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+class StageStats:
+    """Per-stage latency: count, moving average and maximum"""
+
+    GAIN = 1 / 16
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages: Dict[str, list] = {}  # name -> [count, avg, max]
+
+    def record(self, stage: str, seconds: float):
+        with self._lock:
+            entry = self._stages.get(stage)
+            if entry is None:
+                self._stages[stage] = [1, seconds, seconds]
+            else:
+                entry[0] += 1
+                entry[1] += self.GAIN * (seconds - entry[1])
+                entry[2] = max(entry[2], seconds)
+
+    def timed(self, stage: str, started: float) -> float:
+        """Record the time since `started` and return the current time"""
+        now = time.perf_counter()
+        self.record(stage, now - started)
+        return now
+
+    def snapshot(self) -> Dict[str, dict]:
+        with self._lock:
+            return {
+                stage: {'count': count, 'avg_ms': round(avg * 1000, 2), 'max_ms': round(peak * 1000, 2)}
+                for stage, (count, avg, peak) in self._stages.items()
+            }
+
+
+class LatestFrame:
+    """Hands the newest frame from a producer to a slower consumer.
+
+    Triple buffered: the producer fills a spare buffer and publishes
+    it, the consumer takes whatever was published last, so frames it
+    was too slow for are skipped instead of queued. Buffers come from
+    `factory(key)` and are reused until a frame needs a different key
+    (e.g. a new resolution).
+    """
+
+    def __init__(self, factory: Callable[[Any], Any]):
+        self._factory = factory
+        self._lock = threading.Lock()
+        self._buffers = [None, None, None]
+        self._keys = [None, None, None]
+        self._ready: Optional[int] = None    # published, not yet taken
+        self._reading: Optional[int] = None  # taken by the consumer
+        self._writing: Optional[int] = None  # acquired by the producer
+        self.published = 0
+        self.skipped = 0  # published but replaced before the consumer took them
+        self.allocated = 0
+
+    def acquire(self, key):
+        """Buffer for the producer to fill (one the consumer isn't using)"""
+        with self._lock:
+            index = next(i for i in range(3) if i != self._ready and i != self._reading)
+            self._writing = index
+            if self._keys[index] != key:
+                self._buffers[index] = self._factory(key)
+                self._keys[index] = key
+                self.allocated += 1
+            return self._buffers[index]
+
+    def publish(self) -> bool:
+        """Make the acquired buffer the newest frame.
+
+        Returns True if the consumer had nothing waiting, i.e. it needs
+        waking; otherwise the waiting frame is replaced.
+        """
+        with self._lock:
+            idle = self._ready is None
+            if not idle:
+                self.skipped += 1
+            self._ready, self._writing = self._writing, None
+            self.published += 1
+            return idle
+
+    def take(self):
+        """Newest frame for the consumer (None if nothing new); call release() when done"""
+        with self._lock:
+            if self._ready is None:
+                return None
+            self._reading, self._ready = self._ready, None
+            return self._buffers[self._reading]
+
+    def release(self):
+        with self._lock:
+            self._reading = None
@@ -0,0 +1,169 @@
+"""
+Message Codec Module
+Encodes chat message dicts into frame payloads.
+
+JsonCodec is the original format. CompactCodec is a struct-based binary
+format with integer message-type tags; the sender is interned as "the
+peer on this link" (known from the handshake) so the common case costs
+one flag bit instead of a repeated username string.
+"""
+import json
+import struct
+from typing import Dict, Optional
+
+
+CODEC_JSON = 'json'
+CODEC_COMPACT = 'compact'
+
+JSON_START = ord('{')
+
+
+class JsonCodec:
+    """Newline-safe JSON encoding (the original wire format)"""
+
+    name = CODEC_JSON
+
+    def encode(self, msg: dict, local_username: str) -> bytes:
+        return json.dumps(msg).encode()
+
+    def decode(self, payload: memoryview, link_username: Optional[str]) -> dict:
+        return json.loads(bytes(payload))
+
+
+class CompactCodec:
+    """Binary encoding with integer type tags and an interned sender.
+
+    Layout: tag (u8), flags (u8), then optional fields in this order:
+      type name   u16 length + UTF-8 (only when tag is TAG_OTHER)
+      timestamp   f64                 (FLAG_TIMESTAMP)
+      sender      u16 length + UTF-8  (omitted when FLAG_LINK_SENDER)
+      text        u32 length + UTF-8  (FLAG_TEXT)
+      extras      u32 length + JSON   (FLAG_EXTRAS, any other keys)
+
+    Tags stay below ord('{') so a payload can always be told apart
+    from JSON by its first byte.
+    """
+
+    name = CODEC_COMPACT
+
+    TAG_OTHER = 0
+    TYPE_TAGS: Dict[str, int] = {
+        'message': 1,
+        'group_message': 2,
+        'video_request': 3,
+        'audio_request': 4,
+        'ping': 5,
+        'pong': 6,
+    }
+    TAG_TYPES: Dict[int, str] = {tag: name for name, tag in TYPE_TAGS.items()}
+
+    FLAG_TIMESTAMP = 0x01
+    FLAG_LINK_SENDER = 0x02
+    FLAG_SENDER = 0x04
+    FLAG_TEXT = 0x08
+    FLAG_EXTRAS = 0x10
+
+    HEADER = struct.Struct('!BB')
+    TIMESTAMP = struct.Struct('!d')
+    U16 = struct.Struct('!H')
+    U32 = struct.Struct('!I')
+
+    CORE_KEYS = ('type', 'timestamp', 'from', 'text')
+
+    def encode(self, msg: dict, local_username: str) -> bytes:
+        msg_type = msg.get('type')
+        tag = self.TYPE_TAGS.get(msg_type, self.TAG_OTHER)
+        flags = 0
+        parts = [b'']  # placeholder for the header
+        core = 0
+
+        if tag == self.TAG_OTHER:
+            name = str(msg_type).encode()
+            parts += (self.U16.pack(len(name)), name)
+        if msg_type is not None:
+            core += 1
+
+        timestamp = msg.get('timestamp')
+        if timestamp is not None:
+            core += 1
+            flags |= self.FLAG_TIMESTAMP
+            parts.append(self.TIMESTAMP.pack(timestamp))
+
+        sender = msg.get('from')
+        if sender is not None:
+            core += 1
+            if sender == local_username:
+                flags |= self.FLAG_LINK_SENDER
+            else:
+                flags |= self.FLAG_SENDER
+                name = sender.encode()
+                parts += (self.U16.pack(len(name)), name)
+
+        text = msg.get('text')
+        if text is not None:
+            core += 1
+            flags |= self.FLAG_TEXT
+            data = text.encode()
+            parts += (self.U32.pack(len(data)), data)
+
+        if len(msg) > core:
+            extras = {k: v for k, v in msg.items() if k not in self.CORE_KEYS}
+            if extras:
+                flags |= self.FLAG_EXTRAS
+                data = json.dumps(extras, separators=(',', ':')).encode()
+                parts += (self.U32.pack(len(data)), data)
+
+        parts[0] = self.HEADER.pack(tag, flags)
+        return b''.join(parts)
+
+    def decode(self, payload: memoryview, link_username: Optional[str]) -> dict:
+        tag, flags = self.HEADER.unpack_from(payload, 0)
+        offset = self.HEADER.size
+        msg = {}
+
+        if tag == self.TAG_OTHER:
+            msg['type'], offset = self._read_str(payload, offset, self.U16)
+        elif tag in self.TAG_TYPES:
+            msg['type'] = self.TAG_TYPES[tag]
+        else:
+            raise ValueError(f"Unknown message tag {tag}")
+
+        if flags & self.FLAG_TIMESTAMP:
+            msg['timestamp'], = self.TIMESTAMP.unpack_from(payload, offset)
+            offset += self.TIMESTAMP.size
+
+        if flags & self.FLAG_LINK_SENDER:
+            msg['from'] = link_username
+        elif flags & self.FLAG_SENDER:
+            msg['from'], offset = self._read_str(payload, offset, self.U16)
+
+        if flags & self.FLAG_TEXT:
+            msg['text'], offset = self._read_str(payload, offset, self.U32)
+
+        if flags & self.FLAG_EXTRAS:
+            extras, offset = self._read_str(payload, offset, self.U32)
+            msg.update(json.loads(extras))
+
+        return msg
+
+    @staticmethod
+    def _read_str(payload: memoryview, offset: int, prefix: struct.Struct):
+        length, = prefix.unpack_from(payload, offset)
+        start = offset + prefix.size
+        end = start + length
+        if end > len(payload):
+            raise ValueError("Truncated field")
+        return str(payload[start:end], 'utf-8'), end
+
+
+CODECS = {
+    CODEC_JSON: JsonCodec(),
+    CODEC_COMPACT: CompactCodec(),
+}
+
+
+def decode_payload(payload: memoryview, link_username: Optional[str]) -> dict:
+    """Decode a frame payload, detecting the codec from its first byte"""
+    if len(payload) and payload[0] == JSON_START:
+        return CODECS[CODEC_JSON].decode(payload, link_username)
+    return CODECS[CODEC_COMPACT].decode(payload, link_username)
@@ -3,20 +3,118 @@ P2P Client using socket-based direct connections
 This is a simplified alternative to Jami daemon for demonstration
 """
 import socket
-import threading
 import json
-from typing import Callable, Optional
+import struct
+from typing import Callable, Dict, List, Optional
+import threading
 import time
-from peer_discovery import PeerDiscovery
+from concurrent.futures import Future
+from peer_discovery import PeerDiscovery, PeerEvent, MODE_BROADCAST
+from peer_table import PEER_ADDED
+from delivery import BroadcastTracker, FAILED
+from peer_connection import (
+    PeerConnection, DEFAULT_BLOCK_TIMEOUT, DEFAULT_QUEUE_LIMIT, OVERFLOW_DISCONNECT,
+    OVERFLOW_POLICIES,
+)
+from connection_engine import ThreadEngine, SelectorEngine
+from connection_pool import ConnectionPool
+from heartbeat import enable_keepalive
+from framing import FRAMING_LENGTH, FRAMING_NEWLINE, encode_frame
+from message_codec import CODECS, CODEC_COMPACT, CODEC_JSON, decode_payload
+from gossip import MessageIdGenerator, SeenCache, choose_relays
+
+
+ENGINES = {
+    'thread': ThreadEngine,
+    'async': SelectorEngine,
+}
+
+# Peer link states reported by get_peer_state
+LINK_CONNECTED = 'connected'
+LINK_IDLE = 'idle'                  # no open link, but the peer is still discovered
+LINK_DISCONNECTED = 'disconnected'  # failed the heartbeat check, or never seen
 
 
 class P2PClient:
     """Simple P2P client using direct socket connections"""
     
-    def __init__(self, port: int = 5000):
+    # Framings and codecs offered in the handshake, in order of preference
+    SUPPORTED_FRAMINGS = [FRAMING_LENGTH]
+    SUPPORTED_CODECS = [CODEC_COMPACT]
+    
+    # Gossip relay defaults
+    GOSSIP_HOPS = 6  # relay hop limit for group messages
+    SEEN_TTL = 120  # seconds a group message id is remembered
+    
+    MAINTENANCE_INTERVAL = 5  # seconds between idle-link sweeps
+    
+    # TCP keepalive: the kernel gives up on a silent peer after
+    # KEEPALIVE_IDLE + KEEPALIVE_INTERVAL * KEEPALIVE_COUNT seconds
+    KEEPALIVE_IDLE = 10
+    KEEPALIVE_INTERVAL = 3
+    KEEPALIVE_COUNT = 3
+    
+    def __init__(self, port: int = 5000, engine: str = "thread",
+                 queue_limit: int = DEFAULT_QUEUE_LIMIT,
+                 overflow_policy: str = OVERFLOW_DISCONNECT,
+                 block_timeout: float = DEFAULT_BLOCK_TIMEOUT,
+                 coalesce_usec: int = 0,
+                 coalesce_bytes: int = 64 * 1024,
+                 gossip_fanout: int = 0,
+                 discovery_mode: str = MODE_BROADCAST,
+                 max_connections: int = 64,
+                 idle_timeout: float = 300.0,
+                 warm_connect: bool = False,
+                 heartbeat_interval: float = 5.0,
+                 heartbeat_timeout: float = 15.0):
+        """
+        engine: 'thread' (thread per peer) or 'async' (one selectors loop)
+        queue_limit: per-peer send queue high-water mark in bytes
+        overflow_policy: 'drop-oldest', 'block' or 'disconnect' when a
+            peer's queue is over queue_limit
+        block_timeout: how long the 'block' policy waits before evicting
+        coalesce_usec: hold queued frames up to this many microseconds so
+            they go out in one sendmsg call (0 disables coalescing)
+        coalesce_bytes: flush a coalescing batch early once this many
+            bytes are queued, and cap each batch at this size
+        gossip_fanout: relay group messages to at most this many random
+            peers per hop instead of sending to every peer (0 disables)
+        discovery_mode: 'broadcast' or 'multicast' LAN peer discovery
+        max_connections: keep at most this many peer links, closing the
+            least recently used ones beyond it
+        idle_timeout: close links unused for this many seconds (0 disables)
+        warm_connect: open links in the background to newly discovered
+            peers so the first message doesn't wait on a TCP connect
+        heartbeat_interval: ping every peer this often (seconds, 0 disables)
+            to measure RTT and notice dead links
+        heartbeat_timeout: drop a peer that answers pings but has sent
+            nothing for this many seconds
+        """
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown engine '{engine}'. Choose from: {', '.join(ENGINES)}")
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy '{overflow_policy}'. Choose from: {', '.join(OVERFLOW_POLICIES)}")
         self.port = port
+        self.queue_limit = queue_limit
+        self.overflow_policy = overflow_policy
+        self.block_timeout = block_timeout
+        self.coalesce_delay = coalesce_usec / 1_000_000
+        self.coalesce_bytes = coalesce_bytes
+        self.gossip_fanout = gossip_fanout
+        self.discovery_mode = discovery_mode
+        self.seen_messages = SeenCache(ttl=self.SEEN_TTL)
+        self.message_ids = MessageIdGenerator()
         self.username = ""
-        self.peer_connections = {}
+        self.peer_connections: Dict[str, PeerConnection] = {}
+        self.pool = ConnectionPool(max_connections, idle_timeout)
+        self.warm_connect = warm_connect
+        self._warming = set()  # addresses with a background connect in progress
+        self._outbox: Dict[str, List[dict]] = {}  # messages waiting on a background dial, by address
+        self._outbox_lock = threading.Lock()
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_timeout = heartbeat_timeout
+        self._dead_peers = set()  # usernames and addresses dropped by the heartbeat check
+        self.engine = ENGINES[engine](self)
         self.message_callback: Optional[Callable] = None
         self.server_socket: Optional[socket.socket] = None
         self.running = False
@@ -60,12 +158,14 @@ class P2PClient:
         
         self.server_socket.listen(5)
         
-        # Start accept thread
-        accept_thread = threading.Thread(target=self._accept_connections, daemon=True)
-        accept_thread.start()
+        # Start accepting connections
+        self.engine.start(self.server_socket)
+        threading.Thread(target=self._maintenance_loop, daemon=True).start()
+        if self.heartbeat_interval:
+            threading.Thread(target=self._heartbeat_loop, daemon=True).start()
         
         # Start peer discovery
-        self.discovery = PeerDiscovery(username, self.port)
+        self.discovery = PeerDiscovery(username, self.port, mode=self.discovery_mode)
         self.discovery.set_peer_update_callback(self._on_peer_list_update)
         self.discovery.start()
         
@@ -88,7 +188,9 @@ class P2PClient:
         return f"{local_ip}:{self.port}"
         
     def connect_to_peer(self, peer_address: str) -> bool:
-        """Connect to a peer using IP:PORT format"""
+        """Connect to a peer using IP:PORT format, reusing a live link if there is one"""
+        if self.find_connection(peer_address):
+            return True
         try:
             # Validate format
             if ':' not in peer_address:
@@ -121,20 +223,19 @@ class P2PClient:
             handshake = {
                 'type': 'handshake',
                 'username': self.username,
-                'peer_id': self.get_peer_id()
+                'peer_id': self.get_peer_id(),
+                'port': self.port,
+                'framing': self.SUPPORTED_FRAMINGS,
+                'codecs': self.SUPPORTED_CODECS
             }
-            peer_socket.send(json.dumps(handshake).encode() + b'\n')
-            
-            # Store connection
-            self.peer_connections[peer_address] = peer_socket
+            conn = self._create_connection(peer_socket, peer_address)
+            conn.initiated = True
+            # Handshake is always newline JSON so old peers can read it
+            peer_socket.sendall(encode_frame(json.dumps(handshake).encode(), FRAMING_NEWLINE))
             
-            # Start receive thread
-            receive_thread = threading.Thread(
-                target=self._receive_messages,
-                args=(peer_socket, peer_address),
-                daemon=True
-            )
-            receive_thread.start()
+            # Pool the link under its address until the ack names the peer
+            self._register_connection(conn)
+            self.engine.add_connection(conn)
             
             return True
             
@@ -147,12 +248,31 @@ class P2PClient:
         if not self.discovery:
             raise RuntimeError("Discovery not initialized")
             
-        peer_address = self.discovery.get_peer_address(username)
+        if self.pool.get(username):
+            return True
+            
+        # Known peers return at once; others are asked for on the network
+        peer_address = self.discovery.lookup(username)
         if not peer_address:
             raise ValueError(f"Peer '{username}' not found. Are they online?")
             
         return self.connect_to_peer(peer_address)
     
+    def find_connection(self, peer: str) -> Optional[PeerConnection]:
+        """Live link to a peer given its username or any 'ip:port' it is known by"""
+        conn = self.pool.get(peer)
+        if conn is None and self.discovery:
+            username = self.discovery.get_peer_username(peer)
+            if username:
+                conn = self.pool.get(username)
+        return conn
+    
+    def _dial_address(self, peer: str) -> Optional[str]:
+        """'ip:port' to dial for a peer given by username or address"""
+        if ':' in peer:
+            return peer
+        return self.discovery.get_peer_address(peer) if self.discovery else None
+    
     def get_discovered_peers(self) -> dict:
         """Get list of discovered peers {username: 'ip:port'}"""
         if not self.discovery:
@@ -160,120 +280,353 @@ class P2PClient:
         return self.discovery.get_peers()
     
     def set_peer_list_callback(self, callback: Callable):
-        """Set callback for when peer list updates"""
+        """Set callback for peer list changes: callback(events: List[PeerEvent])"""
         self.peer_list_callback = callback
     
-    def _on_peer_list_update(self):
-        """Internal callback when peer list changes"""
+    def _on_peer_list_update(self, events: List[PeerEvent]):
+        """Internal callback with a debounced batch of peer changes"""
+        if self.warm_connect:
+            for event in events:
+                if event.kind == PEER_ADDED:
+                    self._warm_up(event)
         if self.peer_list_callback:
-            self.peer_list_callback()
+            self.peer_list_callback(events)
             
-    def send_message(self, peer_address: str, message: str, msg_type: str = 'message'):
-        """Send a message to a connected peer"""
-        if peer_address not in self.peer_connections:
-            raise ValueError(f"Not connected to {peer_address}")
+    def _warm_up(self, event: PeerEvent):
+        """Connect to a newly discovered peer in the background"""
+        # Only the side with the smaller username dials, so two peers
+        # discovering each other don't both open a link
+        if (not self.running or event.username <= self.username
+                or event.address in self._warming
+                or len(self.pool) >= self.pool.max_size
+                or self.pool.get(event.username)):
+            return
+        self._dial(event.address)
+        
+    def _dial(self, address: str):
+        """Connect to a peer on a background thread, then send any messages
+        queued for it while the link was down"""
+        with self._outbox_lock:
+            if address in self._warming:
+                return
+            self._warming.add(address)
+        
+        def dial():
+            connected = False
+            try:
+                connected = self.connect_to_peer(address)
+            finally:
+                self._flush_outbox(address, connected)
+                
+        threading.Thread(target=dial, daemon=True).start()
+        
+    def _flush_outbox(self, address: str, connected: bool):
+        """Send (or, if the dial failed, drop) the messages queued for an address"""
+        with self._outbox_lock:
+            self._warming.discard(address)
+            queued = self._outbox.pop(address, [])
+            conn = self.find_connection(address) if connected else None
+            if queued and conn is None:
+                print(f"Dropping {len(queued)} message(s) for {address}: could not reconnect")
+                return
+            for msg_data in queued:
+                self._send_data(conn, msg_data)
             
+    def send_message(self, peer_address: str, message: str, msg_type: str = 'message',
+                     extra: Optional[dict] = None):
+        """Send a message to a connected peer (by 'ip:port' or username).
+
+        Never waits on the network: a message for a peer whose link the
+        pool has closed is queued and sent once a background re-dial
+        connects.
+
+        extra: additional fields for the message (e.g. the codecs offered
+        with an audio_request)
+        """
         msg_data = {
             'type': msg_type,
             'from': self.username,
             'text': message,
             'timestamp': time.time()
         }
+        if extra:
+            msg_data.update(extra)
+            
+        conn = self.find_connection(peer_address)
+        if conn is not None:
+            self._send_data(conn, msg_data)
+            return
+            
+        # The pool closed the link (idle or over size): queue the message
+        # and re-dial in the background rather than block the caller
+        address = self._dial_address(peer_address) if self.running else None
+        if not address:
+            raise ValueError(f"Not connected to {peer_address}")
+        with self._outbox_lock:
+            self._outbox.setdefault(address, []).append(msg_data)
+        self._dial(address)
         
+    def _send_data(self, conn: PeerConnection, msg_data: dict):
+        """Encode and queue one message on a live link"""
+        self.pool.touch(conn)
         try:
-            self.peer_connections[peer_address].send(
-                json.dumps(msg_data).encode() + b'\n'
-            )
+            self.engine.send(conn, self._encode(conn, msg_data))
         except Exception as e:
             print(f"Failed to send message: {e}")
             # Remove dead connection
-            del self.peer_connections[peer_address]
-            
-    def send_group_message(self, message: str):
-        """Send a message to all connected peers"""
-        if not self.peer_connections:
-            return 0
+            self._on_disconnect(conn, str(e))
             
+    def send_group_message(self, message: str) -> int:
+        """Send a message to all connected peers without waiting on any of them.
+        
+        Returns the number of peers the message was queued for. In gossip
+        mode that is the first-hop relays, not the whole group.
+        """
+        tracker = self._send_group(message)
+        return len(tracker.report.statuses) - len(tracker.report.failed)
+        
+    def broadcast(self, message: str) -> Future:
+        """Send a group message; the Future resolves to a BroadcastReport
+        once every (first-hop) peer's copy has been written or has failed"""
+        return self._send_group(message).future
+        
+    def _send_group(self, message: str) -> BroadcastTracker:
         msg_data = {
             'type': 'group_message',
             'from': self.username,
             'text': message,
-            'timestamp': time.time()
+            'timestamp': time.time(),
+            'msg_id': self.message_ids.next_id(),
+            'hops': self.GOSSIP_HOPS
         }
+        # Remember our own id so relayed echoes are dropped
+        self.seen_messages.add(msg_data['msg_id'])
+        
+        peers = list(self.peer_connections.values())
+        if self.gossip_fanout:
+            peers = choose_relays(peers, self.gossip_fanout)
+        return self._broadcast(msg_data, peers)
         
-        encoded_msg = json.dumps(msg_data).encode() + b'\n'
-        count = 0
+    def _relay_group_message(self, msg: dict, source: PeerConnection):
+        """Forward a gossiped group message to a few peers that don't have it"""
+        hops = msg.get('hops', 0) - 1
+        if hops <= 0 or not self.gossip_fanout:
+            return
+        origin = msg.get('from')
+        candidates = [
+            conn for conn in list(self.peer_connections.values())
+            if conn is not source and conn.username != origin
+        ]
+        relay = dict(msg, hops=hops)
+        self._broadcast(relay, choose_relays(candidates, self.gossip_fanout))
         
-        # Iterate copy of values to avoid modification issues
-        for peer_addr, sock in list(self.peer_connections.items()):
+    def _broadcast(self, msg_data: dict, peers: List[PeerConnection]) -> BroadcastTracker:
+        """Queue a message on the given peer links, encoding it once per wire format"""
+        tracker = BroadcastTracker(conn.address for conn in peers)
+        frames = {}  # (codec, framing) -> encoded frame, built once each
+        
+        for conn in peers:
+            self.pool.touch(conn)
             try:
-                sock.send(encoded_msg)
-                count += 1
+                self.engine.send(conn, self._encode(conn, msg_data, frames), tracker.callback_for(conn.address))
             except Exception as e:
-                print(f"Group send error to {peer_addr}: {e}")
+                print(f"Group send error to {conn.address}: {e}")
+                tracker.resolve(conn.address, FAILED, str(e))
+                self._on_disconnect(conn, str(e))
                 
-        return count
+        return tracker
+
+    def _encode(self, conn: PeerConnection, msg_data: dict, cache: Optional[dict] = None) -> bytes:
+        """Encode a message with the codec and framing negotiated for a link"""
+        key = (conn.codec, conn.framing)
+        if cache is not None and key in cache:
+            return cache[key]
+        frame = encode_frame(CODECS[conn.codec].encode(msg_data, self.username), conn.framing)
+        if cache is not None:
+            cache[key] = frame
+        return frame
+
+    def get_queue_stats(self) -> Dict[str, dict]:
+        """Send-queue counters for every connected peer"""
+        return {
+            address: conn.queue_stats()
+            for address, conn in list(self.peer_connections.items())
+        }
+
+    def get_rtt_stats(self) -> Dict[str, dict]:
+        """Smoothed RTT and jitter (ms) for every connected peer"""
+        now = time.monotonic()
+        return {
+            address: dict(conn.rtt.as_dict(), username=conn.username,
+                          last_received_s=round(now - conn.last_received, 1))
+            for address, conn in list(self.peer_connections.items())
+        }
+        
+    def get_peer_rtt(self, peer: str) -> Optional[dict]:
+        """RTT and jitter (ms) for one peer, by username or 'ip:port'"""
+        conn = self.find_connection(peer)
+        return conn.rtt.as_dict() if conn else None
+        
+    def get_peer_state(self, peer: str) -> str:
+        """LINK_CONNECTED, LINK_IDLE (link closed by the pool, peer still
+        discovered and re-dialled on the next send) or LINK_DISCONNECTED"""
+        if self.find_connection(peer):
+            return LINK_CONNECTED
+        if not self.discovery:
+            return LINK_DISCONNECTED
+        if ':' in peer:
+            username, address = self.discovery.get_peer_username(peer), peer
+        else:
+            username, address = peer, self.discovery.get_peer_address(peer)
+        if not address or not username or {peer, username, address} & self._dead_peers:
+            return LINK_DISCONNECTED
+        return LINK_IDLE
 
     def set_message_callback(self, callback: Callable):
         """Set callback for incoming messages"""
         self.message_callback = callback
         
-    def _accept_connections(self):
-        """Accept incoming peer connections"""
-        while self.running:
+    def _on_data(self, conn: PeerConnection):
+        """Called by the engine when new bytes are in the connection's decoder"""
+        conn.last_received = time.monotonic()
+        # Frames are newline-delimited JSON or length-prefixed JSON/compact
+        for frame in conn.decoder.frames():
             try:
-                client_socket, address = self.server_socket.accept()
-                print(f"Incoming connection from {address}")
-                
-                # Start receive thread for this connection
-                receive_thread = threading.Thread(
-                    target=self._receive_messages,
-                    args=(client_socket, f"{address[0]}:{address[1]}"),
-                    daemon=True
-                )
-                receive_thread.start()
-                
-            except Exception as e:
-                if self.running:
-                    print(f"Accept error: {e}")
-                    
-    def _receive_messages(self, sock: socket.socket, peer_address: str):
-        """Receive messages from a peer"""
-        buffer = ""
+                msg = decode_payload(frame, conn.username)
+            except (ValueError, struct.error):
+                continue
+            self._handle_message(msg, conn)
         
-        try:
-            while self.running:
-                data = sock.recv(4096).decode()
-                if not data:
-                    break
+    def _create_connection(self, sock: socket.socket, address: str) -> PeerConnection:
+        """Wrap a connected socket with this client's send-queue settings"""
+        enable_keepalive(sock, self.KEEPALIVE_IDLE, self.KEEPALIVE_INTERVAL, self.KEEPALIVE_COUNT)
+        return PeerConnection(
+            sock, address,
+            queue_limit=self.queue_limit,
+            overflow_policy=self.overflow_policy,
+            block_timeout=self.block_timeout
+        )
+        
+    def _register_connection(self, conn: PeerConnection, aliases: List[str] = ()):
+        """Pool a link under its peer's identity, closing any duplicate link"""
+        if conn.closed:
+            return
+        key = conn.username or conn.address
+        duplicate = self.pool.add(conn, key, self.username, aliases)
+        if duplicate is not None:
+            print(f"Closing duplicate link to {key} ({duplicate.address})")
+            self._on_disconnect(duplicate, "duplicate connection")
+        if duplicate is not conn:
+            self.peer_connections[conn.address] = conn
+        self._dead_peers.difference_update((conn.username, conn.address, *aliases))
+            
+    def _maintenance_loop(self):
+        """Periodically close idle links and links over the pool size"""
+        while self.running:
+            time.sleep(self.MAINTENANCE_INTERVAL)
+            for conn in self.pool.evictable():
+                print(f"Closing idle link to {conn.username or conn.address}")
+                self._on_disconnect(conn, "idle connection evicted")
+        
+    def _heartbeat_loop(self):
+        """Ping every peer each interval and drop peers that went silent"""
+        while self.running:
+            time.sleep(self.heartbeat_interval)
+            now = time.monotonic()
+            for conn in list(self.peer_connections.values()):
+                # Only peers known to answer pings can be judged by silence
+                if conn.answers_pings and now - conn.last_received > self.heartbeat_timeout:
+                    print(f"No heartbeat from {conn.username or conn.address} for {self.heartbeat_timeout}s, dropping")
+                    self._dead_peers.update(key for key in (conn.username, conn.address) if key)
+                    self._on_disconnect(conn, "heartbeat timeout")
+                    continue
+                # The ping carries our monotonic clock; the pong echoes it back
+                ping = {'type': 'ping', 'timestamp': now}
+                try:
+                    self.engine.send(conn, self._encode(conn, ping))
+                except Exception as e:
+                    self._on_disconnect(conn, str(e))
                     
-                buffer += data
+    def _on_disconnect(self, conn: PeerConnection, reason: str = "connection closed"):
+        """Called when a peer link is closed or must be dropped"""
+        conn.close(reason)
+        self.engine.forget(conn)
+        self.pool.remove(conn)
+        if self.peer_connections.get(conn.address) is conn:
+            del self.peer_connections[conn.address]
                 
-                # Process complete messages (newline-delimited JSON)
-                while '\n' in buffer:
-                    line, buffer = buffer.split('\n', 1)
-                    try:
-                        msg = json.loads(line)
-                        self._handle_message(msg, peer_address, sock)
-                    except json.JSONDecodeError:
-                        pass
-                        
-        except Exception as e:
-            print(f"Receive error from {peer_address}: {e}")
-        finally:
-            sock.close()
-            if peer_address in self.peer_connections:
-                del self.peer_connections[peer_address]
-                
-    def _handle_message(self, msg: dict, peer_address: str, sock: socket.socket):
+    def _handle_message(self, msg: dict, conn: PeerConnection):
         """Handle incoming message"""
         msg_type = msg.get('type')
+        peer_address = conn.address
+        
+        # Heartbeats keep the link alive but don't count as use
+        if msg_type == 'ping':
+            pong = {'type': 'pong', 'timestamp': msg.get('timestamp')}
+            self.engine.send(conn, self._encode(conn, pong))
+            return
+        if msg_type == 'pong':
+            sent = msg.get('timestamp')
+            if isinstance(sent, (int, float)):
+                conn.answers_pings = True
+                conn.rtt.update(max(0.0, time.monotonic() - sent))
+            return
+        self.pool.touch(conn)
         
         if msg_type == 'handshake':
-            # Store the connection
-            self.peer_connections[peer_address] = sock
+            # Re-key the inbound link by the peer's listening address so
+            # replies and calls go to a port the peer is accepting on
+            conn.username = msg.get('username')
+            aliases = []
+            listen_port = msg.get('port')
+            if listen_port is None and ':' in str(msg.get('peer_id', '')):
+                listen_port = msg['peer_id'].rsplit(':', 1)[1]
+            if listen_port is not None:
+                aliases.append(conn.address)
+                conn.address = f"{conn.address.rsplit(':', 1)[0]}:{listen_port}"
+                # An older peer (no framings offered) never acks, so a link
+                # we dialled to it stays unnamed and the pool can't match it
+                # with this one. The peer sends on the link it dialled:
+                # close ours rather than lose track of it
+                dialled = self.pool.get(conn.address)
+                if (not isinstance(msg.get('framing'), list) and dialled is not None
+                        and dialled is not conn and dialled.username is None):
+                    print(f"Closing duplicate link to {conn.address} (peer sent no ack)")
+                    self._on_disconnect(dialled, "duplicate connection")
+            self._register_connection(conn, aliases)
+            if conn.closed:
+                return  # a link to this peer already existed
             print(f"Handshake from {msg.get('username')}")
             
+            # Peers that advertise framings expect an ack naming our choice
+            offered = msg.get('framing')
+            if isinstance(offered, list):
+                framing = next((f for f in self.SUPPORTED_FRAMINGS if f in offered), FRAMING_NEWLINE)
+                codec = CODEC_JSON
+                # Binary codecs need length-prefixed framing
+                if framing == FRAMING_LENGTH:
+                    offered_codecs = msg.get('codecs') or []
+                    codec = next((c for c in self.SUPPORTED_CODECS if c in offered_codecs), CODEC_JSON)
+                ack = {
+                    'type': 'handshake_ack',
+                    'username': self.username,
+                    'framing': framing,
+                    'codec': codec
+                }
+                self.engine.send(conn, encode_frame(json.dumps(ack).encode(), FRAMING_NEWLINE))
+                conn.framing = framing
+                conn.codec = codec
+                
+        elif msg_type == 'handshake_ack':
+            conn.username = msg.get('username')
+            self._register_connection(conn)
+            framing = msg.get('framing')
+            if framing in self.SUPPORTED_FRAMINGS:
+                conn.framing = framing
+                codec = msg.get('codec', CODEC_JSON)
+                if codec in CODECS:
+                    conn.codec = codec
+            
         elif msg_type == 'message':
             # Deliver to callback
             if self.message_callback:
@@ -284,6 +637,13 @@ class P2PClient:
                 )
                         
         elif msg_type == 'group_message':
+            # Gossiped messages carry an id: drop duplicates, relay new ones
+            msg_id = msg.get('msg_id')
+            if msg_id is not None:
+                if not self.seen_messages.add(msg_id):
+                    return
+                self._relay_group_message(msg, conn)
+                
             # Deliver to callback with special type
             if self.message_callback:
                 self.message_callback(
@@ -307,14 +667,28 @@ class P2PClient:
                 )
 
         elif msg_type == 'audio_request':
-            # New audio request
+            # New audio request, with the caller's codec offer if it made one
             if self.message_callback:
+                offer = {'codecs': msg['codecs']} if isinstance(msg.get('codecs'), list) else {}
                 self.message_callback(
                     sender=msg.get('from'),
                     text="Incoming Voice Call...",
                     timestamp=msg.get('timestamp'),
                     msg_type='audio_request',
-                    peer_address=peer_address
+                    peer_address=peer_address,
+                    **offer
+                )
+                
+        elif msg_type == 'audio_answer':
+            # The callee accepted an audio_request and names the codec it picked
+            if self.message_callback and isinstance(msg.get('codec'), str):
+                self.message_callback(
+                    sender=msg.get('from'),
+                    text=msg.get('text'),
+                    timestamp=msg.get('timestamp'),
+                    msg_type='audio_answer',
+                    peer_address=peer_address,
+                    codec=msg['codec']
                 )
                 
     def stop(self):
@@ -322,8 +696,9 @@ class P2PClient:
         self.running = False
         if self.discovery:
             self.discovery.stop()
+        self.engine.stop()
         if self.server_socket:
             self.server_socket.close()
-        for sock in self.peer_connections.values():
-            sock.close()
+        for conn in list(self.peer_connections.values()):
+            conn.close()
         self.peer_connections.clear()
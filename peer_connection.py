@@ -0,0 +1,277 @@
+"""
+Peer Connection Module
+Per-link state shared by P2PClient and its connection engines
+"""
+import socket
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, List, Optional
+
+from delivery import DROPPED, FAILED, SENT
+from heartbeat import RttEstimator
+from framing import FrameDecoder, FRAMING_NEWLINE
+from message_codec import CODEC_JSON
+
+
+# What enqueue does when a peer's queue is over its high-water mark
+OVERFLOW_DROP_OLDEST = 'drop-oldest'  # discard the oldest unsent frames
+OVERFLOW_BLOCK = 'block'              # wait for room, evict after block_timeout
+OVERFLOW_DISCONNECT = 'disconnect'    # evict the peer straight away
+OVERFLOW_POLICIES = (OVERFLOW_DROP_OLDEST, OVERFLOW_BLOCK, OVERFLOW_DISCONNECT)
+
+DEFAULT_QUEUE_LIMIT = 1024 * 1024  # bytes
+DEFAULT_BLOCK_TIMEOUT = 5.0  # seconds
+
+
+class OutboundFrame:
+    """A queued frame and the callback to fire once it is written"""
+
+    __slots__ = ('data', 'on_done', 'in_flight', 'queued_at')
+
+    def __init__(self, data: bytes, on_done: Optional[Callable]):
+        self.data = memoryview(data)  # shrinks as it is partially written
+        self.on_done = on_done
+        self.in_flight = False  # handed to a writer, can no longer be dropped
+        self.queued_at = time.monotonic()
+
+
+class SlowConsumerError(ConnectionError):
+    """Raised when a peer is evicted because its send queue overflowed"""
+
+
+class PeerConnection:
+    """State for a single TCP link to a peer"""
+
+    def __init__(self, sock: socket.socket, address: str,
+                 queue_limit: int = DEFAULT_QUEUE_LIMIT,
+                 overflow_policy: str = OVERFLOW_DISCONNECT,
+                 block_timeout: float = DEFAULT_BLOCK_TIMEOUT):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy '{overflow_policy}'")
+        self.sock = sock
+        self.address = address
+        self.username: Optional[str] = None
+        self.initiated = False  # True if we dialled this link
+        self.last_used = time.monotonic()  # last send or receive, for idle eviction
+
+        # Liveness: any inbound frame counts; pongs also feed the RTT estimate
+        self.last_received = time.monotonic()
+        self.answers_pings = False  # peer has replied to a ping (older peers never do)
+        self.rtt = RttEstimator()
+
+        # Framing and codec used for outbound messages (upgraded during the handshake)
+        self.framing = FRAMING_NEWLINE
+        self.codec = CODEC_JSON
+
+        # Inbound bytes not yet parsed into messages
+        self.decoder = FrameDecoder()
+
+        # Outbound frames not yet fully written, oldest first
+        self.outbound: Deque[OutboundFrame] = deque()
+        self.queue_limit = queue_limit
+        self.overflow_policy = overflow_policy
+        self.block_timeout = block_timeout
+        self.send_lock = threading.Lock()
+        self.send_ready = threading.Condition(self.send_lock)
+        self.space_ready = threading.Condition(self.send_lock)
+
+        # Counters
+        self.queued_bytes = 0
+        self.peak_queued_bytes = 0
+        self.frames_sent = 0
+        self.bytes_sent = 0
+        self.write_calls = 0
+        self.frames_dropped = 0
+        self.blocked_sends = 0
+
+        self.closed = False
+        self.close_reason: Optional[str] = None
+
+    def fileno(self) -> int:
+        """File descriptor of the underlying socket"""
+        return self.sock.fileno()
+
+    def enqueue(self, data: bytes, on_done: Optional[Callable] = None) -> bool:
+        """Queue a frame for the writer; on_done(status, error) fires once written.
+
+        Applies the overflow policy when the queue is over its high-water
+        mark. Raises ConnectionError if the link is closed and
+        SlowConsumerError if the peer is evicted. Returns True if the
+        queue was empty, i.e. the writer may need waking.
+        """
+        frame = OutboundFrame(data, on_done)
+        size = len(frame.data)
+        dropped = []
+        evict = None
+
+        with self.send_lock:
+            if self.closed:
+                raise ConnectionError(f"Connection to {self.address} is closed")
+
+            if self.queued_bytes and self.queued_bytes + size > self.queue_limit:
+                if self.overflow_policy == OVERFLOW_DROP_OLDEST:
+                    dropped = self._drop_oldest_locked(size)
+                elif self.overflow_policy == OVERFLOW_BLOCK:
+                    self.blocked_sends += 1
+                    deadline = time.monotonic() + self.block_timeout
+                    while (not self.closed and self.queued_bytes
+                           and self.queued_bytes + size > self.queue_limit):
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            evict = f"send blocked for {self.block_timeout}s"
+                            break
+                        self.space_ready.wait(remaining)
+                    if self.closed:
+                        raise ConnectionError(f"Connection to {self.address} is closed")
+                else:
+                    evict = f"send queue over {self.queue_limit} bytes"
+
+            was_empty = not self.outbound
+            if evict is None:
+                self.outbound.append(frame)
+                self.queued_bytes += size
+                self.peak_queued_bytes = max(self.peak_queued_bytes, self.queued_bytes)
+                self.send_ready.notify()
+
+        notify_done(dropped, DROPPED, "send queue overflow")
+        if evict is not None:
+            reason = f"Slow consumer evicted: {evict}"
+            self.close(reason)
+            raise SlowConsumerError(reason)
+        return was_empty
+
+    def _drop_oldest_locked(self, incoming: int) -> List[OutboundFrame]:
+        """Remove the oldest droppable frames until `incoming` bytes fit"""
+        kept = deque()
+        dropped = []
+        while self.outbound and self.queued_bytes + incoming > self.queue_limit:
+            frame = self.outbound.popleft()
+            if frame.in_flight:
+                kept.append(frame)
+                continue
+            self.queued_bytes -= len(frame.data)
+            dropped.append(frame)
+        kept.extend(self.outbound)
+        self.outbound = kept
+        self.frames_dropped += len(dropped)
+        return dropped
+
+    def next_batch(self, max_bytes: int = 0, timeout: Optional[float] = None) -> List[OutboundFrame]:
+        """Return the oldest queued frames without removing them.
+
+        Waits up to `timeout` seconds (forever if None) for a frame. The
+        batch holds at least one frame, plus following frames while the
+        total stays within max_bytes. Returned frames are marked in
+        flight; report what was written with advance().
+        """
+        with self.send_lock:
+            if timeout is None:
+                while not self.outbound and not self.closed:
+                    self.send_ready.wait()
+            elif timeout > 0 and not self.outbound and not self.closed:
+                self.send_ready.wait(timeout)
+
+            batch = []
+            total = 0
+            for frame in self.outbound:
+                if batch and total + len(frame.data) > max_bytes:
+                    break
+                frame.in_flight = True
+                batch.append(frame)
+                total += len(frame.data)
+            return batch
+
+    def wait_for_bytes(self, min_bytes: int, deadline: float):
+        """Wait until min_bytes are queued or the monotonic deadline passes"""
+        with self.send_lock:
+            while not self.closed and self.queued_bytes < min_bytes:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                self.send_ready.wait(remaining)
+
+    def flush_deadline(self, delay: float, min_bytes: int) -> Optional[float]:
+        """When a coalescing writer should flush: None means now"""
+        with self.send_lock:
+            if not self.outbound or self.queued_bytes >= min_bytes:
+                return None
+            deadline = self.outbound[0].queued_at + delay
+            return deadline if deadline > time.monotonic() else None
+
+    def advance(self, sent: int) -> List[OutboundFrame]:
+        """Consume `sent` written bytes from the head of the queue.
+
+        Returns the frames that are now fully written (pass them to
+        notify_done outside any lock).
+        """
+        done = []
+        with self.send_lock:
+            if self.closed:
+                return done
+            self.write_calls += 1
+            self.bytes_sent += sent
+            self.queued_bytes -= sent
+            while sent and self.outbound:
+                frame = self.outbound[0]
+                if sent < len(frame.data):
+                    frame.data = frame.data[sent:]
+                    break
+                sent -= len(frame.data)
+                done.append(self.outbound.popleft())
+            self.frames_sent += len(done)
+            self.space_ready.notify_all()
+        return done
+
+    def queue_stats(self) -> dict:
+        """Snapshot of this link's send-queue counters"""
+        with self.send_lock:
+            return {
+                'queued_frames': len(self.outbound),
+                'queued_bytes': self.queued_bytes,
+                'peak_queued_bytes': self.peak_queued_bytes,
+                'queue_limit': self.queue_limit,
+                'overflow_policy': self.overflow_policy,
+                'frames_sent': self.frames_sent,
+                'bytes_sent': self.bytes_sent,
+                'write_calls': self.write_calls,
+                'frames_dropped': self.frames_dropped,
+                'blocked_sends': self.blocked_sends,
+            }
+
+    def close(self, reason: str = "connection closed"):
+        """Close the socket and fail anything still queued (safe to call twice)"""
+        with self.send_lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.close_reason = reason
+            pending = list(self.outbound)
+            self.outbound.clear()
+            self.queued_bytes = 0
+            self.send_ready.notify_all()
+            self.space_ready.notify_all()
+        try:
+            # shutdown() makes the peer see EOF even while a receive
+            # thread is still blocked on this socket
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+        notify_done(pending, FAILED, reason)
+
+    def __repr__(self) -> str:
+        return f"PeerConnection({self.address}, username={self.username!r})"
+
+
+def notify_done(frames: List[OutboundFrame], status: str = SENT, error: Optional[str] = None):
+    """Fire the delivery callbacks of finished outbound frames"""
+    for frame in frames:
+        if frame.on_done:
+            try:
+                frame.on_done(status, error)
+            except Exception as e:
+                print(f"Delivery callback error: {e}")
@@ -1,42 +1,147 @@
 """
 Peer Discovery Module
-Uses UDP broadcast to discover peers on local network
+Uses UDP broadcast or multicast to discover peers on local network
+
+Announcements are sent on a jittered timer whose interval grows with the
+number of known peers, so the whole segment stays under
+MAX_SEGMENT_RATE announcements per second however many nodes join. Each
+announcement tells receivers how long to keep the entry (ttl). A node
+starting up sends a query listing the peers it already knows; only
+unknown peers answer (known-answer suppression), and because answers go
+to the whole segment they also count as that node's periodic refresh.
+
+lookup() finds a single peer on demand: it sends a who_has query that
+the owner answers at once, so connecting by name costs one round trip
+instead of waiting for the next announcement. Misses are remembered
+for NEGATIVE_TTL seconds.
 """
 import socket
 import json
+import random
+import struct
 import threading
 import time
-from typing import Dict, Optional, Callable
+from typing import Dict, List, Optional, Callable
+from peer_table import (
+    PeerTable, PEER_ADDED, PEER_ADDRESS_CHANGED, PEER_REFRESHED, PEER_REMOVED,
+)
+
+
+class PeerEvent:
+    """A change to the discovered peer list"""
+    
+    __slots__ = ('kind', 'username', 'address', 'previous_address')
+    
+    def __init__(self, kind: str, username: str, address: Optional[str] = None,
+                 previous_address: Optional[str] = None):
+        self.kind = kind  # PEER_ADDED, PEER_REMOVED or PEER_ADDRESS_CHANGED
+        self.username = username
+        self.address = address  # current 'ip:port' (None once removed)
+        self.previous_address = previous_address
+        
+    def __repr__(self) -> str:
+        return f"PeerEvent({self.kind}, {self.username!r}, {self.address!r})"
+
+
+def merge_peer_events(events: List[PeerEvent]) -> List[PeerEvent]:
+    """Collapse a batch to the net change per peer (e.g. added+removed -> nothing)"""
+    before: Dict[str, Optional[str]] = {}  # address at the start of the batch
+    after: Dict[str, Optional[str]] = {}   # address at the end of the batch
+    for event in events:
+        if event.username not in before:
+            before[event.username] = None if event.kind == PEER_ADDED else event.previous_address
+        after[event.username] = event.address
+        
+    merged = []
+    for username, end in after.items():
+        start = before[username]
+        if start == end:
+            continue
+        if start is None:
+            merged.append(PeerEvent(PEER_ADDED, username, end))
+        elif end is None:
+            merged.append(PeerEvent(PEER_REMOVED, username, None, start))
+        else:
+            merged.append(PeerEvent(PEER_ADDRESS_CHANGED, username, end, start))
+    return merged
+
+
+MODE_BROADCAST = 'broadcast'
+MODE_MULTICAST = 'multicast'
 
 
 class PeerDiscovery:
-    """Handles peer discovery via UDP broadcast"""
+    """Handles peer discovery via UDP broadcast or multicast"""
     
     BROADCAST_PORT = 5555
-    BROADCAST_INTERVAL = 5  # seconds
+    MULTICAST_GROUP = '239.255.85.55'  # administratively scoped, stays on the LAN
+    BROADCAST_INTERVAL = 5  # seconds - minimum announce interval
     PEER_TIMEOUT = 15  # seconds - remove peers not seen in this time
+    ANNOUNCE_JITTER = 0.2  # each interval is randomised by +/- 20%
+    MAX_SEGMENT_RATE = 10  # target announcements/second for the whole segment
+    TTL_FACTOR = 3  # receivers keep an entry for this many of our intervals
+    ANSWER_DELAY = (0.02, 0.12)  # seconds - random delay before answering a query
+    MIN_ANSWER_GAP = 1.0  # seconds - announce at most this often when answering
+    MAX_DATAGRAM = 1200  # bytes - keep announcements within one packet
+    LOOKUP_TIMEOUT = 1.0  # seconds - wait for a who_has answer (sent twice)
+    NEGATIVE_TTL = 3.0  # seconds - remember that a username did not answer
     
-    def __init__(self, username: str, tcp_port: int):
+    def __init__(self, username: str, tcp_port: int, debounce: float = 0.5,
+                 mode: str = MODE_BROADCAST):
+        """
+        debounce: seconds to gather peer changes into one callback (0 sends
+            each change on its own)
+        mode: 'broadcast' (255.255.255.255) or 'multicast' (MULTICAST_GROUP)
+        """
+        if mode not in (MODE_BROADCAST, MODE_MULTICAST):
+            raise ValueError(f"Unknown discovery mode '{mode}'")
         self.username = username
         self.tcp_port = tcp_port
-        self.peers: Dict[str, dict] = {}  # {username: {ip, port, last_seen}}
+        self.mode = mode
+        self.peers = PeerTable(self.PEER_TIMEOUT)
         self.running = False
         self.broadcast_socket: Optional[socket.socket] = None
         self.listen_socket: Optional[socket.socket] = None
         self.peer_update_callback: Optional[Callable] = None
         
+        # Peer change events waiting for the debounce window to close
+        self.debounce = debounce
+        self._pending_events: List[PeerEvent] = []
+        self._events_lock = threading.Lock()
+        self._flush_timer: Optional[threading.Timer] = None
+        
+        # Announce scheduling
+        self._last_announce = 0.0  # monotonic time of our last announcement
+        self._next_announce = 0.0  # when the broadcast loop announces next (jitter drawn once per announcement)
+        self._answer_pending = False
+        self._send_lock = threading.Lock()
+        self.announcements_sent = 0
+        
+        # On-demand lookups: waiters are woken when any peer entry changes
+        self._lookup_cond = threading.Condition()
+        self._lookups_waiting = 0
+        self._negative_cache: Dict[str, float] = {}  # username -> expiry (monotonic)
+        
     def start(self):
         """Start discovery service"""
         self.running = True
         
         # Setup broadcast socket
         self.broadcast_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.broadcast_socket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        if self.mode == MODE_MULTICAST:
+            self.broadcast_socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1)
+            self.broadcast_socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+        else:
+            self.broadcast_socket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
         
         # Setup listen socket
         self.listen_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.listen_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.listen_socket.bind(('', self.BROADCAST_PORT))
+        if self.mode == MODE_MULTICAST:
+            membership = struct.pack('4s4s', socket.inet_aton(self.MULTICAST_GROUP),
+                                     socket.inet_aton('0.0.0.0'))
+            self.listen_socket.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
         
         # Start threads
         threading.Thread(target=self._broadcast_loop, daemon=True).start()
@@ -48,54 +153,218 @@ class PeerDiscovery:
     def stop(self):
         """Stop discovery service"""
         self.running = False
+        with self._events_lock:
+            if self._flush_timer:
+                self._flush_timer.cancel()
+            self._pending_events.clear()
         if self.broadcast_socket:
             self.broadcast_socket.close()
         if self.listen_socket:
             self.listen_socket.close()
             
     def set_peer_update_callback(self, callback: Callable):
-        """Set callback for when peer list updates"""
+        """Set callback for peer list changes: callback(events: List[PeerEvent])"""
         self.peer_update_callback = callback
         
+    def _emit(self, event: PeerEvent):
+        """Queue a peer change and deliver it when the debounce window closes"""
+        with self._events_lock:
+            self._pending_events.append(event)
+            if self.debounce <= 0:
+                start_timer = False
+            elif self._flush_timer is None:
+                self._flush_timer = threading.Timer(self.debounce, self._flush_events)
+                self._flush_timer.daemon = True
+                start_timer = True
+            else:
+                return  # a flush is already scheduled
+        if start_timer:
+            self._flush_timer.start()
+        else:
+            self._flush_events()
+            
+    def _flush_events(self):
+        """Deliver the net peer changes gathered since the last flush"""
+        with self._events_lock:
+            events = merge_peer_events(self._pending_events)
+            self._pending_events = []
+            self._flush_timer = None
+        if events and self.peer_update_callback and self.running:
+            try:
+                self.peer_update_callback(events)
+            except Exception as e:
+                print(f"Peer update callback error: {e}")
+        
     def get_peers(self) -> Dict[str, str]:
         """Get current peers as {username: 'ip:port'}"""
-        return {
-            username: f"{info['ip']}:{info['port']}"
-            for username, info in self.peers.items()
-            if username != self.username  # Don't include self
-        }
+        # Our own announcements are never stored, so the snapshot excludes self
+        return dict(self.peers.snapshot())
         
     def get_peer_address(self, username: str) -> Optional[str]:
         """Get IP:PORT for a specific username"""
-        if username in self.peers:
-            info = self.peers[username]
-            return f"{info['ip']}:{info['port']}"
+        return self.peers.get_address(username)
+        
+    def get_peer_username(self, address: str) -> Optional[str]:
+        """Get the username announced from an IP:PORT"""
+        return self.peers.get_username(address)
+        
+    def lookup(self, username: str, timeout: Optional[float] = None) -> Optional[str]:
+        """Get IP:PORT for a username, asking the network if it isn't known yet.
+        
+        Blocks for up to `timeout` seconds (LOOKUP_TIMEOUT by default).
+        A username that does not answer is cached as missing for
+        NEGATIVE_TTL seconds.
+        """
+        address = self.peers.get_address(username)
+        if address or not self.running:
+            return address
+            
+        now = time.monotonic()
+        with self._lookup_cond:
+            if self._negative_cache.get(username, 0) > now:
+                return None
+            self._lookups_waiting += 1
+            
+        timeout = self.LOOKUP_TIMEOUT if timeout is None else timeout
+        deadline = now + timeout
+        try:
+            # Ask twice in case the first datagram is lost
+            for attempt in range(2):
+                self._send_who_has(username)
+                resend_at = min(deadline, now + timeout / 2 * (attempt + 1))
+                with self._lookup_cond:
+                    while True:
+                        address = self.peers.get_address(username)
+                        remaining = resend_at - time.monotonic()
+                        if address or remaining <= 0:
+                            break
+                        self._lookup_cond.wait(remaining)
+                if address:
+                    return address
+        except Exception as e:
+            print(f"Lookup error: {e}")
+        finally:
+            with self._lookup_cond:
+                self._lookups_waiting -= 1
+                
+        with self._lookup_cond:
+            self._negative_cache[username] = time.monotonic() + self.NEGATIVE_TTL
         return None
         
+    def _send_who_has(self, username: str):
+        """Ask the segment for a username (also announces ourselves)"""
+        self._send({
+            'type': 'who_has',
+            'target': username,
+            'username': self.username,
+            'port': self.tcp_port,
+            'ttl': max(self.PEER_TIMEOUT, self.announce_interval() * self.TTL_FACTOR)
+        })
+        
+    def _on_peer_seen(self, username: str):
+        """Wake lookups and clear any cached miss for a peer we just heard"""
+        with self._lookup_cond:
+            self._negative_cache.pop(username, None)
+            if self._lookups_waiting:
+                self._lookup_cond.notify_all()
+        
+    def announce_interval(self) -> float:
+        """Seconds between our announcements, stretched so the segment as a
+        whole stays under MAX_SEGMENT_RATE announcements per second"""
+        nodes = len(self.peers) + 1
+        return max(self.BROADCAST_INTERVAL, nodes / self.MAX_SEGMENT_RATE)
+        
+    def _destination(self) -> tuple:
+        if self.mode == MODE_MULTICAST:
+            return (self.MULTICAST_GROUP, self.BROADCAST_PORT)
+        return ('<broadcast>', self.BROADCAST_PORT)
+        
+    def _send(self, message: dict):
+        """Send a discovery datagram to the segment"""
+        with self._send_lock:
+            self.broadcast_socket.sendto(json.dumps(message).encode('utf-8'), self._destination())
+            
+    def _announce(self, query: bool = False, answer: bool = False):
+        """Announce our presence; a query also asks unknown peers to answer"""
+        interval = self.announce_interval()
+        message = {
+            'username': self.username,
+            'port': self.tcp_port,
+            'ttl': max(self.PEER_TIMEOUT, interval * self.TTL_FACTOR)
+        }
+        if query:
+            message['type'] = 'query'
+            message['known'] = self._known_answers(message)
+        elif answer:
+            message['type'] = 'is_at'
+        self._send(message)
+        self._schedule_next(time.monotonic())
+        self.announcements_sent += 1
+        
+    def _schedule_next(self, now: float):
+        """Record an announcement at `now` and fix the deadline for the next one"""
+        jitter = random.uniform(1 - self.ANNOUNCE_JITTER, 1 + self.ANNOUNCE_JITTER)
+        self._last_announce = now
+        self._next_announce = now + self.announce_interval() * jitter
+        
+    def _known_answers(self, message: dict) -> List[str]:
+        """Usernames we already know, trimmed so the query fits one packet"""
+        budget = self.MAX_DATAGRAM - len(json.dumps(message)) - 20
+        known = []
+        for username in self.peers.snapshot():
+            budget -= len(json.dumps(username)) + 2
+            if budget < 0:
+                break
+            known.append(username)
+        return known
+        
     def _broadcast_loop(self):
-        """Periodically broadcast our presence"""
+        """Announce our presence on a jittered, adaptive timer"""
+        # Random start-up delay so nodes launched together don't stay in step
+        time.sleep(random.uniform(0, 0.25))
+        query = True
         while self.running:
+            now = time.monotonic()
+            if now < self._next_announce:
+                # Woken at least every second, since answers to other nodes'
+                # queries push the deadline back
+                time.sleep(min(self._next_announce - now, 1.0))
+                continue
             try:
-                message = json.dumps({
-                    'username': self.username,
-                    'port': self.tcp_port
-                })
-                
-                self.broadcast_socket.sendto(
-                    message.encode('utf-8'),
-                    ('<broadcast>', self.BROADCAST_PORT)
-                )
-                
+                self._announce(query=query)
+                query = False
             except Exception as e:
                 print(f"Broadcast error: {e}")
+                self._schedule_next(time.monotonic())
                 
-            time.sleep(self.BROADCAST_INTERVAL)
+    def _answer_query(self, delay: float):
+        """Answer pending queries after a delay (one answer serves them all)"""
+        time.sleep(delay)
+        try:
+            if self.running:
+                self._announce()
+        except Exception as e:
+            print(f"Broadcast error: {e}")
+        finally:
+            self._answer_pending = False
+            
+    def _on_query(self, message: dict):
+        """Decide whether a peer's query needs an answer from us"""
+        if self.username in (message.get('known') or []):
+            return  # known-answer suppression: they already have us
+        if self._answer_pending:
+            return  # the answer already scheduled will cover this query too
+        # Random delay spreads answers out; the gap caps how often we answer
+        delay = max(random.uniform(*self.ANSWER_DELAY),
+                    self._last_announce + self.MIN_ANSWER_GAP - time.monotonic())
+        self._answer_pending = True
+        threading.Thread(target=self._answer_query, args=(delay,), daemon=True).start()
             
     def _listen_loop(self):
         """Listen for peer announcements"""
         while self.running:
             try:
-                data, addr = self.listen_socket.recvfrom(1024)
+                data, addr = self.listen_socket.recvfrom(65535)
                 message = json.loads(data.decode('utf-8'))
                 
                 username = message.get('username')
@@ -104,22 +373,28 @@ class PeerDiscovery:
                 if username and port and username != self.username:
                     # Update peer info
                     ip = addr[0]
+                    ttl = message.get('ttl')
+                    ttl = float(ttl) if isinstance(ttl, (int, float)) and ttl > 0 else None
+                    change, previous = self.peers.update(username, ip, port, ttl=ttl)
                     
-                    # Check if this is a new peer or updated info
-                    is_new = username not in self.peers
-                    
-                    self.peers[username] = {
-                        'ip': ip,
-                        'port': port,
-                        'last_seen': time.time()
-                    }
+                    if change != PEER_REFRESHED or self._lookups_waiting:
+                        self._on_peer_seen(username)
+                        
+                    msg_type = message.get('type')
+                    if msg_type == 'query':
+                        self._on_query(message)
+                    elif msg_type == 'who_has' and message.get('target') == self.username:
+                        # Answer our own name straight away (one answer covers
+                        # simultaneous lookups, since it goes to the segment)
+                        if time.monotonic() - self._last_announce > self.ANSWER_DELAY[0]:
+                            self._announce(answer=True)
                     
-                    if is_new:
+                    if change == PEER_ADDED:
                         print(f"Discovered peer: {username} at {ip}:{port}")
                         
-                    # Notify callback
-                    if self.peer_update_callback:
-                        self.peer_update_callback()
+                    # Only real changes are reported, not every refresh
+                    if change != PEER_REFRESHED:
+                        self._emit(PeerEvent(change, username, f"{ip}:{port}", previous))
                         
             except Exception as e:
                 if self.running:  # Only log if we're supposed to be running
@@ -129,21 +404,15 @@ class PeerDiscovery:
         """Remove stale peers"""
         while self.running:
             try:
-                current_time = time.time()
-                stale_peers = [
-                    username for username, info in self.peers.items()
-                    if current_time - info['last_seen'] > self.PEER_TIMEOUT
-                ]
-                
-                for username in stale_peers:
+                # Only peers whose deadline has passed are touched
+                for username, info in self.peers.expire():
                     print(f"Peer timeout: {username}")
-                    del self.peers[username]
-                    
-                    # Notify callback
-                    if self.peer_update_callback:
-                        self.peer_update_callback()
+                    self._emit(PeerEvent(PEER_REMOVED, username, None, f"{info['ip']}:{info['port']}"))
                         
             except Exception as e:
                 print(f"Cleanup error: {e}")
                 
-            time.sleep(5)  # Check every 5 seconds
+            # Sleep until the next peer could expire (at most 5 seconds)
+            next_expiry = self.peers.next_expiry()
+            delay = 5 if next_expiry is None else next_expiry - time.monotonic()
+            time.sleep(min(5, max(0.5, delay)))
@@ -0,0 +1,136 @@
+"""
+Peer Table Module
+Thread-safe table of discovered peers used by PeerDiscovery.
+
+Writers take a lock; readers use an immutable snapshot that is rebuilt
+(copy-on-write) only when a peer is added, removed or changes address,
+so the many refreshes that change nothing but last_seen stay cheap.
+Expiry uses a min-heap of deadlines, so evicting stale peers costs
+O(expired log N) instead of a scan of the whole table.
+"""
+import heapq
+import threading
+import time
+from types import MappingProxyType
+from typing import Dict, List, Mapping, Optional, Tuple
+
+
+# Kinds of change to a peer entry
+PEER_ADDED = 'added'
+PEER_ADDRESS_CHANGED = 'address_changed'
+PEER_REMOVED = 'removed'
+PEER_REFRESHED = 'refreshed'  # seen again, nothing changed
+
+
+class PeerTable:
+    """Peers indexed by username and by 'ip:port', with timed expiry"""
+
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._peers: Dict[str, dict] = {}     # username -> {ip, port, last_seen, expires}
+        self._by_address: Dict[str, str] = {}  # 'ip:port' -> username
+        self._expiry: List[Tuple[float, str]] = []  # (deadline, username), lazily pruned
+        self._snapshot: Mapping[str, str] = MappingProxyType({})
+
+    def update(self, username: str, ip: str, port: int, now: Optional[float] = None,
+               ttl: Optional[float] = None) -> Tuple[str, Optional[str]]:
+        """Record an announcement, keeping the peer for `ttl` seconds
+        (default: the table timeout).
+
+        Returns (change, previous 'ip:port'), where change is PEER_ADDED,
+        PEER_ADDRESS_CHANGED or PEER_REFRESHED.
+        """
+        now = time.monotonic() if now is None else now
+        expires = now + (self.timeout if ttl is None else ttl)
+        address = f"{ip}:{port}"
+        previous = None
+        with self._lock:
+            info = self._peers.get(username)
+            if info is None:
+                result = PEER_ADDED
+                info = self._peers[username] = {'ip': ip, 'port': port}
+            elif (info['ip'], info['port']) != (ip, port):
+                result = PEER_ADDRESS_CHANGED
+                previous = f"{info['ip']}:{info['port']}"
+                self._by_address.pop(previous, None)
+                info['ip'], info['port'] = ip, port
+            else:
+                result = PEER_REFRESHED
+                previous = address
+
+            info['last_seen'] = now
+            info['expires'] = expires
+            heapq.heappush(self._expiry, (expires, username))
+            if result != PEER_REFRESHED:
+                self._by_address[address] = username
+                self._publish()
+        return result, previous
+
+    def remove(self, username: str) -> Optional[dict]:
+        """Remove a peer, returning its info if it was present"""
+        with self._lock:
+            info = self._remove_locked(username)
+            if info is not None:
+                self._publish()
+            return info
+
+    def expire(self, now: Optional[float] = None) -> List[Tuple[str, dict]]:
+        """Remove and return peers whose announcement has outlived its TTL"""
+        now = time.monotonic() if now is None else now
+        expired = []
+        with self._lock:
+            heap = self._expiry
+            while heap and heap[0][0] <= now:
+                deadline, username = heapq.heappop(heap)
+                info = self._peers.get(username)
+                # Skip entries superseded by a later refresh
+                if info is None or info['expires'] > deadline:
+                    continue
+                expired.append((username, self._remove_locked(username)))
+            if expired:
+                self._publish()
+        return expired
+
+    def next_expiry(self) -> Optional[float]:
+        """Monotonic time of the earliest pending deadline, if any"""
+        with self._lock:
+            return self._expiry[0][0] if self._expiry else None
+
+    def snapshot(self) -> Mapping[str, str]:
+        """Read-only {username: 'ip:port'} view, safe to use without locking"""
+        return self._snapshot
+
+    def get_address(self, username: str) -> Optional[str]:
+        """'ip:port' for a username"""
+        return self._snapshot.get(username)
+
+    def get_username(self, address: str) -> Optional[str]:
+        """Username announced from an 'ip:port'"""
+        with self._lock:
+            return self._by_address.get(address)
+
+    def get_info(self, username: str) -> Optional[dict]:
+        """Copy of a peer's {ip, port, last_seen, expires} record"""
+        with self._lock:
+            info = self._peers.get(username)
+            return dict(info) if info else None
+
+    def __contains__(self, username: str) -> bool:
+        return username in self._snapshot
+
+    def __len__(self) -> int:
+        return len(self._snapshot)
+
+    def _remove_locked(self, username: str) -> Optional[dict]:
+        info = self._peers.pop(username, None)
+        if info is not None:
+            self._by_address.pop(f"{info['ip']}:{info['port']}", None)
+        return info
+
+    def _publish(self):
+        """Swap in a fresh reader snapshot (caller holds the lock)"""
+        self._snapshot = MappingProxyType({
+            username: f"{info['ip']}:{info['port']}"
+            for username, info in self._peers.items()
+        })
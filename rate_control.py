@@ -0,0 +1,240 @@
+"""
+Rate Control Module
+Congestion-aware bitrate control for VideoClient.
+
+The receiver summarises what it got every FEEDBACK_INTERVAL (frame
+loss, jitter, change in transit delay and receive rate) and sends the
+summary back over the video socket. The sender keeps a target bitrate:
+it backs off on loss or a growing queueing delay, and otherwise probes
+upward, capped near what the receiver actually gets. The target is met
+by adjusting JPEG quality first, then resolution, then frame rate, all
+within configured bounds.
+
+The cap only applies while the sender is trying to fill its target.
+When it sends much less (a static scene whose frames are skipped or
+sent as small deltas), a low receive rate says nothing about the path,
+so the target is held where it is rather than capped or raised.
+
+In a group call every receiver reports on the same stream. Any of them
+can make the sender back off, but it probes upward at most once per
+interval, so the stream settles at what the weakest receiver can take.
+"""
+import struct
+import threading
+import time
+from typing import Optional, Sequence, Tuple
+
+from jitter_buffer import ts_diff
+
+
+# Datagram kind shared with video_packet's PKT_FRAGMENT
+PKT_FEEDBACK = 2
+
+# kind, stream id reported on, highest frame id, loss fraction (x/255),
+# jitter ms, transit change ms (signed), receive rate kbit/s
+FEEDBACK = struct.Struct('!BIIBHhI')
+
+FEEDBACK_INTERVAL = 0.5  # seconds
+
+
+class ReceiveStats:
+    """Receiver-side counters summarised into feedback datagrams"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._highest: Optional[int] = None
+        self._expected_from: Optional[int] = None  # first frame id of this interval
+        self._frames = 0
+        self._bytes = 0
+        self._transit_sum = 0
+        self._last_avg_transit: Optional[float] = None
+        self._started = time.monotonic()
+
+    def on_frame(self, frame_id: int, capture_ms: int, size: int, now: Optional[float] = None):
+        """Record a completely received frame"""
+        now = time.monotonic() if now is None else now
+        transit = ts_diff(int(now * 1000), capture_ms)
+        with self._lock:
+            if self._highest is None:
+                self._highest = self._expected_from = frame_id
+            elif ts_diff(frame_id, self._highest) > 0:
+                self._highest = frame_id
+            self._frames += 1
+            self._bytes += size
+            self._transit_sum += transit
+
+    def report(self, stream_id: int, jitter_ms: float, now: Optional[float] = None) -> Optional[bytes]:
+        """Build the feedback datagram for the interval just ended and start a new one"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            if self._highest is None:
+                return None
+            elapsed = max(now - self._started, 1e-3)
+            expected = ts_diff(self._highest, self._expected_from) + 1
+            loss = max(0.0, 1 - self._frames / expected) if expected > 0 else 0.0
+
+            gradient = 0
+            if self._frames:
+                avg_transit = self._transit_sum / self._frames
+                if self._last_avg_transit is not None:
+                    gradient = int(avg_transit - self._last_avg_transit)
+                self._last_avg_transit = avg_transit
+
+            datagram = FEEDBACK.pack(
+                PKT_FEEDBACK, stream_id, self._highest, min(255, int(loss * 255)),
+                min(0xFFFF, int(jitter_ms)), max(-0x8000, min(0x7FFF, gradient)),
+                int(self._bytes * 8 / elapsed / 1000),
+            )
+            self._expected_from = (self._highest + 1) & 0xFFFFFFFF
+            self._frames = self._bytes = self._transit_sum = 0
+            self._started = now
+            return datagram
+
+
+class RateController:
+    """Target bitrate from receiver feedback, mapped onto quality, resolution and fps"""
+
+    LOSS_HIGH = 0.10      # back off above this frame loss
+    LOSS_LOW = 0.02       # probe upward below this
+    DELAY_RISE_MS = 15    # transit growth per interval treated as queueing
+    INCREASE = 1.08       # multiplicative probe per feedback interval
+    DECREASE = 0.85       # back-off on queueing delay
+    HEADROOM = 1.5        # never target more than this times the receive rate
+    APP_LIMITED = 0.5     # sending under this fraction of the target means the source, not the path, limits the rate
+    QUALITY_STEP = 5
+    SWITCH_HOLD = 30      # frames between resolution changes, so the ladder can't flap
+
+    def __init__(self, width: int, height: int,
+                 min_bitrate: int = 100_000, max_bitrate: int = 4_000_000,
+                 start_bitrate: int = 600_000,
+                 min_quality: int = 20, max_quality: int = 85, start_quality: int = 50,
+                 min_fps: float = 5, max_fps: float = 30, start_fps: float = 15,
+                 scales: Sequence[float] = (1.0, 0.75, 0.5, 0.25)):
+        self.min_bitrate = min_bitrate
+        self.max_bitrate = max_bitrate
+        self.min_quality = min_quality
+        self.max_quality = max_quality
+        self.min_fps = min_fps
+        self.max_fps = max_fps
+        # Resolution ladder, largest first, each dimension kept even for the encoder
+        self.resolutions = [(int(width * k) & ~1, int(height * k) & ~1) for k in scales]
+
+        self._lock = threading.Lock()
+        self.target_bitrate = max(min_bitrate, min(max_bitrate, start_bitrate))
+        self.quality = max(min_quality, min(max_quality, start_quality))
+        self.level = 0  # index into resolutions
+        self._since_switch = 0
+        self.start_fps = start_fps
+        self.fps = start_fps
+        self.last_feedback: Optional[dict] = None
+        self._probed_at = 0.0
+        # Bytes handed to the network, measured over FEEDBACK_INTERVAL windows
+        self._sent_bytes = 0
+        self._sent_since = time.monotonic()
+        self.send_rate: Optional[float] = None  # bit/s over the last full window
+
+    @property
+    def resolution(self) -> Tuple[int, int]:
+        return self.resolutions[self.level]
+
+    def on_feedback(self, datagram: memoryview, now: Optional[float] = None):
+        """Adjust the target bitrate from a receiver feedback datagram"""
+        _, _, highest, loss, jitter, gradient, rate_kbps = FEEDBACK.unpack_from(datagram, 0)
+        loss /= 255
+        receive_rate = rate_kbps * 1000
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            target = self.target_bitrate
+            if loss > self.LOSS_HIGH:
+                target *= 1 - loss / 2
+            elif gradient > self.DELAY_RISE_MS:
+                target *= self.DECREASE
+            elif (loss < self.LOSS_LOW and now - self._probed_at >= FEEDBACK_INTERVAL * 0.8
+                  and not self._app_limited(now)):
+                self._probed_at = now
+                target *= self.INCREASE
+                if receive_rate:
+                    target = min(target, max(receive_rate * self.HEADROOM, self.min_bitrate))
+            self.target_bitrate = int(max(self.min_bitrate, min(self.max_bitrate, target)))
+            self.last_feedback = {
+                'highest_frame': highest, 'loss': round(loss, 3), 'jitter_ms': jitter,
+                'delay_gradient_ms': gradient, 'receive_kbps': rate_kbps,
+            }
+
+    def on_frame_sent(self, size: int, now: Optional[float] = None):
+        """Count an encoded frame (whole or delta) handed to the network"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._sent_bytes += size
+            self._roll_send_window(now)
+
+    def _roll_send_window(self, now: float):
+        """Close the send-rate window once it spans FEEDBACK_INTERVAL (lock held)"""
+        elapsed = now - self._sent_since
+        if elapsed >= FEEDBACK_INTERVAL:
+            self.send_rate = self._sent_bytes * 8 / elapsed
+            self._sent_bytes = 0
+            self._sent_since = now
+
+    def _app_limited(self, now: float) -> bool:
+        """Whether the sender is offering well under its target (lock held).
+
+        Skipped frames send nothing, so during a static scene the window
+        is closed from the feedback path instead. Once the open window is
+        half an interval long its own rate counts too, so a scene change
+        that starts late in a quiet window isn't held back a whole extra
+        interval by that window's low rate.
+        """
+        self._roll_send_window(now)
+        floor = self.target_bitrate * self.APP_LIMITED
+        elapsed = now - self._sent_since
+        if elapsed >= FEEDBACK_INTERVAL / 2 and self._sent_bytes * 8 / elapsed >= floor:
+            return False
+        return self.send_rate is not None and self.send_rate < floor
+
+    def on_frame_encoded(self, size: int):
+        """Steer the encoder so frames fit the per-frame budget.
+
+        Over budget, give up extra frame rate first, then quality, then
+        resolution, then frame rate down to min_fps; under budget, climb
+        back in the reverse order.
+        """
+        with self._lock:
+            budget = self.target_bitrate / 8 / self.fps
+            self._since_switch += 1
+            can_switch = self._since_switch >= self.SWITCH_HOLD
+            if size > budget:
+                if self.fps > self.start_fps:
+                    self.fps -= 1
+                elif self.quality > self.min_quality:
+                    self.quality = max(self.min_quality, self.quality - self.QUALITY_STEP)
+                elif self.level < len(self.resolutions) - 1:
+                    if can_switch:
+                        self.level += 1
+                        self.quality = self.max_quality
+                        self._since_switch = 0
+                elif self.fps > self.min_fps:
+                    self.fps = max(self.min_fps, self.fps - 1)
+            elif size < budget * 0.7:
+                if self.fps < self.start_fps:
+                    self.fps += 1
+                elif self.level > 0 and self.quality >= self.max_quality:
+                    if can_switch:
+                        self.level -= 1
+                        self.quality = self.min_quality
+                        self._since_switch = 0
+                elif self.quality < self.max_quality:
+                    self.quality = min(self.max_quality, self.quality + self.QUALITY_STEP)
+                elif self.fps < self.max_fps:
+                    self.fps += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'target_kbps': self.target_bitrate // 1000,
+                'send_kbps': None if self.send_rate is None else int(self.send_rate // 1000),
+                'quality': self.quality,
+                'resolution': self.resolution,
+                'fps': self.fps,
+                'feedback': self.last_feedback,
+            }
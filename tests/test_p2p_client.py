@@ -0,0 +1,105 @@
+"""Tests for P2PClient over loopback links"""
+import os
+import queue
+import tempfile
+import time
+import unittest
+
+from p2p_client import P2PClient, LINK_CONNECTED, LINK_DISCONNECTED, LINK_IDLE
+
+
+class LoopbackTestCase(unittest.TestCase):
+    """Two clients, alice and bob, on this host"""
+
+    HEARTBEAT_INTERVAL = 0
+
+    def setUp(self):
+        # start() appends to tracking_log.txt in the working directory
+        self._cwd = os.getcwd()
+        self._tmp = tempfile.TemporaryDirectory()
+        os.chdir(self._tmp.name)
+
+        self.received = queue.Queue()
+        self.alice = P2PClient(port=47000, heartbeat_interval=self.HEARTBEAT_INTERVAL)
+        self.bob = P2PClient(port=47100, heartbeat_interval=0)
+        self.bob.set_message_callback(lambda sender, text, timestamp: self.received.put(text))
+        self.alice.start('alice')
+        self.bob.start('bob')
+        self.bob_address = f"127.0.0.1:{self.bob.port}"
+
+    def tearDown(self):
+        self.alice.stop()
+        self.bob.stop()
+        os.chdir(self._cwd)
+        self._tmp.cleanup()
+
+
+class SendAfterEvictionTest(LoopbackTestCase):
+    """A message to a peer whose idle link was closed is re-dialled in the background"""
+
+    DIAL_DELAY = 1.0
+
+    def test_send_after_eviction_does_not_wait_on_dial(self):
+        self.assertTrue(self.alice.connect_to_peer(self.bob_address))
+        self.alice.send_message(self.bob_address, 'one')
+        self.assertEqual(self.received.get(timeout=2), 'one')
+
+        conn = self.alice.find_connection(self.bob_address)
+        self.alice._on_disconnect(conn, "idle connection evicted")
+        self.assertIsNone(self.alice.find_connection(self.bob_address))
+
+        # Make the re-dial slow so a blocking send would be noticed
+        connect = self.alice.connect_to_peer
+
+        def slow_connect(address):
+            time.sleep(self.DIAL_DELAY)
+            return connect(address)
+        self.alice.connect_to_peer = slow_connect
+
+        started = time.monotonic()
+        self.alice.send_message(self.bob_address, 'two')
+        self.alice.send_message(self.bob_address, 'three')
+        self.assertLess(time.monotonic() - started, self.DIAL_DELAY / 2)
+
+        self.assertEqual(self.received.get(timeout=self.DIAL_DELAY + 2), 'two')
+        self.assertEqual(self.received.get(timeout=2), 'three')
+        self.assertIsNotNone(self.alice.find_connection(self.bob_address))
+
+    def test_send_to_unknown_peer_raises(self):
+        with self.assertRaises(ValueError):
+            self.alice.send_message('nobody', 'hello')
+
+
+class PeerStateTest(LoopbackTestCase):
+    """Idle eviction and a failed heartbeat are reported differently"""
+
+    HEARTBEAT_INTERVAL = 0.1
+
+    def setUp(self):
+        super().setUp()
+        self.assertTrue(self.alice.connect_to_peer(self.bob_address))
+        self.alice.discovery.peers.update('bob', '127.0.0.1', self.bob.port)
+        self.assertEqual(self.alice.get_peer_state('bob'), LINK_CONNECTED)
+
+    def test_evicted_peer_is_idle(self):
+        conn = self.alice.find_connection(self.bob_address)
+        self.alice._on_disconnect(conn, "idle connection evicted")
+        self.assertEqual(self.alice.get_peer_state('bob'), LINK_IDLE)
+        self.assertEqual(self.alice.get_peer_state(self.bob_address), LINK_IDLE)
+
+    def test_silent_peer_is_disconnected(self):
+        conn = self.alice.find_connection(self.bob_address)
+        conn.answers_pings = True
+        conn.last_received = time.monotonic() - 2 * self.alice.heartbeat_timeout
+        deadline = time.monotonic() + 2
+        while not conn.closed and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(self.alice.get_peer_state('bob'), LINK_DISCONNECTED)
+        self.assertEqual(self.alice.get_peer_state(self.bob_address), LINK_DISCONNECTED)
+
+    def test_unknown_peer_is_disconnected(self):
+        self.assertEqual(self.alice.get_peer_state('nobody'), LINK_DISCONNECTED)
+
+
+if __name__ == '__main__':
+    unittest.main()
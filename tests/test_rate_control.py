@@ -0,0 +1,75 @@
+"""Tests for RateController's app-limited hold"""
+import math
+import time
+import unittest
+
+from rate_control import FEEDBACK, FEEDBACK_INTERVAL, PKT_FEEDBACK, RateController
+
+
+FRAME_INTERVAL = 0.125  # seconds between sent frames (exact in binary, so windows close on a frame)
+FRAMES_PER_INTERVAL = round(FEEDBACK_INTERVAL / FRAME_INTERVAL)
+
+
+def feedback(receive_kbps: int, loss: float = 0.0, gradient_ms: int = 0) -> bytes:
+    return FEEDBACK.pack(PKT_FEEDBACK, 1, 0, int(loss * 255), 0, gradient_ms, receive_kbps)
+
+
+class AppLimitedTest(unittest.TestCase):
+    """The receive-rate cap only applies while the sender tries to fill its target"""
+
+    START = 1_000_000
+
+    def setUp(self):
+        self.rate = RateController(640, 480, start_bitrate=self.START)
+        # A whole second on, so the first frame closes the send window opened in __init__
+        self.now = float(math.ceil(time.monotonic())) + 1
+        self.frames = 0
+
+    def run_for(self, seconds: float, frame_bytes: int, receive_kbps: int,
+                loss: float = 0.0, gradient_ms: int = 0):
+        """Send a frame every FRAME_INTERVAL and feedback every FEEDBACK_INTERVAL.
+
+        Send windows close on frames 1, 5, 9...; feedback arrives half an
+        interval later (frames 3, 7, 11...), as it isn't in step with them.
+        """
+        for _ in range(round(seconds / FRAME_INTERVAL)):
+            self.frames += 1
+            self.now += FRAME_INTERVAL
+            self.rate.on_frame_sent(frame_bytes, now=self.now)
+            if self.frames % FRAMES_PER_INTERVAL == 3:
+                self.rate.on_feedback(feedback(receive_kbps, loss, gradient_ms), now=self.now)
+
+    def full_rate_frame(self) -> int:
+        """Frame size that fills the current target"""
+        return int(self.rate.target_bitrate / 8 * FRAME_INTERVAL)
+
+    def test_static_scene_holds_target(self):
+        # 1 kB every 125 ms is 64 kbit/s, far under the target
+        self.run_for(10, 1000, receive_kbps=64)
+        self.assertEqual(self.rate.target_bitrate, self.START)
+
+    def test_busy_scene_is_capped_to_receive_rate(self):
+        self.run_for(5, self.full_rate_frame(), receive_kbps=300)
+        self.assertLessEqual(self.rate.target_bitrate, 300_000 * RateController.HEADROOM)
+
+    def test_loss_backs_off_while_app_limited(self):
+        self.run_for(2, 1000, receive_kbps=64)
+        self.run_for(FEEDBACK_INTERVAL, 1000, receive_kbps=64, loss=0.3)
+        self.assertLess(self.rate.target_bitrate, self.START)
+
+    def test_delay_backs_off_while_app_limited(self):
+        self.run_for(2, 1000, receive_kbps=64)
+        self.run_for(FEEDBACK_INTERVAL, 1000, receive_kbps=64,
+                     gradient_ms=RateController.DELAY_RISE_MS + 5)
+        self.assertEqual(self.rate.target_bitrate, int(self.START * RateController.DECREASE))
+
+    def test_probing_resumes_within_one_interval(self):
+        # The scene changes on the frame that closes a quiet send window,
+        # so that window's rate is still under APP_LIMITED of the target
+        self.run_for(2, 1000, receive_kbps=64)
+        self.run_for(FEEDBACK_INTERVAL, self.full_rate_frame(), receive_kbps=self.START // 1000)
+        self.assertGreater(self.rate.target_bitrate, self.START)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,54 +1,209 @@
 """
 Video Calling Module
-Handles video capture and UDP streaming
+Handles video capture and UDP streaming, 1:1 or with several participants
 """
 import cv2
 import socket
 import threading
 import time
-import struct
-import numpy as np
-from PIL import Image, ImageTk
-from typing import Optional, Callable
+from PIL import Image
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from video_packet import (
+    DEFAULT_MTU, MAX_DATAGRAM, PKT_FRAGMENT, STREAM_HEADER,
+    FrameAssembler, new_stream_id, packetize, timestamp_ms,
+)
+from jitter_buffer import VideoJitterBuffer
+from rate_control import FEEDBACK, FEEDBACK_INTERVAL, PKT_FEEDBACK, RateController, ReceiveStats
+from media_pipeline import DropOldestQueue, LatestFrame, StageStats
+from video_delta import (
+    DELTA_SKIP, PKT_KEYFRAME_REQUEST, SEND_DELTA, SEND_KEY, SEND_SKIP,
+    ChangeDetector, DeltaDecoder, decode_rgb, encode_delta, encode_key,
+)
+
+STREAM_TIMEOUT = 10.0  # seconds of silence before a remote stream or learned participant is dropped
+MAX_STREAMS = 16       # remote streams received at once
+
+
+def decode_into(data, frames: LatestFrame, decoder: Optional[DeltaDecoder] = None) -> bool:
+    """Decode a frame payload into a reused PIL image and publish it to the renderer.
+
+    Plain JPEG payloads need no decoder; key/delta payloads need the
+    stream's DeltaDecoder. Returns True if the renderer had no frame
+    waiting and needs waking.
+    """
+    frame = decoder.decode(data) if decoder else decode_rgb(data)
+    if frame is None:
+        return False
+    height, width = frame.shape[:2]
+    image = frames.acquire((width, height))
+    image.frombytes(frame)  # copies into the image's existing storage
+    return frames.publish()
+
+
+class _RemoteStream:
+    """Receive state for one remote sender's stream"""
+
+    def __init__(self, stream_id: int, address: tuple):
+        self.stream_id = stream_id
+        self.address = address  # where its datagrams arrive from: the sender or a forwarder
+        self.assembler = FrameAssembler()
+        self.jitter_buffer = VideoJitterBuffer()
+        self.receive_stats = ReceiveStats()
+        self.delta_decoder = DeltaDecoder()
+        # Decoded frames for the renderer, in reused RGB images
+        self.frames = LatestFrame(lambda size: Image.new('RGB', size))
+        self.last_seen = time.monotonic()
+        self.keyframe_requested = 0.0
+
+    def stats(self) -> dict:
+        return {
+            'address': self.address,
+            'render': {
+                'frames_published': self.frames.published,
+                'frames_skipped': self.frames.skipped,
+                'buffers_allocated': self.frames.allocated,
+            },
+            'deltas_dropped': self.delta_decoder.deltas_dropped,
+            'assembler': self.assembler.stats(),
+            'jitter_buffer': self.jitter_buffer.stats(),
+        }
+
 
 class VideoClient:
     """Handles video streaming via UDP"""
     
-    def __init__(self, port: int):
+    def __init__(self, port: int, width: int = 320, height: int = 240,
+                 quality: int = 50, mtu: int = DEFAULT_MTU,
+                 adaptive: bool = True,
+                 min_quality: int = 20, max_quality: int = 85,
+                 min_fps: float = 5, max_fps: float = 30, fps: float = 15,
+                 min_bitrate: int = 100_000, max_bitrate: int = 4_000_000,
+                 encode_workers: int = 2,
+                 delta_mode: str = DELTA_SKIP, keyframe_interval: float = 2.0,
+                 forward: bool = False):
+        """
+        width, height: capture resolution (the largest sent)
+        quality: JPEG quality (0-100) to start from
+        mtu: largest datagram sent; frames are split into fragments this size
+        adaptive: adjust quality, resolution and fps to receiver feedback,
+            within the min/max bounds below; otherwise send at fixed settings
+        fps: frame rate to start from
+        min_bitrate, max_bitrate: bounds for the target bitrate (bit/s)
+        encode_workers: frames encoded in parallel (OpenCV releases the GIL)
+        delta_mode: 'off' sends every frame, 'skip' drops frames that haven't
+            changed, 'tiles' also sends only the changed tiles between keyframes
+        keyframe_interval: seconds between full frames in 'skip'/'tiles' mode
+        forward: act as a selective forwarding node, relaying each received
+            datagram unchanged to the other participants (so every sender
+            uploads one stream however many join) and routing feedback back
+            to each stream's sender; anyone who sends to this client joins
+        """
         self.port = port + 1  # Video port is Chat Port + 1
-        self.remote_address: Optional[tuple] = None
+        self.width = width
+        self.height = height
+        self.quality = quality
+        self.mtu = mtu
+        self.adaptive = adaptive
+        self.encode_workers = encode_workers
+        self.delta_mode = delta_mode
+        self.keyframe_interval = keyframe_interval
+        self.detector = ChangeDetector(delta_mode, keyframe_interval=keyframe_interval)
+        self.rate = RateController(
+            width, height,
+            min_bitrate=min_bitrate, max_bitrate=max_bitrate,
+            min_quality=min_quality, max_quality=max_quality, start_quality=quality,
+            min_fps=min_fps, max_fps=max_fps, start_fps=fps
+        )
+        self.stream_id = new_stream_id()  # identifies our stream to every receiver
+        self.forward = forward
+        self.remotes: List[tuple] = []  # video addresses we send to
+        self._learned: Dict[tuple, float] = {}  # forward mode: address -> last heard from
+        self._targets: Tuple[tuple, ...] = ()  # remotes + learned, read by the send path
+        self._owners: Dict[int, tuple] = {}  # forward mode: stream id -> its sender's address
+        self._lock = threading.Lock()
         self.running = False
         self.capture: Optional[cv2.VideoCapture] = None
         
         # Sockets
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 65536)  # 64KB buffer
+        # Room for a few fragmented frames in flight
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1024 * 1024)
         self.socket.bind(('0.0.0.0', self.port))
         
         # State
-        self.frame_callback: Optional[Callable] = None
+        self.frame_callback: Optional[Callable[[int], None]] = None
+        self.stream_end_callback: Optional[Callable[[int], None]] = None
+        self.streams: Dict[int, _RemoteStream] = {}  # remote stream id -> receive state
+        self.frame_id = 0  # sequence number of the next frame sent
+        self.datagrams_forwarded = 0
+        self.streams_rejected = 0  # new streams refused beyond MAX_STREAMS
         
-    def start_call(self, remote_ip: str, remote_port: int, on_frame: Callable):
-        """Start video call with a peer"""
-        # Video port is always Chat Port + 1
-        self.remote_address = (remote_ip, remote_port + 1)
+        # Send pipeline: capture -> encoder pool -> sender, with per-stage timings
+        self.encoder: Optional[ThreadPoolExecutor] = None
+        self.send_queue = DropOldestQueue(encode_workers + 1, on_drop=lambda item: item[2].cancel())
+        self.stage_stats = StageStats()
+        
+    @property
+    def remote_address(self) -> Optional[tuple]:
+        """First configured remote (the peer, in a 1:1 call)"""
+        return self.remotes[0] if self.remotes else None
+
+    def start_call(self, remote_ip: str, remote_port: int, on_frame: Callable[[int], None],
+                   on_stream_end: Optional[Callable[[int], None]] = None):
+        """Start video call with a peer (see start_group_call)"""
+        self.start_group_call([(remote_ip, remote_port)], on_frame, on_stream_end)
+
+    def start_group_call(self, remotes: Iterable[Tuple[str, int]], on_frame: Callable[[int], None],
+                         on_stream_end: Optional[Callable[[int], None]] = None):
+        """Start a video call with any number of participants.
+
+        remotes: (ip, chat port) of each participant to send to. With a
+            forwarding node, that is just the node; a forwarding node
+            can start with none and learn participants as they send.
+        on_frame(stream_id) is called from that stream's playout thread
+            when a new frame is ready and the renderer has none waiting;
+            fetch it with take_frame(stream_id). Frames the renderer is
+            too slow for are skipped.
+        on_stream_end(stream_id) is called once a stream has gone silent.
+        """
+        with self._lock:
+            # Video port is always Chat Port + 1
+            self.remotes = [(ip, port + 1) for ip, port in remotes]
+            self._learned.clear()
+            self._owners.clear()
+            self._rebuild_targets()
         self.frame_callback = on_frame
+        self.stream_end_callback = on_stream_end
+        self.streams = {}
+        self.encoder = ThreadPoolExecutor(max_workers=self.encode_workers)
+        self.send_queue = DropOldestQueue(self.encode_workers + 1, on_drop=lambda item: item[2].cancel())
+        self.stage_stats = StageStats()
+        self.detector = ChangeDetector(self.delta_mode, keyframe_interval=self.keyframe_interval)
         self.running = True
         
         # Initialize camera
         self.capture = cv2.VideoCapture(0)
-        self.capture.set(cv2.CAP_PROP_FRAME_WIDTH, 320)
-        self.capture.set(cv2.CAP_PROP_FRAME_HEIGHT, 240)
+        self.capture.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)
+        self.capture.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
         
         # Start threads
+        threading.Thread(target=self._capture_loop, daemon=True).start()
         threading.Thread(target=self._send_loop, daemon=True).start()
         threading.Thread(target=self._receive_loop, daemon=True).start()
+        threading.Thread(target=self._feedback_loop, daemon=True).start()
         
-        print(f"Video started on port {self.port} -> {self.remote_address}")
+        mode = " (forwarding)" if self.forward else ""
+        print(f"Video started on port {self.port}{mode} -> {', '.join(map(str, self.remotes)) or 'no one yet'}")
         
     def stop_call(self):
         """Stop video call"""
         self.running = False
+        for stream in self._stream_list():
+            stream.jitter_buffer.close()
+        self.send_queue.close()
+        if self.encoder:
+            self.encoder.shutdown(wait=False)
         if self.capture:
             self.capture.release()
         
@@ -56,51 +211,316 @@ class VideoClient:
         # But for full cleanup:
         # self.socket.close() 
 
-    def _send_loop(self):
-        """Capture and send frames"""
+    def add_remote(self, remote_ip: str, remote_port: int):
+        """Start sending to another participant mid-call"""
+        address = (remote_ip, remote_port + 1)
+        with self._lock:
+            if address not in self.remotes:
+                self.remotes.append(address)
+                self._rebuild_targets()
+
+    def remove_remote(self, remote_ip: str, remote_port: int):
+        """Stop sending to a participant; their stream ends once it goes silent"""
+        address = (remote_ip, remote_port + 1)
+        with self._lock:
+            if address in self.remotes:
+                self.remotes.remove(address)
+            self._learned.pop(address, None)
+            self._rebuild_targets()
+
+    def _rebuild_targets(self):
+        """Snapshot who to send to, so the send path never iterates a changing list (lock held)"""
+        self._targets = tuple(dict.fromkeys(self.remotes + list(self._learned)))
+
+    def _capture_loop(self):
+        """Grab frames on a steady clock and hand them to the encoder pool"""
+        next_due = time.monotonic()
         while self.running and self.capture.isOpened():
+            started = time.perf_counter()
             ret, frame = self.capture.read()
             if not ret:
                 continue
-                
-            # Compress frame
-            # 1. Resize (optional, already set in cap props, but safety check)
-            frame = cv2.resize(frame, (320, 240))
-            
-            # 2. Encode to JPEG
-            encoded, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 50])
-            
-            # 3. Send via UDP
-            if self.remote_address:
+            captured = timestamp_ms()
+            queued = self.stage_stats.timed('capture', started)
+
+            # Settings are fixed here so parallel encoders agree with the detector
+            if self.adaptive:
+                size, quality = self.rate.resolution, self.rate.quality
+            else:
+                size, quality = (self.width, self.height), self.quality
+            action, tiles = self.detector.analyze(frame, size)
+            if action != SEND_SKIP:
                 try:
-                    # UDP packet limit is ~65KB, our frames should be ~5-10KB
-                    message = buffer.tobytes()
-                    self.socket.sendto(message, self.remote_address)
-                except Exception as e:
-                    print(f"Video send error: {e}")
-            
-            # Limit FPS to ~15 to save bandwidth
-            time.sleep(0.066)
+                    job = self.encoder.submit(self._encode, frame, queued, size, quality,
+                                              action, tiles, self.detector.key_id)
+                except RuntimeError:
+                    break  # stop_call() shut the encoder pool down
+                self.send_queue.put((captured, queued, job))
+
+            # Pace on deadlines so capture and hand-off time don't stretch the interval
+            next_due += 1 / (self.rate.fps if self.adaptive else self.rate.start_fps)
+            delay = next_due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_due = time.monotonic()  # fell behind: skip ahead rather than burst
+
+    def _encode(self, frame, queued: float, size: tuple, quality: int,
+                action: str, tiles: list, key_id: int):
+        """Encoder pool job: resize and JPEG-encode one frame, whole or as changed tiles"""
+        started = self.stage_stats.timed('encode_wait', queued)
+
+        # 1. Resize to the target resolution
+        width, height = size
+        if frame.shape[1] != width or frame.shape[0] != height:
+            frame = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+
+        # 2. Encode to JPEG
+        if action == SEND_DELTA:
+            payload = encode_delta(frame, key_id, tiles, self.detector.cols, self.detector.rows, quality)
+        else:
+            encoded, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+            if not encoded:
+                return None
+            # Only whole frames say how big a frame is at this quality
+            if self.adaptive:
+                self.rate.on_frame_encoded(len(buffer))
+            payload = encode_key(key_id, buffer) if action == SEND_KEY else buffer
+        self.stage_stats.timed('encode', started)
+        return payload
+
+    def _send_loop(self):
+        """Send encoded frames in capture order, one MTU-sized fragment per datagram"""
+        while self.running:
+            item = self.send_queue.get(timeout=0.5)
+            if item is None:
+                continue
+            captured, queued, job = item
+            try:
+                buffer = job.result()
+            except Exception as e:
+                print(f"Video encode error: {e}")
+                continue
+            targets = self._targets
+            if buffer is None or not targets:
+                continue
+
+            started = time.perf_counter()
+            try:
+                # Ids are given out here so frames shed by the queues don't look like loss
+                for datagram in packetize(self.stream_id, self.frame_id, captured, buffer, self.mtu):
+                    self._send_to(datagram, targets)
+                self.frame_id = (self.frame_id + 1) & 0xFFFFFFFF
+                self.rate.on_frame_sent(len(buffer))
+            except Exception as e:
+                print(f"Video send error: {e}")
+            done = self.stage_stats.timed('send', started)
+            self.stage_stats.record('capture_to_send', done - queued)
+
+    def _send_to(self, datagram, targets: Iterable[tuple], skip: Optional[tuple] = None):
+        """Send one datagram to each target but `skip`; one bad address doesn't stop the rest"""
+        for address in targets:
+            if address != skip:
+                try:
+                    self.socket.sendto(datagram, address)
+                except OSError as e:
+                    print(f"Video send error to {address}: {e}")
 
     def _receive_loop(self):
-        """Receive and decode frames"""
+        """Demux datagrams by stream id: fragments to each stream's reassembly and
+        jitter buffer, feedback for our stream to rate control, and in forward
+        mode relay everything else on"""
+        packet = bytearray(MAX_DATAGRAM)
+        view = memoryview(packet)
         while self.running:
             try:
-                data, addr = self.socket.recvfrom(65536)  # Max UDP packet size
-                
-                # Decode JPEG
-                np_data = np.frombuffer(data, dtype=np.uint8)
-                frame = cv2.imdecode(np_data, cv2.IMREAD_COLOR)
-                
-                if frame is not None:
-                    # Convert to Tkinter compatible format
-                    # OpenCV is BGR, Pillow uses RGB
-                    color_converted = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                    pil_image = Image.fromarray(color_converted)
-                    
-                    if self.frame_callback:
-                        self.frame_callback(pil_image)
-                        
+                size, addr = self.socket.recvfrom_into(packet)
+                if size < STREAM_HEADER.size:
+                    continue
+                kind, stream_id = STREAM_HEADER.unpack_from(packet, 0)
+                datagram = view[:size]
+                if self.forward and not self._learn(addr):
+                    continue  # not a participant, and no room to take them on
+
+                if kind == PKT_FRAGMENT:
+                    if stream_id == self.stream_id:
+                        continue  # our own stream, echoed back
+                    if self.forward:
+                        if not self._claim_stream(stream_id, addr):
+                            continue
+                        self._send_to(datagram, self._targets, skip=addr)
+                        self.datagrams_forwarded += 1
+                    self._on_fragment(stream_id, addr, datagram)
+                elif kind in (PKT_FEEDBACK, PKT_KEYFRAME_REQUEST):
+                    if stream_id == self.stream_id:
+                        if kind == PKT_KEYFRAME_REQUEST:
+                            self.detector.force_keyframe()
+                        elif size >= FEEDBACK.size:
+                            self.rate.on_feedback(datagram)
+                    elif self.forward:
+                        # About a stream we relay: pass it back to its sender
+                        owner = self._owners.get(stream_id)
+                        if owner and owner != addr:
+                            self._send_to(datagram, (owner,))
+                            self.datagrams_forwarded += 1
             except Exception as e:
                 if self.running:
                     print(f"Video receive error: {e}")
+
+    def _learn(self, address: tuple) -> bool:
+        """Forward mode: make a participant of anyone who sends to us, while
+        there is room. Returns whether the sender is a participant."""
+        with self._lock:
+            if address in self._learned:
+                self._learned[address] = time.monotonic()
+            elif address in self.remotes:
+                pass
+            elif len(self._learned) < MAX_STREAMS:
+                self._learned[address] = time.monotonic()
+                self._rebuild_targets()
+            else:
+                return False
+            return True
+
+    def _claim_stream(self, stream_id: int, address: tuple) -> bool:
+        """Forward mode: whether to relay a stream's fragments from `address`.
+
+        A stream belongs to whoever sent it first, and at most MAX_STREAMS
+        are relayed at once, so no sender can grow the owner table or
+        take over another participant's stream id.
+        """
+        with self._lock:
+            owner = self._owners.get(stream_id)
+            if owner is None:
+                if len(self._owners) >= MAX_STREAMS:
+                    self.streams_rejected += 1
+                    return False
+                self._owners[stream_id] = address
+                return True
+            return owner == address
+
+    def _on_fragment(self, stream_id: int, addr: tuple, datagram: memoryview):
+        stream = self.streams.get(stream_id) or self._open_stream(stream_id, addr)
+        if stream is None:
+            return
+        stream.address = addr
+        stream.last_seen = time.monotonic()
+        complete = stream.assembler.add(datagram)
+        if complete is None:
+            return  # frame still incomplete
+        frame_id, captured, data = complete
+        stream.receive_stats.on_frame(frame_id, captured, len(data))
+        # The assembler reuses its buffers, so the jitter buffer gets a copy
+        stream.jitter_buffer.push(frame_id, captured, bytes(data))
+
+    def _open_stream(self, stream_id: int, addr: tuple) -> Optional[_RemoteStream]:
+        """Receive state and a playout thread for a newly heard stream"""
+        with self._lock:
+            if len(self.streams) >= MAX_STREAMS:
+                self.streams_rejected += 1
+                return None
+            stream = self.streams[stream_id] = _RemoteStream(stream_id, addr)
+        threading.Thread(target=self._playout_loop, args=(stream,), daemon=True).start()
+        print(f"Video stream {stream_id:08x} from {addr}")
+        return stream
+
+    def _close_stream(self, stream: _RemoteStream):
+        with self._lock:
+            if self.streams.get(stream.stream_id) is not stream:
+                return
+            del self.streams[stream.stream_id]
+            self._owners.pop(stream.stream_id, None)
+        stream.jitter_buffer.close()
+        if self.stream_end_callback:
+            self.stream_end_callback(stream.stream_id)
+
+    def _stream_list(self) -> List[_RemoteStream]:
+        with self._lock:
+            return list(self.streams.values())
+
+    def _feedback_loop(self):
+        """Report reception quality on each stream back to its sender, and drop
+        streams and learned participants that have gone silent"""
+        while self.running:
+            time.sleep(FEEDBACK_INTERVAL)
+            now = time.monotonic()
+            for stream in self._stream_list():
+                if now - stream.last_seen > STREAM_TIMEOUT:
+                    print(f"Video stream {stream.stream_id:08x} ended")
+                    self._close_stream(stream)
+                    continue
+                report = stream.receive_stats.report(stream.stream_id, stream.jitter_buffer.estimator.jitter)
+                if report:
+                    try:
+                        self.socket.sendto(report, stream.address)
+                    except OSError as e:
+                        print(f"Video feedback error: {e}")
+
+            if self.forward:
+                with self._lock:
+                    silent = [a for a, seen in self._learned.items() if now - seen > STREAM_TIMEOUT]
+                    for address in silent:
+                        del self._learned[address]
+                    if silent:
+                        self._rebuild_targets()
+
+    def get_stats(self) -> dict:
+        """Send pipeline timings (ms), rate control, forwarding counters and,
+        per remote stream, reassembly/playout counters"""
+        return {
+            'stream_id': self.stream_id,
+            'pipeline': dict(self.stage_stats.snapshot(), frames_shed=self.send_queue.dropped),
+            'delta': self.detector.stats(),
+            'rate': self.rate.stats(),
+            'peers': {
+                'targets': len(self._targets),
+                'forwarding': self.forward,
+                'datagrams_forwarded': self.datagrams_forwarded,
+                'streams_rejected': self.streams_rejected,
+            },
+            'streams': {f"{stream.stream_id:08x}": stream.stats() for stream in self._stream_list()},
+        }
+
+    def _playout_loop(self, stream: _RemoteStream):
+        """Decode one stream's frames as its jitter buffer releases them and publish the newest"""
+        while self.running and self.streams.get(stream.stream_id) is stream:
+            try:
+                released = stream.jitter_buffer.pop(timeout=0.5)
+                if released is None:
+                    continue
+                frame_id, data = released
+                started = time.perf_counter()
+                wake = decode_into(data, stream.frames, stream.delta_decoder)
+                self.stage_stats.timed('decode', started)
+                if stream.delta_decoder.needs_keyframe:
+                    self._request_keyframe(stream)
+                if wake and self.frame_callback:
+                    self.frame_callback(stream.stream_id)
+            except Exception as e:
+                if self.running:
+                    print(f"Video playout error: {e}")
+
+    def _request_keyframe(self, stream: _RemoteStream):
+        """Ask a stream's sender for a whole frame (at most twice a second)"""
+        now = time.monotonic()
+        if now - stream.keyframe_requested < 0.5:
+            return
+        stream.keyframe_requested = now
+        try:
+            self.socket.sendto(STREAM_HEADER.pack(PKT_KEYFRAME_REQUEST, stream.stream_id), stream.address)
+        except OSError as e:
+            print(f"Video keyframe request error: {e}")
+
+    def take_frame(self, stream_id: int) -> Optional[Image.Image]:
+        """Newest decoded frame of a stream, or None if there is nothing new.
+
+        The image is reused for later frames: call release_frame() as
+        soon as it has been drawn.
+        """
+        stream = self.streams.get(stream_id)
+        return stream.frames.take() if stream else None
+
+    def release_frame(self, stream_id: int):
+        stream = self.streams.get(stream_id)
+        if stream:
+            stream.frames.release()
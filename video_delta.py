@@ -0,0 +1,231 @@
+"""
+Video Delta Module
+Change detection, unchanged-frame skipping and tile-delta frames for VideoClient.
+
+The sender compares a small grayscale thumbnail of each captured frame
+with the last frame it sent, split into a grid of tiles. Frames where no
+tile changed are not sent at all. In tile mode, a frame where only some
+tiles changed since the last keyframe is sent as a delta holding just
+those tiles. The receiver pastes them over its copy of that keyframe, so
+a lost delta never corrupts later frames. Keyframes are sent
+periodically, whenever most of the picture changes, and on request from
+a receiver that missed one.
+
+Payloads (inside the fragmented frame):
+  plain JPEG   starts with 0xFF (no delta coding)
+  keyframe     PAYLOAD_KEY, key id (u16), JPEG
+  delta        PAYLOAD_DELTA, key id (u16), width, height (u16), cols,
+               rows (u8), tile count (u16), then per tile: index (u16),
+               length (u32), JPEG
+"""
+import struct
+import time
+from typing import List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+
+# Change detection modes
+DELTA_OFF = 'off'      # send every frame
+DELTA_SKIP = 'skip'    # drop frames that match the last one sent
+DELTA_TILES = 'tiles'  # also send only changed tiles between keyframes
+DELTA_MODES = (DELTA_OFF, DELTA_SKIP, DELTA_TILES)
+
+# What to do with a captured frame
+SEND_SKIP = 'skip'
+SEND_FULL = 'full'
+SEND_KEY = 'key'
+SEND_DELTA = 'delta'
+
+PAYLOAD_DELTA = 1
+PAYLOAD_KEY = 2
+JPEG_START = 0xFF
+
+# Datagram kind (alongside video_packet's PKT_FRAGMENT and rate_control's
+# PKT_FEEDBACK); just a STREAM_HEADER naming the stream that needs a keyframe
+PKT_KEYFRAME_REQUEST = 3
+
+KEY_HEADER = struct.Struct('!BH')
+DELTA_HEADER = struct.Struct('!BHHHBBH')
+TILE_ENTRY = struct.Struct('!HI')
+
+THUMB_CELL = 8  # thumbnail pixels per tile side
+
+# OpenCV 4.10+ can decode JPEG straight to RGB
+IMREAD_RGB = getattr(cv2, 'IMREAD_COLOR_RGB', None)
+
+
+def decode_rgb(data) -> Optional[np.ndarray]:
+    """Decode a JPEG to an RGB array"""
+    frame = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), IMREAD_RGB or cv2.IMREAD_COLOR)
+    if frame is not None and not IMREAD_RGB:
+        cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=frame)  # in place, no copy
+    return frame
+
+
+def tile_rect(index: int, width: int, height: int, cols: int, rows: int) -> Tuple[int, int, int, int]:
+    """(x, y, w, h) of a tile; edge tiles absorb any remainder"""
+    tile_w, tile_h = -(-width // cols), -(-height // rows)
+    x, y = (index % cols) * tile_w, (index // cols) * tile_h
+    return x, y, min(tile_w, width - x), min(tile_h, height - y)
+
+
+class ChangeDetector:
+    """Decides per captured frame whether to skip it or send it whole or as a delta.
+
+    Runs on the capture thread, so its reference state is only ever
+    touched in capture order.
+    """
+
+    def __init__(self, mode: str = DELTA_SKIP, cols: int = 8, rows: int = 6,
+                 threshold: float = 4.0, keyframe_interval: float = 2.0,
+                 max_delta_fraction: float = 0.5):
+        if mode not in DELTA_MODES:
+            raise ValueError(f"Unknown delta mode '{mode}'. Choose from: {', '.join(DELTA_MODES)}")
+        self.mode = mode
+        self.cols = cols
+        self.rows = rows
+        self.threshold = threshold  # mean absolute grey-level change that counts as a change
+        self.keyframe_interval = keyframe_interval  # seconds; also refreshes a static picture
+        self.max_delta_fraction = max_delta_fraction  # above this, a keyframe is cheaper
+
+        self.key_id = 0
+        self._sent_thumb: Optional[np.ndarray] = None  # last frame sent
+        self._key_thumb: Optional[np.ndarray] = None   # last keyframe sent
+        self._key_size = None
+        self._key_at = 0.0
+        self._force_key = False
+
+        # Counters
+        self.frames_skipped = 0
+        self.keyframes = 0
+        self.deltas = 0
+
+    def force_keyframe(self):
+        """Send the next frame whole (a receiver lost the keyframe)"""
+        self._force_key = True
+
+    def analyze(self, frame: np.ndarray, size: Tuple[int, int],
+                now: Optional[float] = None) -> Tuple[str, List[int]]:
+        """Return (SEND_*, changed tile indices) for a BGR frame that will be
+        sent at `size`; a new size always starts with a keyframe."""
+        if self.mode == DELTA_OFF:
+            return SEND_FULL, []
+        now = time.monotonic() if now is None else now
+        thumb = self._thumbnail(frame)
+
+        key_due = (self._force_key or self._key_thumb is None
+                   or size != self._key_size
+                   or now - self._key_at >= self.keyframe_interval)
+        if not key_due and not self._changed_tiles(thumb, self._sent_thumb).size:
+            self.frames_skipped += 1
+            return SEND_SKIP, []
+        self._sent_thumb = thumb
+
+        if self.mode == DELTA_TILES and not key_due:
+            tiles = self._changed_tiles(thumb, self._key_thumb)
+            if tiles.size <= self.max_delta_fraction * self.cols * self.rows:
+                self.deltas += 1
+                return SEND_DELTA, tiles.tolist()
+
+        self._key_thumb = thumb
+        self._key_size = size
+        self._key_at = now
+        self._force_key = False
+        self.keyframes += 1
+        if self.mode == DELTA_TILES:
+            self.key_id = (self.key_id + 1) & 0xFFFF
+            return SEND_KEY, []
+        return SEND_FULL, []
+
+    def _thumbnail(self, frame: np.ndarray) -> np.ndarray:
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        size = (self.cols * THUMB_CELL, self.rows * THUMB_CELL)
+        return cv2.resize(gray, size, interpolation=cv2.INTER_AREA)
+
+    def _changed_tiles(self, thumb: np.ndarray, reference: Optional[np.ndarray]) -> np.ndarray:
+        """Indices of tiles whose mean change exceeds the threshold"""
+        if reference is None:
+            return np.arange(self.cols * self.rows)
+        diff = cv2.absdiff(thumb, reference)
+        per_tile = diff.reshape(self.rows, THUMB_CELL, self.cols, THUMB_CELL).mean(axis=(1, 3))
+        return np.flatnonzero(per_tile > self.threshold)
+
+    def stats(self) -> dict:
+        return {
+            'mode': self.mode,
+            'frames_skipped': self.frames_skipped,
+            'keyframes': self.keyframes,
+            'deltas': self.deltas,
+        }
+
+
+def encode_key(key_id: int, jpeg) -> bytes:
+    return KEY_HEADER.pack(PAYLOAD_KEY, key_id) + memoryview(jpeg)
+
+
+def encode_delta(frame: np.ndarray, key_id: int, tiles: List[int], cols: int, rows: int,
+                 quality: int) -> bytes:
+    """JPEG-encode the given tiles of a BGR frame into a delta payload"""
+    height, width = frame.shape[:2]
+    parts = [DELTA_HEADER.pack(PAYLOAD_DELTA, key_id, width, height, cols, rows, len(tiles))]
+    params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+    for index in tiles:
+        x, y, w, h = tile_rect(index, width, height, cols, rows)
+        ok, jpeg = cv2.imencode('.jpg', frame[y:y + h, x:x + w], params)
+        if not ok:
+            raise ValueError(f"Could not encode tile {index}")
+        parts += (TILE_ENTRY.pack(index, len(jpeg)), jpeg.tobytes())
+    return b''.join(parts)
+
+
+class DeltaDecoder:
+    """Rebuilds frames from plain, key and delta payloads (receiver side)"""
+
+    def __init__(self):
+        self.key_id: Optional[int] = None
+        self._key: Optional[np.ndarray] = None     # decoded keyframe (RGB)
+        self._canvas: Optional[np.ndarray] = None  # keyframe + latest tiles, reused
+        self.needs_keyframe = False
+        self.deltas_dropped = 0  # deltas whose keyframe never arrived
+
+    def decode(self, data) -> Optional[np.ndarray]:
+        """RGB frame for a payload, or None if it can't be shown"""
+        kind = data[0]
+        if kind == JPEG_START:
+            return decode_rgb(data)
+        if kind == PAYLOAD_KEY:
+            _, key_id = KEY_HEADER.unpack_from(data, 0)
+            frame = decode_rgb(memoryview(data)[KEY_HEADER.size:])
+            if frame is not None:
+                self._key, self.key_id = frame, key_id
+                self.needs_keyframe = False
+            return frame
+        if kind == PAYLOAD_DELTA:
+            return self._apply_delta(memoryview(data))
+        return None
+
+    def _apply_delta(self, data: memoryview) -> Optional[np.ndarray]:
+        _, key_id, width, height, cols, rows, count = DELTA_HEADER.unpack_from(data, 0)
+        if key_id != self.key_id or self._key is None or self._key.shape[:2] != (height, width):
+            self.deltas_dropped += 1
+            self.needs_keyframe = True
+            return None
+
+        # Start from the keyframe each time, so tiles from a lost or
+        # superseded delta never linger
+        if self._canvas is None or self._canvas.shape != self._key.shape:
+            self._canvas = np.empty_like(self._key)
+        np.copyto(self._canvas, self._key)
+
+        offset = DELTA_HEADER.size
+        for _ in range(count):
+            index, length = TILE_ENTRY.unpack_from(data, offset)
+            offset += TILE_ENTRY.size
+            tile = decode_rgb(data[offset:offset + length])
+            offset += length
+            x, y, w, h = tile_rect(index, width, height, cols, rows)
+            if tile is not None and tile.shape[:2] == (h, w):
+                self._canvas[y:y + h, x:x + w] = tile
+        return self._canvas
@@ -0,0 +1,169 @@
+"""
+Video Packet Module
+Splits encoded video frames into MTU-sized UDP datagrams and reassembles them.
+
+Sending a whole JPEG as one datagram relies on IP fragmentation above
+~1.4 KB (losing any fragment loses the frame) and fails outright above
+64 KB. Instead each frame is cut into chunks that fit one datagram, each
+carrying the frame id, its index, the fragment count and its byte offset
+in the frame, plus the frame's capture timestamp for playout timing.
+
+Every datagram kind starts with the kind byte and a 32-bit stream id
+(like an RTP SSRC) naming the sender's stream, so receivers can demux
+several senders on one socket and a forwarding node can route feedback
+back to a stream's owner without parsing the rest.
+"""
+import random
+import struct
+import time
+from typing import List, Optional, Tuple
+
+
+# Datagram kinds
+PKT_FRAGMENT = 1
+
+# kind, stream id: the prefix of every video datagram
+STREAM_HEADER = struct.Struct('!BI')
+
+# kind, stream id, frame id, capture time (ms, wraps), fragment index,
+# fragment count, byte offset in the frame
+FRAGMENT_HEADER = struct.Struct('!BIIIHHI')
+
+DEFAULT_MTU = 1200  # max datagram payload; stays under a 1500-byte path MTU with room for tunnels
+MAX_FRAME_SIZE = 1024 * 1024  # largest encoded frame the receiver will reassemble
+MAX_DATAGRAM = 65536
+
+
+def new_stream_id() -> int:
+    """Random 32-bit stream id, so independent senders are unlikely to collide"""
+    return random.getrandbits(32)
+
+
+def seq_newer(a: int, b: int, bits: int = 32) -> bool:
+    """True if sequence number a is after b, allowing for wraparound"""
+    half = 1 << (bits - 1)
+    return a != b and ((a - b) % (1 << bits)) < half
+
+
+def timestamp_ms(now: Optional[float] = None) -> int:
+    """32-bit millisecond capture timestamp from the monotonic clock"""
+    now = time.monotonic() if now is None else now
+    return int(now * 1000) & 0xFFFFFFFF
+
+
+def packetize(stream_id: int, frame_id: int, timestamp: int, payload: bytes,
+              mtu: int = DEFAULT_MTU) -> List[bytes]:
+    """Split an encoded frame into datagrams of at most `mtu` bytes"""
+    chunk = mtu - FRAGMENT_HEADER.size
+    view = memoryview(payload)
+    count = max(1, -(-len(view) // chunk))
+    if count > 0xFFFF:
+        raise ValueError(f"Frame of {len(view)} bytes needs too many fragments")
+    frame_id &= 0xFFFFFFFF
+    timestamp &= 0xFFFFFFFF
+    return [
+        FRAGMENT_HEADER.pack(PKT_FRAGMENT, stream_id, frame_id, timestamp, index, count, offset)
+        + view[offset:offset + chunk]
+        for index, offset in enumerate(range(0, max(len(view), 1), chunk))
+    ]
+
+
+class _Slot:
+    """One frame being reassembled, backed by a buffer allocated once"""
+
+    __slots__ = ('buffer', 'received', 'frame_id', 'timestamp', 'count', 'remaining', 'length', 'started')
+
+    def __init__(self, max_frame: int):
+        self.buffer = bytearray(max_frame)
+        self.received = bytearray(0xFFFF)  # one flag per fragment index
+        self.frame_id: Optional[int] = None
+        self.timestamp = 0
+        self.count = 0
+        self.remaining = 0
+        self.length = 0
+        self.started = 0.0
+
+    def reset(self, frame_id: int, timestamp: int, count: int, now: float):
+        self.frame_id = frame_id
+        self.timestamp = timestamp
+        self.count = count
+        self.remaining = count
+        self.length = 0
+        self.started = now
+        self.received[:count] = bytes(count)
+
+
+class FrameAssembler:
+    """Reassembles one stream's fragmented frames into a small ring of preallocated buffers.
+
+    Frames map to slots by frame id, so a new frame evicts the
+    incomplete frame `slots` ids older than it. A frame that is still
+    incomplete after `timeout` seconds is abandoned. Frames can complete
+    out of order; putting them back in order is the jitter buffer's job.
+    """
+
+    def __init__(self, slots: int = 4, max_frame: int = MAX_FRAME_SIZE, timeout: float = 0.5):
+        self.timeout = timeout
+        self.max_frame = max_frame
+        self._slots = [_Slot(max_frame) for _ in range(slots)]
+
+        # Counters
+        self.fragments_received = 0
+        self.frames_completed = 0
+        self.frames_lost = 0  # incomplete frames evicted or timed out
+        self.fragments_late = 0  # arrived after their slot was reused
+
+    def add(self, datagram: memoryview,
+            now: Optional[float] = None) -> Optional[Tuple[int, int, memoryview]]:
+        """Feed one fragment datagram.
+
+        Returns (frame id, capture timestamp, frame) once the frame's last
+        fragment arrives. The view points into a reused buffer and is
+        only valid until the slot is reused, so decode or copy it
+        straight away.
+        """
+        if len(datagram) < FRAGMENT_HEADER.size:
+            return None
+        kind, _, frame_id, timestamp, index, count, offset = FRAGMENT_HEADER.unpack_from(datagram, 0)
+        chunk = datagram[FRAGMENT_HEADER.size:]
+        if kind != PKT_FRAGMENT or index >= count or offset + len(chunk) > self.max_frame:
+            return None
+        now = time.monotonic() if now is None else now
+        self.fragments_received += 1
+
+        slot = self._slots[frame_id % len(self._slots)]
+        if slot.frame_id != frame_id:
+            if slot.frame_id is not None and seq_newer(slot.frame_id, frame_id):
+                self.fragments_late += 1  # slot already holds a newer frame
+                return None
+            if slot.remaining:
+                self.frames_lost += 1
+            slot.reset(frame_id, timestamp, count, now)
+        elif not slot.remaining or slot.received[index]:
+            return None  # duplicate
+
+        slot.buffer[offset:offset + len(chunk)] = chunk
+        slot.received[index] = 1
+        slot.remaining -= 1
+        slot.length = max(slot.length, offset + len(chunk))
+        if slot.remaining:
+            self._expire(now)
+            return None
+
+        self.frames_completed += 1
+        return frame_id, slot.timestamp, memoryview(slot.buffer)[:slot.length]
+
+    def _expire(self, now: float):
+        """Abandon frames that have waited too long for missing fragments"""
+        for slot in self._slots:
+            if slot.remaining and now - slot.started > self.timeout:
+                slot.remaining = 0
+                self.frames_lost += 1
+
+    def stats(self) -> dict:
+        return {
+            'fragments_received': self.fragments_received,
+            'frames_completed': self.frames_completed,
+            'frames_lost': self.frames_lost,
+            'fragments_late': self.fragments_late,
+        }
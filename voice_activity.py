@@ -0,0 +1,136 @@
+"""
+Voice Activity Module
+Silence suppression for AudioClient: a voice activity detector on the
+sender and comfort noise on the receiver.
+
+The detector measures each block's energy and zero-crossing rate and
+compares the energy with a running noise floor. Loud blocks are speech.
+Moderately loud blocks count only if they cross zero rarely, like voiced
+speech does, and not if they are hiss-like noise. Speech keeps the
+stream open for a short hangover so word endings aren't clipped. During
+silence nothing is sent except a small comfort noise packet (as in
+RFC 3389) every so often, carrying the background level. The receiver
+plays noise at that level instead of dead air.
+"""
+import math
+import struct
+from typing import Optional
+
+import numpy as np
+
+
+# Datagram kind (alongside audio_stream's PKT_AUDIO)
+PKT_COMFORT_NOISE = 2
+
+# kind, noise level in -dBov (0 = full scale, 127 = silence)
+CN_HEADER = struct.Struct('!BB')
+
+
+def level_dbov(block: np.ndarray) -> float:
+    """RMS level of an int16 block in dB relative to full scale"""
+    samples = block.reshape(-1).astype(np.float32)
+    energy = float(np.dot(samples, samples)) / max(len(samples), 1)
+    return 10 * math.log10(energy / 32768 ** 2 + 1e-13)
+
+
+class VoiceActivityDetector:
+    """Sender side: decides per captured block whether to send it"""
+
+    NOISE_RISE_DB = 0.5  # dB/s the noise floor may climb, so speech barely moves it
+
+    def __init__(self, sample_rate: int, threshold_db: float = 9.0, hangover: float = 0.2,
+                 min_level_db: float = -55.0, voiced_zcr: float = 0.15, cn_interval: float = 0.5):
+        self.sample_rate = sample_rate
+        self.threshold_db = threshold_db  # above the noise floor, a block is speech
+        self.hangover = hangover          # seconds kept open after speech ends
+        self.min_level_db = min_level_db  # quieter than this is never speech
+        self.voiced_zcr = voiced_zcr      # crossings per sample below which a quieter block is voiced
+        self.cn_interval = cn_interval    # seconds between comfort noise packets in silence
+
+        self.noise_db: Optional[float] = None
+        self._hangover_left = 0      # samples
+        self._since_cn: Optional[int] = None  # samples since the last comfort noise packet
+
+        # Counters
+        self.speech_blocks = 0
+        self.silent_blocks = 0
+        self.cn_packets = 0
+
+    def is_speech(self, block: np.ndarray) -> bool:
+        samples = block.reshape(-1)
+        level = level_dbov(samples)
+        crossings = np.count_nonzero(np.diff(np.signbit(samples))) / max(len(samples) - 1, 1)
+
+        # Noise floor: drops straight to any quieter block, climbs slowly
+        seconds = len(samples) / self.sample_rate
+        if self.noise_db is None or level < self.noise_db:
+            self.noise_db = level
+        else:
+            self.noise_db = min(level, self.noise_db + self.NOISE_RISE_DB * seconds)
+
+        margin = level - self.noise_db
+        speech = level > self.min_level_db and (
+            margin > self.threshold_db
+            or (margin > self.threshold_db / 2 and crossings < self.voiced_zcr)
+        )
+        if speech:
+            self._hangover_left = int(self.hangover * self.sample_rate)
+        elif self._hangover_left > 0:
+            self._hangover_left -= len(samples)
+            speech = True
+
+        if speech:
+            self.speech_blocks += 1
+            self._since_cn = None
+        else:
+            self.silent_blocks += 1
+        return speech
+
+    def comfort_noise(self, samples: int) -> Optional[bytes]:
+        """After a silent block of `samples`: a comfort noise packet if one is due"""
+        if self._since_cn is not None and self._since_cn + samples < self.cn_interval * self.sample_rate:
+            self._since_cn += samples
+            return None
+        self._since_cn = 0
+        self.cn_packets += 1
+        return CN_HEADER.pack(PKT_COMFORT_NOISE, min(127, max(0, int(round(-self.noise_db)))))
+
+    def stats(self) -> dict:
+        return {
+            'speech_blocks': self.speech_blocks,
+            'silent_blocks': self.silent_blocks,
+            'comfort_noise_packets': self.cn_packets,
+            'noise_db': None if self.noise_db is None else round(self.noise_db, 1),
+        }
+
+
+class ComfortNoise:
+    """Receiver side: background noise at the level the sender last reported.
+
+    The noise is drawn once into a one-second table and rescaled only
+    when the level changes, so silences cost next to nothing to play.
+    """
+
+    def __init__(self, sample_rate: int):
+        self._unit = np.random.default_rng().standard_normal(sample_rate).astype(np.float32)
+        self._table: Optional[np.ndarray] = None
+        self._pos = 0
+        self.level: Optional[int] = None  # -dBov
+
+    def set_level(self, level: int):
+        if level == self.level:
+            return
+        amplitude = 32767 * 10 ** (-level / 20)
+        self._table = np.clip(self._unit * amplitude, -32768, 32767).astype(np.int16)
+        self.level = level
+
+    def block(self, count: int) -> Optional[np.ndarray]:
+        """`count` samples of noise (a view into the table), or None before any level is known"""
+        if self._table is None:
+            return None
+        count = min(count, len(self._table))
+        if self._pos + count > len(self._table):
+            self._pos = 0
+        start = self._pos
+        self._pos += count
+        return self._table[start:start + count]